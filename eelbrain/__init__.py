@@ -17,15 +17,17 @@ from . import mne_fixes
 
 from ._config import configure
 from ._data_obj import (Datalist, Dataset, Var, Factor, Interaction, Model,
-                        NDVar, Case, Categorial, Scalar, Sensor, UTS,
-                        Celltable, choose, combine, align, align1, cellname,
-                        shuffled_index)
+                        NDVar, LazyNDVar, Case, Categorial, Scalar, Sensor, UTS,
+                        Celltable, Combiner, choose, combine, align, align1,
+                        cellname, shuffled_index)
 from ._experiment import MneExperiment
 from ._mne import labels_from_clusters, morph_source_space
 from ._ndvar import (Butterworth, concatenate, convolve, cross_correlation,
                      cwt_morlet, dss, filter_data, find_intervals, find_peaks,
                      label_operator, neighbor_correlation, resample, segment)
-from ._trf import boosting, BoostingResult
+from ._trf import (
+    boosting, boosting_permutation, boosting_sweep, BoostingCache,
+    BoostingPermutation, BoostingResult, BoostingSweep)
 from ._utils import set_log_level
 from ._utils.com import check_for_update
 
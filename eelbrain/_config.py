@@ -7,6 +7,7 @@ from matplotlib.colors import colorConverter
 
 CONFIG = {
     'n_workers': cpu_count(),
+    'persistent_workers': False,
     'eelbrain': True,
     'autorun': None,
     'show': True,
@@ -19,6 +20,7 @@ CONFIG = {
 
 def configure(
         n_workers=None,
+        persistent_workers=None,
         frame=None,
         autorun=None,
         show=None,
@@ -36,6 +38,11 @@ def configure(
         computations. ``False`` to disable multiprocessing. ``True`` (default)
         to use as many processes as cores are available. Negative numbers to use
         all but n available CPUs.
+    persistent_workers : bool
+        Keep worker processes running between computations (default False).
+        This avoids starting new processes for every permutation test, which
+        reduces the overhead when running many tests in a row. The workers
+        are shut down when the configuration changes or when Python exits.
     frame : bool
         Open figures in the Eelbrain application. This provides additional
         functionality such as copying a figure to the clipboard. If False, open
@@ -82,6 +89,8 @@ def configure(
                 new['n_workers'] = n_workers
         else:
             raise TypeError("n_workers=%r" % (n_workers,))
+    if persistent_workers is not None:
+        new['persistent_workers'] = bool(persistent_workers)
     if frame is not None:
         new['eelbrain'] = bool(frame)
     if autorun is not None:
@@ -101,4 +110,7 @@ def configure(
     if animate is not None:
         new['animate'] = bool(animate)
 
+    if 'n_workers' in new or 'persistent_workers' in new:
+        from ._utils.parallel import shutdown_pool
+        shutdown_pool()
     CONFIG.update(new)
@@ -52,6 +52,7 @@ import operator
 import os
 import re
 import string
+import tempfile
 
 from matplotlib.ticker import (
     FixedLocator, FormatStrFormatter, FuncFormatter, IndexFormatter)
@@ -1236,7 +1237,8 @@ class Celltable(object):
                         self.get_statistic(func=func, a=a, **kwargs)))
 
 
-def combine(items, name=None, check_dims=True, incomplete='raise'):
+def combine(items, name=None, check_dims=True, incomplete='raise',
+            mmap=None):
     """Combine a list of items of the same type into one item.
 
     Parameters
@@ -1258,11 +1260,24 @@ def combine(items, name=None, check_dims=True, incomplete='raise'):
         KeyError to be raised. With ``"drop"``, partially missing variables are
         dropped. With ``"fill in"``, they are retained and missing values are
         filled in with empty values (``""`` for factors, ``NaN`` for variables).
+    mmap : None | True | str
+        Store the data of combined NDVars in a temporary file that is
+        memory-mapped (:class:`numpy.memmap`), instead of in memory. Can be a
+        directory for the temporary files, or ``True`` to use the default
+        temporary directory. The files are deleted automatically when the data
+        are no longer used.
+
+    See Also
+    --------
+    Combiner : combine items incrementally
 
     Notes
     -----
     The info dict inherits only entries that are equal (``x is y or
     np.array_equal(x, y)``) for all items.
+
+    NDVar data are copied into a single array that is allocated before
+    copying, so that no intermediate copies of the combined data are made.
     """
     if not isinstance(incomplete, basestring):
         raise TypeError("incomplete=%s, need str" % repr(incomplete))
@@ -1274,7 +1289,10 @@ def combine(items, name=None, check_dims=True, incomplete='raise'):
         items = tuple(items)
     if len(items) == 0:
         raise ValueError("combine() called with empty sequence %s" % repr(items))
+    return _combine(items, name, check_dims, incomplete, mmap)
+
 
+def _combine(items, name, check_dims, incomplete, mmap):
     # find type
     first_item = items[0]
     if isinstance(first_item, Number):
@@ -1310,7 +1328,7 @@ def combine(items, name=None, check_dims=True, incomplete='raise'):
             for key in keys:
                 pieces = [ds[key] if key in ds else
                           _empty_like(sample[key], ds.n_cases) for ds in items]
-                out[key] = combine(pieces, check_dims=check_dims)
+                out[key] = _combine(pieces, None, check_dims, incomplete, mmap)
         else:
             keys = set(first_item)
             if incomplete == 'raise':
@@ -1318,13 +1336,14 @@ def combine(items, name=None, check_dims=True, incomplete='raise'):
                     raise KeyError("Datasets have unequal keys. Use with "
                                    "incomplete='drop' or incomplete='fill in' "
                                    "to combine anyways.")
-                out_keys = first_item
+                out_keys = first_item.keys()
             else:
                 keys.intersection_update(*items[1:])
-                out_keys = (k for k in first_item if k in keys)
+                out_keys = [k for k in first_item if k in keys]
 
             for key in out_keys:
-                out[key] = combine([ds[key] for ds in items])
+                pieces = [ds[key] for ds in items]
+                out[key] = _combine(pieces, None, True, incomplete, mmap)
         return out
     elif stype is Var:
         x = np.hstack(i.x for i in items)
@@ -1355,26 +1374,365 @@ def combine(items, name=None, check_dims=True, incomplete='raise'):
 
         dims = reduce(lambda x, y: intersect_dims(x, y, check_dims), all_dims)
         idx = {d.name: d for d in dims}
-        # reduce data to common dimension range
-        sub_items = []
-        for item in items:
+        info = merge_info(items)
+        # allocate output
+        if has_case:
+            n_cases = [len(item) for item in items]
+        else:
+            n_cases = [1] * len(items)
+        shape = (sum(n_cases),) + tuple(len(dim) for dim in dims)
+        dtype = np.result_type(*(item._dtype for item in items))
+        x = _allocate(shape, dtype, mmap)
+        # copy data, reduced to common dimension range
+        start = 0
+        for item, n in izip(items, n_cases):
+            stop = start + n
             if item.dims[has_case:] == dims:
-                sub_items.append(item)
+                item_x = item._read((FULL_SLICE,) * item.ndim)
             else:
-                sub_items.append(item.sub(**idx))
-        # combine data
-        if has_case:
-            x = np.concatenate([v.x for v in sub_items], axis=0)
-        else:
-            x = np.array([v.x for v in sub_items])
-        dims = ('case',) + dims
-        return NDVar(x, dims, merge_info(sub_items), name)
+                item_x = item.sub(**idx).x
+            if has_case:
+                x[start:stop] = item_x
+            else:
+                x[start] = item_x
+            start = stop
+            del item, item_x
+        return NDVar(x, ('case',) + dims, info, name)
     elif stype is Datalist:
         return Datalist(sum(items, []), name, items[0]._fmt)
     else:
         raise RuntimeError("combine with stype = %r" % stype)
 
 
+def _temporary_file(mmap):
+    "Temporary file for memory-mapped data (see ``mmap`` in :func:`combine`)"
+    return tempfile.TemporaryFile(dir=None if mmap is True else mmap)
+
+
+def _allocate(shape, dtype, mmap):
+    "Allocate an array, memory-mapped to a temporary file if ``mmap``"
+    if mmap is None or mmap is False or 0 in shape:
+        return np.empty(shape, dtype)
+    # the file is deleted when the memmap is closed
+    return np.memmap(_temporary_file(mmap), dtype, 'w+', shape=shape)
+
+
+def _outer_index(dims, sub_dims):
+    "Index of the elements of ``sub_dims`` in ``dims`` for :func:`numpy.ix_`"
+    out = []
+    for dim, sub_dim in izip(dims, sub_dims):
+        index = dim._array_index(sub_dim)
+        if isinstance(index, slice):
+            index = np.arange(len(dim))[index]
+        elif isinstance(index, np.ndarray) and index.dtype.kind == 'b':
+            index = np.flatnonzero(index)
+        out.append(np.asarray(index))
+    return out
+
+
+class _NDVarStore(object):
+    """Copies of the data of NDVars that are combined by :class:`Combiner`
+
+    Data are stored with the dimensions of the first NDVar; elements missing
+    from later NDVars are removed when the data are retrieved.
+    """
+    def __init__(self, ndvar, check_dims, n_cases, mmap):
+        self.has_case = ndvar.has_case
+        self.dims = self.common_dims = ndvar.dims[self.has_case:]
+        self.shape = tuple(len(dim) for dim in self.dims)
+        self.dtype = ndvar._dtype
+        self.check_dims = check_dims
+        self.mmap = mmap
+        self.info = dict(ndvar.info)
+        self.names = []
+        self.n = 0
+        self._x = self._file = self._chunks = None
+        if n_cases is not None:
+            self._x = _allocate((n_cases,) + self.shape, self.dtype, mmap)
+        elif mmap is not None and mmap is not False:
+            self._file = _temporary_file(mmap)
+        else:
+            self._chunks = []
+
+    def append(self, ndvar):
+        if not isinstance(ndvar, NDVar):
+            raise TypeError("All items to be combined need to have the same "
+                            "type, got %r" % (ndvar,))
+        elif ndvar.has_case != self.has_case:
+            raise DimensionMismatchError("Some items have a 'case' dimension, "
+                                         "others do not")
+        dims = ndvar.dims[self.has_case:]
+        if dims == self.dims:
+            x = ndvar._read((FULL_SLICE,) * ndvar.ndim)
+            if not self.has_case:
+                x = x[newaxis]
+        else:
+            dims = intersect_dims(self.dims, dims, self.check_dims)
+            x = ndvar.sub(**{dim.name: dim for dim in dims}).x
+            if not self.has_case:
+                x = x[newaxis]
+            if dims != self.dims:
+                # fill in elements that are missing from ndvar
+                x_ = np.zeros((len(x),) + self.shape, x.dtype)
+                index = _outer_index(self.dims, dims)
+                x_[np.ix_(np.arange(len(x)), *index)] = x
+                x = x_
+                self.common_dims = intersect_dims(self.common_dims, dims,
+                                                  self.check_dims)
+        self._write(x)
+        self.info = merge_info((self, ndvar))
+        self.names.append(ndvar.name)
+
+    def append_empty(self, n):
+        "Add ``n`` cases filled with NaN"
+        x = np.empty((n,) + self.shape, self.dtype)
+        x.fill(np.nan)
+        self._write(x)
+
+    def _write(self, x):
+        if self._chunks is None and not np.can_cast(x.dtype, self.dtype):
+            raise TypeError("Can not combine NDVar data of type %s with data "
+                            "of type %s" % (x.dtype, self.dtype))
+        start = self.n
+        self.n += len(x)
+        if self._x is not None:
+            if self.n > len(self._x):
+                raise ValueError("Combiner: more than n_cases=%i cases" %
+                                 len(self._x))
+            self._x[start:self.n] = x
+        elif self._file is not None:
+            np.ascontiguousarray(x, self.dtype).tofile(self._file)
+        else:
+            self._chunks.append(x)
+
+    def get(self, name=None):
+        shape = (self.n,) + self.shape
+        if self._x is not None:
+            if self.n < len(self._x):
+                x = self._x[:self.n]
+            else:
+                x = self._x
+        elif self._file is not None:
+            self._file.flush()
+            if 0 in shape:
+                x = np.empty(shape, self.dtype)
+            else:
+                x = np.memmap(self._file, self.dtype, 'r+', shape=shape)
+            # the memmap keeps the data accessible
+            self._file.close()
+        else:
+            x = np.empty(shape, np.result_type(*self._chunks))
+            start = 0
+            while self._chunks:
+                chunk = self._chunks.pop(0)
+                x[start:start + len(chunk)] = chunk
+                start += len(chunk)
+        self._x = self._file = self._chunks = None
+
+        # remove elements that are missing from some NDVars
+        if self.common_dims != self.dims:
+            index = _outer_index(self.dims, self.common_dims)
+            shape = (self.n,) + tuple(map(len, index))
+            x_ = _allocate(shape, x.dtype, self.mmap)
+            for start in xrange(0, self.n, 100):
+                stop = min(start + 100, self.n)
+                x_[start:stop] = x[np.ix_(np.arange(start, stop), *index)]
+            x = x_
+
+        if name is None:
+            name = os.path.commonprefix(filter(None, self.names)) or None
+        return NDVar(x, ('case',) + self.common_dims, self.info, name)
+
+
+class Combiner(object):
+    """Combine data-objects incrementally
+
+    Parameters
+    ----------
+    name : None | str
+        Name for the combined data-object (see :func:`combine`).
+    check_dims : bool
+        For NDVars, check dimensions for consistency between items (see
+        :func:`combine`).
+    incomplete : "raise" | "drop" | "fill in"
+        How to handle variables that are missing from some of the Datasets
+        (see :func:`combine`).
+    mmap : None | True | str
+        Store the data of NDVars in a memory-mapped temporary file (see
+        :func:`combine`).
+    n_cases : int
+        Total number of cases of the combined item, if known in advance. The
+        data of NDVars are then copied to a single preallocated array.
+
+    See Also
+    --------
+    combine : combine a sequence of items
+
+    Notes
+    -----
+    Items are added with :meth:`append` as they become available, and the
+    combined item is retrieved with :meth:`get`. The data of NDVars are
+    copied when an item is added, so that the added item can be released:
+
+     - With ``n_cases``, the data are copied to a preallocated array (in a
+       memory-mapped file with ``mmap``). Combining requires memory for the
+       combined data only.
+     - With ``mmap`` (and without ``n_cases``), the data are appended to a
+       memory-mapped file. Combining requires memory for one item.
+     - Otherwise, the data are kept in memory as separate arrays and are
+       copied to a single array by :meth:`get`, which can temporarily require
+       twice the memory of the combined data.
+
+    NDVar data are stored with the dimensions of the first NDVar; when
+    later NDVars lack some elements (e.g., sensors), these elements are
+    removed by :meth:`get`, which then requires an additional copy of the
+    combined data.
+
+    Examples
+    --------
+    Combine the data of several subjects::
+
+        combiner = Combiner(mmap=True)
+        for subject in subjects:
+            combiner.append(load_subject(subject))
+        ds = combiner.get()
+    """
+    def __init__(self, name=None, check_dims=True, incomplete='raise',
+                 mmap=None, n_cases=None):
+        if incomplete not in ('raise', 'drop', 'fill in'):
+            raise ValueError("incomplete=%s" % repr(incomplete))
+        self.name = name
+        self.check_dims = check_dims
+        self.incomplete = incomplete
+        self.mmap = mmap
+        self.n_cases = n_cases
+        self._reset()
+
+    def _reset(self):
+        self._type = None
+        self._item_n_cases = []
+        self._items = []  # Var, Factor and Datalist items
+        self._store = None  # NDVar items
+        self._columns = OrderedDict()  # Dataset items
+        self._keys = None
+        self._dropped = set()
+        self._info = None
+        self._names = []
+
+    def __len__(self):
+        return len(self._item_n_cases)
+
+    def __repr__(self):
+        return "<Combiner: %i items>" % len(self)
+
+    def append(self, item):
+        """Add an item
+
+        Parameters
+        ----------
+        item : Dataset | Var | Factor | NDVar | Datalist
+            The item. The data of NDVars are copied, so the item can be
+            released after it is added.
+        """
+        if not isdatacontainer(item):
+            raise TypeError("Can only combine data-objects, got %r" % (item,))
+        stype = NDVar if isinstance(item, NDVar) else type(item)
+        if self._type is None:
+            self._type = stype
+        elif stype is not self._type:
+            raise TypeError("All items to be combined need to have the same "
+                            "type, got %s and %s" % (self._type, type(item)))
+
+        if stype is Dataset:
+            self._append_dataset(item)
+            n = item.n_cases
+        elif stype is NDVar:
+            if self._store is None:
+                self._store = _NDVarStore(item, self.check_dims, self.n_cases,
+                                          self.mmap)
+            self._store.append(item)
+            n = len(item) if item.has_case else 1
+        else:
+            self._items.append(item)
+            n = len(item)
+        self._item_n_cases.append(n)
+
+    def _append_dataset(self, ds):
+        n_previous = sum(self._item_n_cases)
+        n = ds.n_cases
+        if self._keys is None:
+            self._keys = ds.keys()
+            self._info = dict(ds.info)
+        else:
+            if self.incomplete == 'raise' and set(ds) != set(self._keys):
+                raise KeyError("Datasets have unequal keys. Use with "
+                               "incomplete='drop' or incomplete='fill in' "
+                               "to combine anyways.")
+            self._info = merge_info((Dataset(info=self._info), ds))
+        self._names.append(ds.name)
+
+        # variables missing from ds
+        for key in [key for key in self._columns if key not in ds]:
+            if self.incomplete == 'drop':
+                del self._columns[key]
+                self._dropped.add(key)
+            elif isinstance(self._columns[key], _NDVarStore):
+                self._columns[key].append_empty(n)
+            else:
+                self._columns[key].append(None)
+
+        for key, value in ds.iteritems():
+            if key in self._dropped:
+                continue
+            elif key not in self._columns:
+                if n_previous and self.incomplete == 'drop':
+                    self._dropped.add(key)
+                    continue
+                elif isinstance(value, NDVar):
+                    column = _NDVarStore(value, self.check_dims, self.n_cases,
+                                         self.mmap)
+                    if n_previous:
+                        column.append_empty(n_previous)
+                else:
+                    column = [None] * len(self._item_n_cases)
+                self._columns[key] = column
+            self._columns[key].append(value)
+
+    def get(self):
+        """Combine the items that were added and reset the :class:`Combiner`
+
+        Returns
+        -------
+        item : Dataset | Var | Factor | NDVar | Datalist
+            Combination of all items that were added with :meth:`append`.
+        """
+        if not self._item_n_cases:
+            raise RuntimeError("Combiner.get() called without items")
+
+        if self._type is Dataset:
+            name = self.name
+            if name is None:
+                name = os.path.commonprefix(filter(None, self._names)) or None
+            out = Dataset(name=name, info=self._info)
+            for key, column in self._columns.iteritems():
+                if isinstance(column, _NDVarStore):
+                    out[key] = column.get()
+                    continue
+                # fill in missing pieces
+                sample = next(piece for piece in column if piece is not None)
+                pieces = [_empty_like(sample, n) if piece is None else piece
+                          for piece, n in izip(column, self._item_n_cases)]
+                out[key] = _combine(pieces, None, self.check_dims,
+                                    self.incomplete, None)
+        elif self._type is NDVar:
+            out = self._store.get(self.name)
+        else:
+            out = _combine(self._items, self.name, self.check_dims,
+                           self.incomplete, None)
+        self._reset()
+        return out
+
+
 def find_factors(obj):
     "Return the list of all factors contained in obj"
     if isinstance(obj, EffectList):
@@ -1422,6 +1780,176 @@ class EffectList(list):
         return [UNNAMED if n is None else n for n in names]
 
 
+class CellGroups(object):
+    """Cases grouped by the cells of a categorial model
+
+    Cases are sorted by cell once (with a stable sort, so that cases keep their
+    order within each cell), so that data for each cell can be summarized
+    from a contiguous segment.
+
+    Parameters
+    ----------
+    x : categorial
+        Model defining the cells.
+
+    Attributes
+    ----------
+    cells : list
+        Non-empty cells (in the order of ``x.cells``).
+    counts : array of int
+        Number of cases in each cell.
+    starts : array of int
+        Start of each cell in data sorted by cell.
+    order : None | array of int
+        Index to sort data by cell (``None`` if data are already sorted).
+
+    Notes
+    -----
+    Since cases keep their order within each cell, ``order`` also works as an
+    inverted index from cells to sorted case indices (see :meth:`index`).
+    """
+    def __init__(self, x):
+        codes = self._cell_codes(x)
+        cells = self._cells(x)
+        if len(codes):
+            counts = np.bincount(codes, minlength=len(cells))
+        else:
+            counts = np.zeros(len(cells), np.intp)
+        nonempty = np.flatnonzero(counts)
+        self.cells = [cells[i] for i in nonempty]
+        self.counts = counts[nonempty]
+        self.starts = np.cumsum(self.counts) - self.counts
+        if np.any(codes[1:] < codes[:-1]):
+            self.order = np.argsort(codes, kind='mergesort')
+        else:
+            self.order = None
+        self.n_cases = len(codes)
+        self._cell_index = {cell: i for i, cell in enumerate(self.cells)}
+
+    @staticmethod
+    def _cells(x):
+        "Cells corresponding to the codes from :meth:`_cell_codes`"
+        if isinstance(x, Interaction) and all(isinstance(f, Factor) for f in
+                                              x.base):
+            # x.cells is not updated when base Factors are modified
+            return list(itertools.product(*(f.cells for f in x.base)))
+        return x.cells
+
+    @staticmethod
+    def _cell_codes(x):
+        "Index into ``x.cells`` for each case"
+        if isinstance(x, Factor):
+            lut = np.zeros(max(x._labels) + 1 if x._labels else 0, np.intp)
+            lut[x._labels.keys()] = np.arange(len(x._labels))
+            return lut[x.x]
+        elif isinstance(x, Interaction) and all(isinstance(f, Factor) for f in
+                                                x.base):
+            return np.ravel_multi_index([CellGroups._cell_codes(f) for f in
+                                         x.base],
+                                        [len(f.cells) for f in x.base])
+        codes = np.empty(len(x), np.intp)
+        for i, cell in enumerate(x.cells):
+            codes[x == cell] = i
+        return codes
+
+    def __len__(self):
+        return self.n_cases
+
+    def __iter__(self):
+        "Index of the cases in each cell"
+        if self.order is None:
+            for start, n in izip(self.starts, self.counts):
+                yield slice(start, start + n)
+        else:
+            for start, n in izip(self.starts, self.counts):
+                yield self.order[start:start + n]
+
+    def _segment(self, cell):
+        "Index of ``cell`` into data sorted by cell (None for empty cells)"
+        i = self._cell_index.get(cell)
+        if i is None:
+            return None
+        start = self.starts[i]
+        return slice(start, start + self.counts[i])
+
+    def index(self, cell):
+        "Sorted indices of the cases in ``cell``"
+        segment = self._segment(cell)
+        if segment is None:
+            return np.empty(0, np.intp)
+        elif self.order is None:
+            return np.arange(segment.start, segment.stop)
+        return self.order[segment].copy()
+
+    def mask(self, cells):
+        "Boolean index that is ``True`` for cases in any of ``cells``"
+        out = np.zeros(self.n_cases, bool)
+        for cell in cells:
+            segment = self._segment(cell)
+            if segment is None:
+                continue
+            elif self.order is None:
+                out[segment] = True
+            else:
+                out[self.order[segment]] = True
+        return out
+
+    def apply(self, x, func, **kwargs):
+        "Apply ``func`` to the data in each cell (list of results)"
+        x = self.sort(x)
+        return [func(x[start:start + n], **kwargs) for start, n in
+                izip(self.starts, self.counts)]
+
+    def _divide(self, x):
+        "Divide by the number of cases in each cell"
+        shape = (-1,) + (1,) * (x.ndim - 1)
+        return np.true_divide(x, self.counts.reshape(shape))
+
+    def mean(self, x):
+        "Mean in each cell (along the first axis, like :func:`numpy.mean`)"
+        if x.dtype.kind in 'biu':
+            x = x.astype(np.float64)
+        return self._divide(self.sum(x))
+
+    def _reduce(self, x):
+        # same dtype as np.sum() (reduceat() does not upcast bool and small int)
+        dtype = np.sum(x[:0], 0).dtype
+        if not len(self.starts):
+            return np.zeros((0,) + x.shape[1:], dtype)
+        return np.add.reduceat(x, self.starts, 0, dtype)
+
+    def sort(self, x):
+        "Sort data by cell (along the first axis)"
+        if self.order is None:
+            return x
+        return x[self.order]
+
+    def std(self, x):
+        "Standard deviation in each cell (like :func:`numpy.std`)"
+        if x.dtype.kind in 'biu':
+            x = x.astype(np.float64)
+        x = self.sort(x)
+        mean = self._divide(self._reduce(x))
+        dev = x - np.repeat(mean, self.counts, 0)
+        np.multiply(dev, dev, dev)
+        return np.sqrt(self._divide(self._reduce(dev)))
+
+    def sum(self, x):
+        "Sum in each cell (along the first axis)"
+        return self._reduce(self.sort(x))
+
+
+def cell_groups(x):
+    "Group cases by the cells of ``x`` (see :class:`CellGroups`)"
+    if isinstance(x, CellGroups):
+        return x
+    elif isinstance(x, _Effect):
+        groups = x._cell_groups()
+        if groups is not None:
+            return groups
+    return CellGroups(x)
+
+
 class Var(object):
     """Container for scalar data.
 
@@ -1911,16 +2439,9 @@ class Var(object):
             err = "Length mismatch: %i (Var) != %i (X)" % (len(self), len(X))
             raise ValueError(err)
 
-        x = []
-        for cell in X.cells:
-            x_cell = self.x[X == cell]
-            if len(x_cell) > 0:
-                x.append(func(x_cell))
-
+        x = np.array(cell_groups(X).apply(self.x, func))
         if name is True:
             name = self.name
-
-        x = np.array(x)
         return Var(x, name, info=self.info.copy())
 
     @property
@@ -2231,6 +2752,10 @@ class _Effect(object):
             counts[value] += 1
         return Var(enum, name)
 
+    def _cell_groups(self):
+        "Cached :class:`CellGroups` (None if not supported)"
+        return None
+
     def index(self, cell):
         """Array with ``int`` indices equal to ``cell``
 
@@ -2245,7 +2770,10 @@ class _Effect(object):
         >>> f
         Factor(['a', 'new_b', 'c', 'a', 'new_b', 'c', 'a', 'new_b', 'c'])
         """
-        return np.flatnonzero(self == cell)
+        groups = self._cell_groups()
+        if groups is None:
+            return np.flatnonzero(self == cell)
+        return groups.index(cell)
 
     def index_opt(self, cell):
         """Find an optimized index for a given cell.
@@ -2256,7 +2784,7 @@ class _Effect(object):
             If possible, a ``slice`` object is returned. Otherwise, an array
             of indices (as with ``e.index(cell)``).
         """
-        index = np.flatnonzero(self == cell)
+        index = self.index(cell)
         d_values = np.unique(np.diff(index))
         if len(d_values) == 1:
             start = index.min() or None
@@ -2286,21 +2814,31 @@ class _Effect(object):
         sort_index : array of int
             Array which can be used to sort a data_object in the desired order.
         """
-        idx = np.empty(len(self), dtype=np.intp)
-        if order is None:
-            cells = self.cells
-        else:
-            cells = order
-            idx.fill(-1)
+        groups = self._cell_groups()
+        if groups is not None and order is None:
+            if groups.order is None:
+                sort_idx = np.arange(len(self))
+            else:
+                sort_idx = groups.order.copy()
+        elif groups is not None and len(set(order)) == len(order):
+            sort_idx = np.concatenate([groups.index(cell) for cell in order] +
+                                      [np.empty(0, np.intp)])
+        else:
+            idx = np.empty(len(self), dtype=np.intp)
+            if order is None:
+                cells = self.cells
+            else:
+                cells = order
+                idx.fill(-1)
 
-        for i, cell in enumerate(cells):
-            idx[self == cell] = i
+            for i, cell in enumerate(cells):
+                idx[self == cell] = i
 
-        sort_idx = np.argsort(idx, kind='mergesort')
-        if order is not None:
-            excluded = np.count_nonzero(idx == -1)
-            if excluded:
-                sort_idx = sort_idx[excluded:]
+            sort_idx = np.argsort(idx, kind='mergesort')
+            if order is not None:
+                excluded = np.count_nonzero(idx == -1)
+                if excluded:
+                    sort_idx = sort_idx[excluded:]
 
         if descending:
             if not isinstance(descending, bool):
@@ -2464,6 +3002,7 @@ class Factor(_Effect):
             self._labels = OrderedDict([(codes[label], label) for label in cells])
 
         self._n_cases = len(x)
+        self._groups = None
 
     def __getstate__(self):
         state = {'x': self.x,
@@ -2528,6 +3067,7 @@ class Factor(_Effect):
         # obliterate redundant labels
         for code in set(self._labels).difference(self.x):
             del self._codes[self._labels.pop(code)]
+        self._groups = None
 
     def _get_code(self, label):
         "Add the label if it does not exists and return its code"
@@ -2553,11 +3093,25 @@ class Factor(_Effect):
 
     # numeric ---
     def __eq__(self, other):
+        if isinstance(other, basestring):
+            return self._cell_groups().mask((other,))
         return self.x == self._encode(other)
 
     def __ne__(self, other):
+        if isinstance(other, basestring):
+            return ~self._cell_groups().mask((other,))
         return self.x != self._encode(other)
 
+    def _cell_groups(self):
+        """Inverted index from cells to cases (:class:`CellGroups`)
+
+        The index is built on first use and discarded when ``x`` is replaced
+        or modified through item assignment.
+        """
+        if self._groups is None or self._groups[0] is not self.x:
+            self._groups = (self.x, CellGroups(self))
+        return self._groups[1]
+
     def _encode(self, x):
         if isinstance(x, basestring):
             return self._codes.get(x, -1)
@@ -2629,13 +3183,10 @@ class Factor(_Effect):
 
     def _cellsize(self):
         "-1 if cell size is not equal"
-        codes = self._labels.keys()
-        buf = self.x == codes[0]
-        n = buf.sum()
-        for code in codes[1:]:
-            n_ = np.equal(self.x, code, buf).sum()
-            if n_ != n:
-                return -1
+        counts = self._cell_groups().counts
+        n = counts[0]
+        if np.any(counts[1:] != n):
+            return -1
         return n
 
     def aggregate(self, X, name=True):
@@ -2661,21 +3212,22 @@ class Factor(_Effect):
             err = "Length mismatch: %i (Var) != %i (X)" % (len(self), len(X))
             raise ValueError(err)
 
-        x = []
-        for cell in X.cells:
-            idx = (X == cell)
-            if np.sum(idx):
-                x_i = np.unique(self.x[idx])
-                if len(x_i) > 1:
-                    labels = tuple(self._labels[code] for code in x_i)
-                    err = ("Can not determine aggregated value for Factor %r "
-                           "in cell %r because the cell contains multiple "
-                           "values %r. Set drop_bad=True in order to ignore "
-                           "this inconsistency and drop the Factor."
-                           % (self.name, cell, labels))
-                    raise ValueError(err)
-                else:
-                    x.append(x_i[0])
+        groups = cell_groups(X)
+        x_sorted = groups.sort(self.x)
+        x = x_sorted[groups.starts]
+        is_bad = np.repeat(x, groups.counts) != x_sorted
+        if np.any(is_bad):
+            i_cell = np.searchsorted(groups.starts, np.flatnonzero(is_bad)[0],
+                                     'right') - 1
+            start = groups.starts[i_cell]
+            x_i = np.unique(x_sorted[start:start + groups.counts[i_cell]])
+            labels = tuple(self._labels[code] for code in x_i)
+            err = ("Can not determine aggregated value for Factor %r "
+                   "in cell %r because the cell contains multiple "
+                   "values %r. Set drop_bad=True in order to ignore "
+                   "this inconsistency and drop the Factor."
+                   % (self.name, groups.cells[i_cell], labels))
+            raise ValueError(err)
 
         if name is True:
             name = self.name
@@ -2838,7 +3390,9 @@ class Factor(_Effect):
         >>> f.isin(('b', 'c'))
         array([False, False,  True,  True,  True,  True], dtype=bool)
         """
-        return np.in1d(self.x, self._encode(values))
+        if isinstance(values, basestring):
+            values = (values,)
+        return self._cell_groups().mask(values)
 
     def isnot(self, *values):
         """Find the index of entries not in ``values``
@@ -2858,7 +3412,7 @@ class Factor(_Effect):
         index : array of bool
             For each case False if the value is in values, else True.
         """
-        return np.in1d(self.x, self._encode(values), invert=True)
+        return ~self.isin(values)
 
     def label_length(self, name=None):
         """Create Var with the length of each label string
@@ -2943,6 +3497,7 @@ class Factor(_Effect):
 
         self._labels = new_labels
         self._codes = {l: c for c, l in new_labels.iteritems()}
+        self._groups = None
 
     def startswith(self, substr):
         """An index that is true for all cases whose name starts with ``substr``
@@ -3051,43 +3606,9 @@ class NDVar(object):
 
     """
     def __init__(self, x, dims, info={}, name=None):
-        # check data shape
-        if (isinstance(dims, Dimension) or dims is Case or
-                isinstance(dims, basestring)):
-            dims_ = [dims]
-        else:
-            dims_ = list(dims)
-
         x = np.asarray(x)
-        if len(dims_) != x.ndim:
-            raise DimensionMismatchError(
-                "Unequal number of dimensions (data: %i, dims: %i)" %
-                (x.ndim, len(dims_)))
-
-        first_dim = dims_[0]
-        if first_dim is Case or (isinstance(first_dim, basestring) and
-                                 first_dim == 'case'):
-            dims_[0] = Case(len(x))
-
-        if not all(isinstance(dim, Dimension) for dim in dims_):
-            raise TypeError(
-                "Invalid dimension in dims=%r. All dimensions need to be "
-                "Dimension subclass objects, with the exception of the "
-                "first dimension which can also be 'case'" % (dims,))
-        elif any(isinstance(dim, Case) for dim in dims_[1:]):
-            raise TypeError(
-                "Invalid dimension in dims=%r. Only the first dimension can be "
-                "Case." % (dims,))
-
-        # check dimensions
-        for dim, n in zip(dims_, x.shape):
-            if len(dim) != n:
-                raise DimensionMismatchError(
-                    "Dimension %r length mismatch: %i in data, %i in dimension "
-                    "%r" % (dim.name, n, len(dim), dim.name))
-
         self.x = x
-        self.dims = tuple(dims_)
+        self.dims = _ndvar_dims(dims, x.shape)
         self.info = dict(info)
         self.name = name
         self._init_secondary()
@@ -3097,7 +3618,7 @@ class NDVar(object):
         self._truedims = self.dims[self.has_case:]
         self.dimnames = tuple(dim.name for dim in self.dims)
         self.ndim = len(self.dims)
-        self.shape = self.x.shape
+        self.shape = tuple(len(dim) for dim in self.dims)
         self._dim_2_ax = dict(izip(self.dimnames, xrange(self.ndim)))
         # Dimension attributes
         for dim in self._truedims:
@@ -3354,7 +3875,7 @@ class NDVar(object):
         "Convert ravelled array index to dimension index"
         if self.ndim == 1:
             return self.dims[0]._dim_index(index)
-        return self._dim_index(np.unravel_index(index, self.x.shape))
+        return self._dim_index(np.unravel_index(index, self.shape))
 
     def _dim_index(self, index):
         "Convert array index to dimension index"
@@ -3374,7 +3895,7 @@ class NDVar(object):
         self.x[self._array_index(key)] = value
 
     def __len__(self):
-        return len(self.x)
+        return self.shape[0]
 
     def __iter__(self):
         dim = self.dims[0]
@@ -3549,6 +4070,11 @@ class NDVar(object):
         -------
         aggregated_ndvar : NDVar
             NDVar with data aggregated over cells of ``X``.
+
+        Notes
+        -----
+        With ``numpy.mean``, ``numpy.sum`` and ``numpy.std``, all cells are
+        summarized at once; other functions are called for each cell.
         """
         if not self.has_case:
             raise DimensionMismatchError("%r has no case dimension" % self)
@@ -3556,13 +4082,15 @@ class NDVar(object):
             err = "Length mismatch: %i (Var) != %i (X)" % (len(self), len(X))
             raise ValueError(err)
 
-        x = []
-        for cell in X.cells:
-            idx = (X == cell)
-            if np.sum(idx):
-                x_cell = self.x[idx]
-                x.append(func(x_cell, axis=0))
-        x = np.array(x)
+        groups = cell_groups(X)
+        if self.ndim > 1 and func is np.mean:
+            x = groups.mean(self.x)
+        elif self.ndim > 1 and func is np.sum:
+            x = groups.sum(self.x)
+        elif self.ndim > 1 and func is np.std:
+            x = groups.std(self.x)
+        else:
+            x = np.array(groups.apply(self.x, func, axis=0))
 
         # update info for summary
         info = self.info.copy()
@@ -4337,6 +4865,15 @@ class NDVar(object):
         else:
             return NDVar(x, dims, info, name)
 
+    @property
+    def _dtype(self):
+        "Data type (without reading the data of lazy NDVars)"
+        return self.x.dtype
+
+    def _read(self, index):
+        "Data for an array index (lazy NDVars only read the required data)"
+        return self.x[index]
+
     def repeat(self, repeats, name=None):
         """Repeat slices of the NDVar along the case dimension
 
@@ -4700,7 +5237,7 @@ class NDVar(object):
                 idx = index[i]
                 if ndim_increment and isinstance(idx, (slice, np.ndarray)):
                     if isinstance(idx, slice):
-                        idx = slice_to_arange(idx, self.x.shape[i])
+                        idx = slice_to_arange(idx, self.shape[i])
                     elif idx.dtype.kind == 'b':
                         idx = np.flatnonzero(idx)
                     index[i] = idx[FULL_AXIS_SLICE + (None,) * ndim_increment]
@@ -4710,8 +5247,8 @@ class NDVar(object):
 
         # create NDVar
         return self._package_aggregated_output(
-            self.x[tuple(index)], tuple(dim for dim in dims if dim is not None),
-            info, var_name)
+            self._read(tuple(index)),
+            tuple(dim for dim in dims if dim is not None), info, var_name)
 
     def sum(self, dims=(), **regions):
         """Compute the sum over given dimensions
@@ -4808,6 +5345,130 @@ class NDVar(object):
                      izip(self.dims, self.x.nonzero()))
 
 
+def _ndvar_dims(dims, shape):
+    "Check NDVar ``dims`` for data of ``shape``"
+    if (isinstance(dims, Dimension) or dims is Case or
+            isinstance(dims, basestring)):
+        dims_ = [dims]
+    else:
+        dims_ = list(dims)
+
+    if len(dims_) != len(shape):
+        raise DimensionMismatchError(
+            "Unequal number of dimensions (data: %i, dims: %i)" %
+            (len(shape), len(dims_)))
+
+    first_dim = dims_[0]
+    if first_dim is Case or (isinstance(first_dim, basestring) and
+                             first_dim == 'case'):
+        dims_[0] = Case(shape[0])
+
+    if not all(isinstance(dim, Dimension) for dim in dims_):
+        raise TypeError(
+            "Invalid dimension in dims=%r. All dimensions need to be "
+            "Dimension subclass objects, with the exception of the "
+            "first dimension which can also be 'case'" % (dims,))
+    elif any(isinstance(dim, Case) for dim in dims_[1:]):
+        raise TypeError(
+            "Invalid dimension in dims=%r. Only the first dimension can be "
+            "Case." % (dims,))
+
+    # check dimensions
+    for dim, n in zip(dims_, shape):
+        if len(dim) != n:
+            raise DimensionMismatchError(
+                "Dimension %r length mismatch: %i in data, %i in dimension "
+                "%r" % (dim.name, n, len(dim), dim.name))
+    return tuple(dims_)
+
+
+class LazyNDVar(NDVar):
+    """NDVar whose data are read from a source only when they are needed
+
+    Parameters
+    ----------
+    source : array_like
+        Source of the data. Needs a ``shape`` attribute and needs to return
+        the data as array when indexed with a tuple containing one slice per
+        dimension (with ``0 <= start <= stop <= n`` and step ``None``). An
+        optional ``dtype`` attribute indicates the data type of the data
+        (default ``float64``). Arrays (including :class:`numpy.memmap`) are
+        indexed directly.
+    dims : sequence of Dimension
+        Dimensions (see :class:`NDVar`).
+    info : dict
+        Info dictionary.
+    name : str
+        Name.
+
+    Notes
+    -----
+    Indexing (:meth:`~NDVar.sub` and ``ndvar[...]``) and aggregating over
+    regions (e.g., ``ndvar.mean(time=(0.1, 0.2))``) only read the part of the
+    data that is needed, and return a regular :class:`NDVar`. Any other
+    access to :attr:`x` reads all data, after which the object is equivalent
+    to a regular :class:`NDVar`.
+    """
+    def __init__(self, source, dims, info={}, name=None):
+        self._source = source
+        self._x = None
+        self.dims = _ndvar_dims(dims, source.shape)
+        self.info = dict(info)
+        self.name = name
+        self._init_secondary()
+
+    @property
+    def x(self):
+        if self._x is None:
+            self._x = np.asarray(self._read((FULL_SLICE,) * self.ndim))
+            self._source = None
+        return self._x
+
+    @x.setter
+    def x(self, x):
+        self._x = x
+        self._source = None
+
+    def __reduce__(self):
+        return NDVar, (self.x, self.dims, self.info, self.name)
+
+    @property
+    def _dtype(self):
+        if self._x is not None:
+            return self._x.dtype
+        return np.dtype(getattr(self._source, 'dtype', np.float64))
+
+    def _read(self, index):
+        if self._x is not None:
+            return self._x[index]
+        elif isinstance(self._source, np.ndarray):
+            return self._source[index]
+        # read the block containing the index, then index the block
+        read = []
+        block_index = []
+        for idx, n in izip(index, self.shape):
+            if isinstance(idx, slice):
+                start, stop, step = idx.indices(n)
+                if step < 0:
+                    start, stop = stop + 1, start + 1
+                read.append(slice(start, max(start, stop)))
+                block_index.append(slice(None, None, step))
+            elif isinstance(idx, np.ndarray):
+                if idx.dtype.kind == 'b':
+                    idx = np.flatnonzero(idx)
+                else:
+                    idx = idx % n
+                start = idx.min() if idx.size else 0
+                stop = idx.max() + 1 if idx.size else 0
+                read.append(slice(start, stop))
+                block_index.append(idx - start)
+            else:
+                idx = int(idx) % n
+                read.append(slice(idx, idx + 1))
+                block_index.append(0)
+        return self._source[tuple(read)][tuple(block_index)]
+
+
 def extrema(x, axis=0):
     "Extract the extreme values in x"
     max = np.max(x, axis)
@@ -4952,8 +5613,8 @@ class Datalist(list):
             raise ValueError(err)
 
         x = []
-        for cell in X.cells:
-            x_cell = self[X == cell]
+        for index in cell_groups(X):
+            x_cell = self[index]
             n = len(x_cell)
             if n == 1:
                 x.append(x_cell)
@@ -5719,24 +6380,19 @@ class Dataset(OrderedDict):
             x = Factor('a' * self.n_cases)
 
         ds = Dataset(name=name.format(name=self.name), info=self.info)
+        groups = CellGroups(x)
 
         if count:
-            n_cases = filter(None, (np.sum(x == cell) for cell in x.cells))
-            ds[count] = Var(n_cases)
+            ds[count] = Var(groups.counts)
 
         for k, v in self.iteritems():
             if k in drop:
                 continue
             try:
                 if hasattr(v, 'aggregate'):
-                    ds[k] = v.aggregate(x)
+                    ds[k] = v.aggregate(groups)
                 elif isinstance(v, MNE_EPOCHS):
-                    evokeds = []
-                    for cell in x.cells:
-                        idx = (x == cell)
-                        if idx.sum():
-                            evokeds.append(v[idx].average())
-                    ds[k] = evokeds
+                    ds[k] = [v[index].average() for index in groups]
                 else:
                     err = ("Unsupported value type: %s" % type(v))
                     raise TypeError(err)
@@ -6288,6 +6944,7 @@ class Interaction(_Effect):
         self.cell_header = tuple(f.name for f in factors)
         # TODO: beta-labels
         self.beta_labels = ['?'] * self.df
+        self._groups = None
 
     def __getstate__(self):
         return {'base': self.base, 'is_categorial': self.is_categorial}
@@ -6329,6 +6986,9 @@ class Interaction(_Effect):
             x = np.vstack((b == bo for b, bo in izip(self.base, other.base)))
             return np.all(x, 0)
         elif isinstance(other, tuple) and len(other) == len(self.base):
+            groups = self._cell_groups()
+            if groups is not None:
+                return groups.mask((other,))
             x = np.vstack(factor == level for factor, level in izip(self.base, other))
             return np.all(x, 0)
         else:
@@ -6339,10 +6999,23 @@ class Interaction(_Effect):
             x = np.vstack((b != bo for b, bo in izip(self.base, other.base)))
             return np.any(x, 0)
         elif isinstance(other, tuple) and len(other) == len(self.base):
+            groups = self._cell_groups()
+            if groups is not None:
+                return ~groups.mask((other,))
             x = np.vstack(factor != level for factor, level in izip(self.base, other))
             return np.any(x, 0)
         return np.ones(len(self), bool)
 
+    def _cell_groups(self):
+        "Inverted index (None unless all base effects are Factors)"
+        if not all(isinstance(f, Factor) for f in self.base):
+            return None
+        base_groups = tuple(f._cell_groups() for f in self.base)
+        if self._groups is None or any(
+                g1 is not g2 for g1, g2 in izip(self._groups[0], base_groups)):
+            self._groups = (base_groups, CellGroups(self))
+        return self._groups[1]
+
     def as_factor(self, delim=' ', name=None):
         """Convert the Interaction to a factor
 
@@ -6408,6 +7081,9 @@ class Interaction(_Effect):
             Cells for which the index will be true. Cells described as tuples
             of strings.
         """
+        groups = self._cell_groups()
+        if groups is not None:
+            return groups.mask(cells)
         is_v = [self == cell for cell in cells]
         return np.any(is_v, 0)
 
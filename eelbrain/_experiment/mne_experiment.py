@@ -27,11 +27,11 @@ from .. import save
 from .. import table
 from .. import testnd
 from .._data_obj import (
-    Datalist, Dataset, Factor, Var, align, all_equal, as_legal_dataset_key,
-    asfactor, assert_is_legal_dataset_key, combine)
+    Combiner, Datalist, Dataset, Factor, LazyNDVar, Var, align, all_equal,
+    as_legal_dataset_key, asfactor, assert_is_legal_dataset_key, combine)
 from .._exceptions import DimensionMismatchError, OldVersionError
 from .._info import BAD_CHANNELS
-from .._io.fiff import KIT_NEIGHBORS
+from .._io.fiff import KIT_NEIGHBORS, EpochsInverseSource
 from .._io.pickle import update_subjects_dir
 from .._names import INTERPOLATE_CHANNELS
 from .._meeg import new_rejection_ds
@@ -47,6 +47,8 @@ from .._report import named_list, enumeration, plural
 from .._resources import predefined_connectivity
 from .._stats.stats import ttest_t
 from .._stats.testnd import _MergedTemporalClusterDist
+from .._trf import BoostingCache, boosting
+from .._trf._cache import DEFAULT_MAX_SIZE as DEFAULT_BOOSTING_CACHE_SIZE
 from .._utils import WrappedFormater, subp, keydefaultdict, log_level
 from .._utils.mne_utils import fix_annot_names, is_fake_mri
 from .definitions import (
@@ -431,6 +433,8 @@ temp = {
     'data_parc': 'unmasked',  # for some tests, parc and mask parameter can be saved in same file
     'test-file': join('{test-dir}', '{analysis} {group}',
                       '{epoch} {test} {test_options} {data_parc}.pickled'),
+    # boosting results (content-addressed)
+    'boosting-cache-dir': join('{cache-dir}', 'boosting'),
 
     # MRIs
     'common_brain': 'fsaverage',
@@ -533,6 +537,8 @@ class MneExperiment(FileTree):
     path_version = None
     screen_log_level = logging.INFO
     auto_delete_cache = True
+    # maximum size of the boosting cache (bytes; None for no limit)
+    boosting_cache_size = DEFAULT_BOOSTING_CACHE_SIZE
     # what to do when the experiment class definition changed:
     #   True: delete outdated files
     #   False: raise an error
@@ -1794,6 +1800,14 @@ class MneExperiment(FileTree):
             out = max(out, mtime)
         return out
 
+    def _group_combiner(self, incomplete='raise'):
+        "Combiner for data from several subjects"
+        # store NDVar data in a temporary file to limit memory usage
+        cache_dir = self.get('cache-dir')
+        if not exists(cache_dir):
+            os.makedirs(cache_dir)
+        return Combiner(incomplete=incomplete, mmap=cache_dir)
+
     def _process_subject_arg(self, subject, kwargs):
         """Process subject arg for methods that work on groups and subjects
 
@@ -1929,7 +1943,14 @@ class MneExperiment(FileTree):
 
         epochs = ds['epochs']
         inv = self.load_inv(epochs)
-        stc = apply_inverse_epochs(epochs, inv, **self._params['apply_inv_kw'])
+        apply_inv_kw = self._params['apply_inv_kw']
+        # without further processing, source estimates are computed only when
+        # the data are accessed
+        lazy = ndvar and not (baseline or morph or mask)
+        if lazy:
+            stc = apply_inverse_epochs(epochs[:1], inv, **apply_inv_kw)
+        else:
+            stc = apply_inverse_epochs(epochs, inv, **apply_inv_kw)
 
         if ndvar:
             parc = self.get('parc') or None
@@ -1945,7 +1966,11 @@ class MneExperiment(FileTree):
                                       self._params['make_inv_kw'].get('fixed', False),
                                       parc=parc,
                                       connectivity=self.get('connectivity'))
-            if baseline:
+            if lazy:
+                source = EpochsInverseSource(epochs, inv, apply_inv_kw,
+                                             src.shape[1:])
+                src = LazyNDVar(source, ('case',) + src.dims[1:], src.info)
+            elif baseline:
                 src -= src.summary(time=baseline)
 
             if morph:
@@ -2251,6 +2276,38 @@ class MneExperiment(FileTree):
         for src, dst in pairs:
             shutil.copy2(src, dst)
 
+    def boosting(self, y, x, tstart, tstop, scale_data=True, delta=0.005,
+                 mindelta=None, error='l2'):
+        """Estimate a temporal response function through boosting with caching
+
+        Calls :func:`boosting` with results cached in the experiment's cache
+        directory. Cached results are identified by the content of ``y``, ``x``
+        and the parameters, so they are never outdated. The size of the cache
+        is limited by :attr:`MneExperiment.boosting_cache_size`.
+
+        Parameters
+        ----------
+        y : NDVar | sequence of NDVar
+            Signal to predict.
+        x : NDVar | sequence of NDVar
+            Signal to use to predict ``y``.
+        tstart : float
+            Start of the TRF in seconds.
+        tstop : float
+            Stop of the TRF in seconds.
+        ...
+            See :func:`boosting`.
+
+        Returns
+        -------
+        result : BoostingResult
+            Object containing results from the boosting estimation.
+        """
+        cache = BoostingCache(self.get('boosting-cache-dir', mkdir=True),
+                              self.boosting_cache_size)
+        return boosting(y, x, tstart, tstop, scale_data, delta, mindelta, error,
+                        cache)
+
     def clear_cache(self, level=1):
         """Remove cached files.
 
@@ -2650,14 +2707,15 @@ class MneExperiment(FileTree):
         subject, group = self._process_subject_arg(subject, kwargs)
 
         if group is not None:
-            dss = []
+            combiner = self._group_combiner()
             for _ in self.iter(group=group):
                 ds = self.load_epochs(None, baseline, ndvar, add_bads, reject,
                                       cat, decim, pad, data_raw, vardef,
                                       tmin=tmin, tmax=tmax, tstop=tstop)
-                dss.append(ds)
+                combiner.append(ds)
+                del ds
 
-            return combine(dss)
+            return combiner.get()
         elif self.get('modality') == 'meeg':  # single subject, combine MEG and EEG
             # FIXME: combine MEG/EEG based on different pipes
             with self._temporary_state:
@@ -2714,7 +2772,10 @@ class MneExperiment(FileTree):
             not apply baseline correction.
         ndvar : bool
             Add the source estimates as NDVar named "src" instead of a list of
-            SourceEstimate objects named "stc" (default True).
+            SourceEstimate objects named "stc" (default True). Without
+            ``src_baseline``, ``morph`` and ``mask``, the NDVar is a
+            :class:`LazyNDVar` that computes source estimates only for the data
+            that are accessed.
         cat : sequence of cell-names
             Only load data for these cells (cells of model).
         keep_epochs : bool
@@ -2761,13 +2822,14 @@ class MneExperiment(FileTree):
                 raise ValueError("Source estimates can only be combined after "
                                  "morphing data to common brain model. Set "
                                  "morph=True.")
-            dss = []
+            combiner = self._group_combiner()
             for _ in self.iter(group=group):
                 ds = self.load_epochs_stc(None, sns_baseline, src_baseline,
                                           ndvar, cat, keep_epochs, morph, mask,
                                           False, vardef, decim)
-                dss.append(ds)
-            return combine(dss)
+                combiner.append(ds)
+                del ds
+            return combiner.get()
         else:
             ds = self.load_epochs(subject, sns_baseline, False, cat=cat,
                                   decim=decim, data_raw=data_raw, vardef=vardef)
@@ -2902,17 +2964,19 @@ class MneExperiment(FileTree):
             baseline = self._epochs[self.get('epoch')].baseline
 
         if group is not None:
-            dss = [self.load_evoked(None, baseline, False, cat, decim, data_raw,
-                                    vardef)
-                   for _ in self.iter(group=group)]
-            if ndvar:
-                sysnames = set(ds.info['sysname'] for ds in dss)
-                if len(sysnames) != 1:
-                    err = ("Can not combine different MEG systems in a single "
-                           "NDVar (trying to load data with systems %s)" %
-                           enumeration(sysnames))
-                    raise NotImplementedError(err)
-            ds = combine(dss, incomplete='drop')
+            combiner = self._group_combiner('drop')
+            sysnames = set()
+            for _ in self.iter(group=group):
+                ds = self.load_evoked(None, baseline, False, cat, decim,
+                                      data_raw, vardef)
+                sysnames.add(ds.info['sysname'])
+                combiner.append(ds)
+            if ndvar and len(sysnames) != 1:
+                err = ("Can not combine different MEG systems in a single "
+                       "NDVar (trying to load data with systems %s)" %
+                       enumeration(sysnames))
+                raise NotImplementedError(err)
+            ds = combiner.get()
 
             # check consistency in MNE objects' number of time points
             lens = [len(e.times) for e in ds['evoked']]
@@ -3280,7 +3344,9 @@ class MneExperiment(FileTree):
         preload : bool
             Mne Raw parameter.
         ndvar : bool
-            Load as NDVar instead of mne Raw object (defautl False).
+            Load as NDVar instead of mne Raw object (defautl False). The NDVar
+            is a :class:`LazyNDVar` that only reads data when they are
+            accessed.
         decim : int
             Decimate data (implies preload=True; default 1, i.e. no decimation)
         ...
@@ -3302,7 +3368,7 @@ class MneExperiment(FileTree):
             raw.resample(sfreq)
 
         if ndvar:
-            raw = load.fiff.raw_ndvar(raw)
+            raw = load.fiff.raw_ndvar(raw, lazy=True)
 
         return raw
 
@@ -3631,7 +3697,10 @@ class MneExperiment(FileTree):
             Return the data along with the test result (see below).
         make : bool
             If the target file does not exist, create it (could take a long
-            time depending on the test; if False, raise an IOError).
+            time depending on the test; if False, raise an IOError). If the
+            test is cached with fewer ``samples``, only the additional
+            permutations are computed. Permutations are checkpointed while the
+            test runs, so that an interrupted test resumes where it stopped.
         ...
             State parameters (Use the ``group`` state parameter to select the 
             subject group for which to perform the test).
@@ -3688,6 +3757,8 @@ class MneExperiment(FileTree):
         # try to load cached test
         res = None
         load_data = True
+        # partial permutation distributions are saved here while the test runs
+        checkpoint = dst + '.checkpoint'
         desc = self._get_rel('test-file', 'test-dir')
         if self._result_file_mtime(dst, data):
             try:
@@ -3706,6 +3777,16 @@ class MneExperiment(FileTree):
                                   "make=True to perform the test." %
                                   (desc, res.samples, samples))
                 else:
+                    if (isinstance(test_obj, EvokedTest) and res.samples > 0 and
+                            not exists(checkpoint)):
+                        # only compute the additional permutations
+                        try:
+                            testnd.write_checkpoint(res, checkpoint)
+                        except ValueError:  # test from an old version
+                            pass
+                        else:
+                            self._log.info("Extending cached test from "
+                                           "samples=%i: %s", res.samples, desc)
                     res = None
         elif not make and exists(dst):
             raise IOError("The requested test is outdated: %s. Set make=True "
@@ -3718,6 +3799,8 @@ class MneExperiment(FileTree):
         if res is None:
             test_kwargs = self._test_kwargs(samples, pmin, tstart, tstop, dims,
                                             parc_dim)
+            if isinstance(test_obj, EvokedTest):
+                test_kwargs['checkpoint'] = checkpoint
 
         # two-stage tests
         if isinstance(test_obj, TwoStageTest):
@@ -3730,7 +3813,7 @@ class MneExperiment(FileTree):
 
                 # stage 1
                 lms = []
-                dss = []
+                combiner = self._group_combiner()
                 for subject in tqdm(self, "Loading stage 1 models",
                                     len(self.get_field_values('subject'))):
                     if test_obj.model is None:
@@ -3746,7 +3829,8 @@ class MneExperiment(FileTree):
                         lms.append(testnd.LM(y_name, test_obj.stage_1, ds,
                                              subject=subject))
                     if return_data:
-                        dss.append(ds)
+                        combiner.append(ds)
+                    del ds
 
                 if res is None:
                     res = testnd.LMGroup(lms)
@@ -3755,7 +3839,7 @@ class MneExperiment(FileTree):
                     save.pickle(res, dst)
 
             if return_data:
-                return combine(dss), res
+                return combiner.get(), res
             else:
                 return res
 
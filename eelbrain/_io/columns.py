@@ -0,0 +1,149 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+"""Columnar storage of data-objects with memory-mapped loading
+
+An object is stored as a directory containing a pickled header with the
+metadata (dimensions, labels, names, info) and one ``.npy`` file with the data
+of each column. The ``.npy`` files are opened as :class:`numpy.memmap`, so that
+only the parts of the data that are accessed are read from disk.
+"""
+import os
+
+import numpy as np
+
+from .._data_obj import Dataset, Factor, NDVar, Var
+from .pickle import pickle, unpickle
+
+
+# format version
+VERSION = 1
+HEADER = 'header.pickled'
+# data-objects whose data are stored in .npy files (the state from
+# __getstate__ contains the data as 'x' entry or first item)
+ARRAY_TYPES = (NDVar, Var, Factor)
+
+
+def save_columns(obj, dest):
+    """Save a data-object in columnar format
+
+    Parameters
+    ----------
+    obj : Dataset | NDVar | Var | Factor
+        Object to save.
+    dest : str
+        Path of the destination directory (created if it does not exist;
+        existing data in columnar format is overwritten).
+
+    See Also
+    --------
+    load.columns : load data saved in columnar format
+
+    Notes
+    -----
+    Each column is saved as a separate ``.npy`` file. Columns of a
+    :class:`Dataset` that do not hold numerical data (e.g.
+    :class:`Datalist`) are pickled with the header.
+    """
+    dest = os.path.expanduser(dest)
+    header_path = os.path.join(dest, HEADER)
+    if not os.path.exists(dest):
+        os.makedirs(dest)
+    elif os.path.exists(header_path):
+        _remove(dest)
+    elif os.listdir(dest):
+        raise IOError("%s: Directory exists and does not contain data in "
+                      "columnar format" % (dest,))
+
+    files = []
+    if isinstance(obj, Dataset):
+        columns = [(key, _save_column(value, dest, files)) for key, value in
+                   obj.iteritems()]
+        header = {'type': Dataset, 'columns': columns, 'name': obj.name,
+                  'caption': obj._caption, 'info': obj.info,
+                  'n_cases': obj.n_cases}
+    elif isinstance(obj, ARRAY_TYPES):
+        header = {'type': type(obj), 'column': _save_column(obj, dest, files)}
+    else:
+        raise TypeError("obj=%r: need Dataset, NDVar, Var or Factor" % (obj,))
+    header['version'] = VERSION
+    header['files'] = files
+    # the header is written last, so that incomplete data can't be loaded
+    pickle(header, header_path)
+
+
+def _save_column(obj, dest, files):
+    if isinstance(obj, ARRAY_TYPES) and obj.x.dtype != object:
+        state = obj.__getstate__()
+        if isinstance(state, dict):
+            state = state.copy()
+            x = state.pop('x')
+        else:
+            x = state[0]
+            state = (None,) + state[1:]
+        fname = '%i.npy' % len(files)
+        np.save(os.path.join(dest, fname), x)
+        files.append(fname)
+        return 'array', type(obj), state, fname
+    return 'object', obj
+
+
+def _remove(path):
+    header = unpickle(os.path.join(path, HEADER))
+    os.remove(os.path.join(path, HEADER))
+    for fname in header['files']:
+        fpath = os.path.join(path, fname)
+        if os.path.exists(fpath):
+            os.remove(fpath)
+
+
+def load_columns(path, mmap_mode='r'):
+    """Load a data-object saved in columnar format
+
+    Parameters
+    ----------
+    path : str
+        Path of the directory containing the data.
+    mmap_mode : None | 'r' | 'r+' | 'c'
+        Mode for memory-mapping the data (see :func:`numpy.load`). With the
+        default ``'r'``, the data are read-only and only read from disk when
+        they are accessed. Use ``'c'`` to allow modifying the data in memory
+        (copy-on-write), or ``None`` to read all data into memory.
+
+    Returns
+    -------
+    obj : Dataset | NDVar | Var | Factor
+        The saved object.
+
+    See Also
+    --------
+    save.columns : save data in columnar format
+    """
+    path = os.path.expanduser(path)
+    header_path = os.path.join(path, HEADER)
+    if not os.path.exists(header_path):
+        raise IOError("%s: No data in columnar format" % (path,))
+    header = unpickle(header_path)
+    if header['version'] > VERSION:
+        raise IOError("%s: Data saved with a newer version of Eelbrain" %
+                      (path,))
+
+    if header['type'] is Dataset:
+        items = [(key, _load_column(column, path, mmap_mode)) for key, column
+                 in header['columns']]
+        return Dataset(items, header['name'], header['caption'],
+                       header['info'], header['n_cases'])
+    return _load_column(header['column'], path, mmap_mode)
+
+
+def _load_column(column, path, mmap_mode):
+    if column[0] == 'object':
+        return column[1]
+    _, cls, state, fname = column
+    x = np.load(os.path.join(path, fname), mmap_mode)
+    if isinstance(state, dict):
+        state = state.copy()
+        state['x'] = x
+    else:
+        state = (x,) + state[1:]
+    obj = cls.__new__(cls)
+    obj.__setstate__(state)
+    return obj
@@ -14,13 +14,14 @@ import mne
 from mne.source_estimate import _BaseSourceEstimate
 from mne.io.constants import FIFF
 from mne.io.kit.constants import KIT
-from mne.minimum_norm import prepare_inverse_operator, apply_inverse_raw
+from mne.minimum_norm import (
+    prepare_inverse_operator, apply_inverse_epochs, apply_inverse_raw)
 
 from .. import _colorspaces as _cs
 from .._info import BAD_CHANNELS
 from .._utils import ui
-from .._data_obj import (Var, NDVar, Dataset, Sensor, SourceSpace, UTS,
-                         _matrix_graph)
+from .._data_obj import (Var, NDVar, LazyNDVar, Dataset, Sensor, SourceSpace,
+                         UTS, _matrix_graph)
 from ..mne_fixes import MNE_EVOKED
 
 
@@ -621,7 +622,7 @@ def sensor_dim(fiff, picks=None, sysname=None):
 
 def raw_ndvar(raw, i_start=None, i_stop=None, decim=1, inv=None, lambda2=1,
               method='dSPM', pick_ori=None, src=None, subjects_dir=None,
-              parc='aparc', label=None):
+              parc='aparc', label=None, lazy=False):
     """Raw dta as NDVar
 
     Parameters
@@ -654,6 +655,9 @@ def raw_ndvar(raw, i_start=None, i_stop=None, decim=1, inv=None, lambda2=1,
         Parcellation to load for the source space.
     label : Label
         Restrict source estimate to this label.
+    lazy : bool
+        Return a :class:`LazyNDVar` that reads (and source-localizes) only the
+        data that are accessed (default ``False``).
 
     Returns
     -------
@@ -699,7 +703,16 @@ def raw_ndvar(raw, i_start=None, i_stop=None, decim=1, inv=None, lambda2=1,
 
     out = []
     for start, stop in izip(i_start, i_stop):
-        if inv is None:
+        if lazy:
+            if inv is None:
+                source = RawSource(raw, start, stop, decim, len(dim), picks)
+            else:
+                source = RawSource(raw, start, stop, decim, len(dim), None,
+                                   (inv, lambda2, method, label, pick_ori))
+            time = UTS(0, float(decim) / raw.info['sfreq'], source.shape[1])
+            out.append(LazyNDVar(source, (dim, time), _cs.meg_info(), name))
+            continue
+        elif inv is None:
             x = raw[picks, start:stop][0]
         else:
             x = apply_inverse_raw(raw, inv, lambda2, method, label, start,
@@ -716,6 +729,80 @@ def raw_ndvar(raw, i_start=None, i_stop=None, decim=1, inv=None, lambda2=1,
         return out
 
 
+class RawSource(object):
+    """Data source for a :class:`LazyNDVar` reading from a :class:`mne.io.Raw`
+
+    Parameters
+    ----------
+    raw : Raw
+        Raw data.
+    start, stop : None | int
+        Start and stop sample in ``raw`` (``None`` for the beginning and end).
+    decim : int
+        Decimation factor.
+    n : int
+        Number of channels or sources.
+    picks : array of int
+        Channels to read (for sensor space data).
+    inv_args : tuple
+        ``(inv, lambda2, method, label, pick_ori)`` to apply a prepared inverse
+        operator (for source space data).
+    """
+    def __init__(self, raw, start, stop, decim, n, picks=None, inv_args=None):
+        self.raw = raw
+        self.start = 0 if start is None else start
+        stop = raw.n_times if stop is None else stop
+        self.decim = decim
+        self.picks = picks
+        self.inv_args = inv_args
+        self.shape = (n, len(xrange(self.start, stop, decim)))
+
+    def __getitem__(self, index):
+        index, time_index = index
+        if index.start == index.stop or time_index.start == time_index.stop:
+            return np.empty((index.stop - index.start,
+                             time_index.stop - time_index.start))
+        start = self.start + time_index.start * self.decim
+        stop = self.start + (time_index.stop - 1) * self.decim + 1
+        if self.inv_args is None:
+            x = self.raw[self.picks[index], start:stop][0]
+        else:
+            inv, lambda2, method, label, pick_ori = self.inv_args
+            x = apply_inverse_raw(self.raw, inv, lambda2, method, label, start,
+                                  stop, pick_ori=pick_ori, prepared=True).data
+            x = x[index]
+        return x[:, ::self.decim]
+
+
+class EpochsInverseSource(object):
+    """Data source for a :class:`LazyNDVar` with source estimates for epochs
+
+    Parameters
+    ----------
+    epochs : Epochs
+        Epochs.
+    inv : InverseOperator
+        Inverse operator.
+    apply_inv_kw : dict
+        Parameters for :func:`mne.minimum_norm.apply_inverse_epochs`.
+    shape : tuple of int
+        Shape of the source estimate for a single epoch.
+    """
+    def __init__(self, epochs, inv, apply_inv_kw, shape):
+        self.epochs = epochs
+        self.inv = inv
+        self.apply_inv_kw = dict(apply_inv_kw)
+        self.shape = (len(epochs),) + tuple(shape)
+
+    def __getitem__(self, index):
+        case_index, source_index, time_index = index
+        if any(i.start == i.stop for i in index):
+            return np.empty(tuple(i.stop - i.start for i in index))
+        stcs = apply_inverse_epochs(self.epochs[case_index], self.inv,
+                                    **self.apply_inv_kw)
+        return np.array([stc.data[source_index, time_index] for stc in stcs])
+
+
 def epochs_ndvar(epochs, name=None, data=None, exclude='bads', mult=1,
                  info=None, sensors=None, vmax=None, sysname=None):
     """
@@ -49,6 +49,49 @@ class Connectivity(object):
     def __getstate__(self):
         return {k: getattr(self, k) for k in self.__slots__}
 
+    def graph(self, shape):
+        """Neighborhood of each element in a flattened array
+
+        Parameters
+        ----------
+        shape : tuple of int
+            Shape of the (C-contiguous) array.
+
+        Returns
+        -------
+        grid_strides : array of int
+            Stride of each axis with grid connectivity.
+        grid_lengths : array of int
+            Length of each axis with grid connectivity.
+        custom_stride : int
+            Stride of the first axis if it has custom connectivity, 0
+            otherwise.
+        neighbors : array of int
+            Neighbors of each element on the custom axis (in both
+            directions), ordered by source element.
+        neighbor_start : array of int  (len(shape[0]) + 1,)
+            Index of the first neighbor of each element on the custom axis in
+            ``neighbors``, and the total number of neighbors.
+        """
+        ndim = len(shape)
+        strides = [int(np.prod(shape[i + 1:])) for i in xrange(ndim)]
+        grid_axes = [i for i in xrange(ndim) if
+                     self.struct[(1,) * i + (0,) + (1,) * (ndim - i - 1)]]
+        grid_strides = np.array([strides[i] for i in grid_axes], np.int64)
+        grid_lengths = np.array([shape[i] for i in grid_axes], np.int64)
+        if 0 in self.custom:
+            edges = self.custom[0][0].astype(np.int64)
+            edges = np.vstack((edges, edges[:, ::-1]))
+            edges = edges[np.argsort(edges[:, 0], kind='mergesort')]
+            neighbor_start = np.zeros(shape[0] + 1, np.int64)
+            np.cumsum(np.bincount(edges[:, 0], minlength=shape[0]),
+                      out=neighbor_start[1:])
+            return (grid_strides, grid_lengths, strides[0],
+                    np.ascontiguousarray(edges[:, 1]), neighbor_start)
+        else:
+            empty = np.empty(0, np.int64)
+            return grid_strides, grid_lengths, 0, empty, empty
+
     def __setstate__(self, state):
         for k, v in state.iteritems():
             setattr(self, k, v)
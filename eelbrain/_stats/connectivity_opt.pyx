@@ -6,127 +6,300 @@ import numpy as np
 cimport numpy as np
 
 
+ctypedef np.int8_t INT8
 ctypedef np.uint32_t UINT32
 ctypedef np.int64_t INT64
 ctypedef np.float64_t FLOAT64
 
-def merge_labels(np.ndarray[UINT32, ndim=2] cmap,
-                 long n_labels_in,
-                 np.ndarray[UINT32, ndim=2] edges,
-                 np.ndarray[INT64, ndim=1] edge_start,
-                 np.ndarray[INT64, ndim=1] edge_stop):
-    """Merge adjacent labels with non-standard connectivity
+ctypedef fused FLOAT:
+    np.float32_t
+    np.float64_t
+
+cdef inline long _neighbors(long i, INT64* out, INT64* grid_strides,
+                            INT64* grid_lengths, long n_grid,
+                            long custom_stride, INT64* neighbors,
+                            INT64* neighbor_start):
+    "Write the indexes of the neighbors of ``i`` to ``out``"
+    cdef long i_axis, stride, length, coord, edge, v, r
+    cdef long n = 0
+
+    for i_axis in range(n_grid):
+        stride = grid_strides[i_axis]
+        length = grid_lengths[i_axis]
+        coord = (i // stride) % length
+        if coord > 0:
+            out[n] = i - stride
+            n += 1
+        if coord < length - 1:
+            out[n] = i + stride
+            n += 1
+    if custom_stride:
+        v = i // custom_stride
+        r = i - v * custom_stride
+        for edge in range(neighbor_start[v], neighbor_start[v + 1]):
+            out[n] = neighbors[edge] * custom_stride + r
+            n += 1
+    return n
+
+
+def label_clusters(np.ndarray[INT8, ndim=1] sign_map,
+                   np.ndarray[UINT32, ndim=1] cmap,
+                   np.ndarray[FLOAT, ndim=1] stat_map,
+                   np.ndarray[FLOAT64, ndim=1] mass,
+                   np.ndarray[INT64, ndim=1] grid_strides,
+                   np.ndarray[INT64, ndim=1] grid_lengths,
+                   long custom_stride,
+                   np.ndarray[INT64, ndim=1] neighbors,
+                   np.ndarray[INT64, ndim=1] neighbor_start):
+    """Label connected components
 
     Parameters
     ----------
-    cmap : array of int, ndim=2
-        Array with labels, labels are merged along the second axis; cmap is
-        modified in-place.
-    n_labels_in : int
-        Number of labels in cmap.
-    edges : array of int (n_edges, 2)
-        Edges of the connectivity graph.
+    sign_map : array of int8 (n,)
+        Elements to label (1: positive cluster, -1: negative cluster, 0: no
+        cluster). Clusters consist of connected elements with the same sign.
+    cmap : array of uint32 (n,)
+        Output for cluster labels (0 for elements that are not part of a
+        cluster). Positive clusters are labeled first, each sign in the order
+        of the first element of the cluster.
+    stat_map : array of float32 | float64 (n,)
+        Statistical map from which to compute cluster masses (only used with
+        ``mass``).
+    mass : None | array of float (> n_clusters,)
+        Output for cluster masses (``mass[label]`` is the sum of ``stat_map``
+        in the cluster).
+    grid_strides, grid_lengths, custom_stride, neighbors, neighbor_start :
+        Connectivity (see :meth:`Connectivity.graph`).
+
+    Returns
+    -------
+    n_clusters : int
+        Number of clusters (labels are ``1, ..., n_clusters``).
     """
-    n_labels_in += 1
-
-    cdef unsigned int slice_i, i, dst_i, edge_i
-    cdef unsigned int n_vert = cmap.shape[0]
-    cdef unsigned int n_slices = cmap.shape[1]
-    cdef unsigned int label, connected_label, src, dst
-    cdef unsigned int relabel_src, relabel_dst
-
-    cdef unsigned int* relabel = <unsigned int*> malloc(sizeof(unsigned int) * n_labels_in)
-    for i in range(n_labels_in):
-        relabel[i] = i
-
-    # find targets for relabeling
-    for slice_i in range(n_slices):
-        for src in range(n_vert):
-            label = cmap[src, slice_i]
-            if label == 0:
-                continue
+    cdef long i, j, k, n_candidates, n_stack
+    cdef INT8 sign
+
+    cdef long n = sign_map.shape[0]
+    cdef long n_grid = grid_strides.shape[0]
+    cdef bint do_mass = mass is not None
+    cdef unsigned int label = 0
+    cdef INT64* stack = <INT64*> malloc(sizeof(INT64) * n)
+    cdef INT64* candidates = <INT64*> malloc(sizeof(INT64) * (
+        2 * n_grid + (neighbors.shape[0] if custom_stride else 0)))
+    cdef INT64* neighbors_p = &neighbors[0] if custom_stride else NULL
+    cdef INT64* neighbor_start_p = &neighbor_start[0] if custom_stride else NULL
 
-            for edge_i in range(edge_start[src], edge_stop[src]):
-                dst = edges[edge_i, 1]
-                connected_label = cmap[dst, slice_i]
-                if connected_label == 0:
-                    continue
-
-                while relabel[label] < label:
-                    label = relabel[label]
-
-                while relabel[connected_label] < connected_label:
-                    connected_label = relabel[connected_label]
-
-                if label > connected_label:
-                    relabel_src = label
-                    relabel_dst = connected_label
-                else:
-                    relabel_src = connected_label
-                    relabel_dst = label
-
-                relabel[relabel_src] = relabel_dst
-
-    # find lowest labels
-    cdef int n_labels_out = -1
-    for i in range(n_labels_in):
-        relabel_dst = relabel[i]
-        if relabel_dst == i:
-            n_labels_out += 1
-        else:
-            while relabel[relabel_dst] < relabel_dst:
-                relabel_dst = relabel[relabel_dst]
-            relabel[i] = relabel_dst
-
-    # relabel cmap
-    for i in range(n_vert):
-        for slice_i in range(n_slices):
-            label = cmap[i, slice_i]
-            if label != 0:
-                relabel_dst = relabel[label]
-                if relabel_dst != label:
-                    cmap[i, slice_i] = relabel_dst
-
-    # find all label ids in cmap
-    cdef np.ndarray[UINT32, ndim=1] out = np.empty(n_labels_out, dtype=np.uint32)
-    dst_i = 0
-    for i in range(1, n_labels_in):
-        if i == relabel[i]:
-            out[dst_i] = i
-            dst_i += 1
-
-    free(relabel)
-    return out
-
-
-def tfce_increment(np.ndarray[UINT32, ndim=1] labels,
-                   np.ndarray[UINT32, ndim=1] label_image,
-                   np.ndarray[FLOAT64, ndim=1] image,
-                   double e, double h_factor):
-    cdef unsigned int i, cid
-    cdef unsigned int n = image.shape[0]
-    cdef unsigned int n_labels = labels.max() + 1
-
-    cdef double* area = <double*> malloc(sizeof(double) * n_labels)
-
-    # initialize area
-    for i in range(n_labels):
-        area[i] = 0.
-
-    # determine area
     for i in range(n):
-        cid = label_image[i]
-        if cid > 0:
-            area[cid] += 1.
+        cmap[i] = 0
+
+    for sign in (1, -1):
+        for i in range(n):
+            if sign_map[i] != sign or cmap[i] != 0:
+                continue
+            # flood fill a new cluster
+            label += 1
+            cmap[i] = label
+            stack[0] = i
+            n_stack = 1
+            while n_stack:
+                n_stack -= 1
+                j = stack[n_stack]
+                n_candidates = _neighbors(
+                    j, candidates, &grid_strides[0], &grid_lengths[0], n_grid,
+                    custom_stride, neighbors_p, neighbor_start_p)
+                for k in range(n_candidates):
+                    if (sign_map[candidates[k]] == sign and
+                            cmap[candidates[k]] == 0):
+                        cmap[candidates[k]] = label
+                        stack[n_stack] = candidates[k]
+                        n_stack += 1
+
+    # cluster masses (summed in the same order as scipy.ndimage.sum)
+    if do_mass:
+        for j in range(label + 1):
+            mass[j] = 0.
+        for i in range(n):
+            if cmap[i]:
+                mass[cmap[i]] += stat_map[i]
+
+    free(stack)
+    free(candidates)
+    return label
+
+
+def cluster_extent(np.ndarray[UINT32, ndim=1] cmap,
+                   unsigned int n_clusters,
+                   long stride,
+                   long length):
+    """Number of positions along one axis that each cluster occupies
+
+    Parameters
+    ----------
+    cmap : array of uint32 (n,)
+        Flattened cluster map (clusters labeled ``1, ..., n_clusters``).
+    n_clusters : int
+        Number of clusters.
+    stride : int
+        Stride of the axis in the flattened map.
+    length : int
+        Length of the axis.
+
+    Returns
+    -------
+    extent : array of int (n_clusters + 1,)
+        Extent of each cluster (``extent[label]``).
+    """
+    cdef long pos, outer, inner, start, label
+    cdef long n = cmap.shape[0]
+    cdef long block = stride * length
+    cdef np.ndarray[INT64, ndim=1] extent = np.zeros(n_clusters + 1, np.int64)
+    cdef INT64* last_pos = <INT64*> malloc(sizeof(INT64) * (n_clusters + 1))
+
+    for label in range(n_clusters + 1):
+        last_pos[label] = -1
+
+    for pos in range(length):
+        for outer in range(0, n, block):
+            start = outer + pos * stride
+            for inner in range(start, start + stride):
+                label = cmap[inner]
+                if last_pos[label] != pos:
+                    last_pos[label] = pos
+                    extent[label] += 1
 
-    # determine TFCE value
-    for cid in labels:
-        area[cid] = area[cid] ** e * h_factor
+    free(last_pos)
+    return extent
+
+
+cdef inline long _find_root(INT64* parent, double* acc, long i, INT64* path):
+    "Find the root of ``i`` and compress the path, keeping ``acc`` consistent"
+    cdef long j
+    cdef long root = i
+    cdef long n_path = 0
+
+    while parent[root] != root:
+        path[n_path] = root
+        n_path += 1
+        root = parent[root]
+    # the last node on the path is already relative to the root
+    for j in range(n_path - 2, -1, -1):
+        acc[path[j]] += acc[path[j + 1]]
+        parent[path[j]] = root
+    return root
+
+
+cdef inline void _flush(long root, long level, INT64* since, double* area,
+                        double* acc, double* cum_h_factor, double e):
+    "Add the contribution of all levels between since[root] and level"
+    if since[root] > level:
+        acc[root] += area[root] ** e * (cum_h_factor[since[root] + 1] -
+                                        cum_h_factor[level + 1])
+        since[root] = level
+
+
+def tfce_union_find(np.ndarray[INT64, ndim=1] order,
+                    np.ndarray[INT64, ndim=1] level,
+                    np.ndarray[FLOAT64, ndim=1] cum_h_factor,
+                    np.ndarray[FLOAT64, ndim=1] out,
+                    double e,
+                    np.ndarray[INT64, ndim=1] grid_strides,
+                    np.ndarray[INT64, ndim=1] grid_lengths,
+                    long custom_stride,
+                    np.ndarray[INT64, ndim=1] neighbors,
+                    np.ndarray[INT64, ndim=1] neighbor_start):
+    """Add the TFCE integral for all thresholds in a single sweep
+
+    Parameters
+    ----------
+    order : array of int (n_active,)
+        Indices of all elements that exceed at least the lowest threshold, in
+        order of descending ``level``.
+    level : array of int (n,)
+        Index of the highest threshold reached by each element (-1 for
+        elements below the lowest threshold).
+    cum_h_factor : array of float (n_levels + 1,)
+        Cumulative sum of the height factor (``h ** H``) of all thresholds,
+        starting with 0.
+    out : array of float (n,)
+        TFCE map (the integral is added to the existing values).
+    e : scalar
+        Extent exponent.
+    grid_strides, grid_lengths, custom_stride, neighbors, neighbor_start :
+        Connectivity (see :meth:`Connectivity.graph`).
+
+    Notes
+    -----
+    Elements are added in order of descending threshold and clusters are
+    merged with a union-find structure. Instead of adding each threshold's
+    contribution to all elements of a cluster, contributions are added to the
+    cluster root, and only when the cluster changes; ``acc[i]`` holds the
+    value of ``i`` relative to its parent.
+    """
+    cdef long idx, i, j, k, root, other
+
+    cdef long n = level.shape[0]
+    cdef long n_active = order.shape[0]
+    cdef long n_grid = grid_strides.shape[0]
+    cdef INT64* parent = <INT64*> malloc(sizeof(INT64) * n)
+    cdef INT64* since = <INT64*> malloc(sizeof(INT64) * n)
+    cdef INT64* path = <INT64*> malloc(sizeof(INT64) * n)
+    cdef INT64* candidates = <INT64*> malloc(sizeof(INT64) * (
+        2 * n_grid + (neighbors.shape[0] if custom_stride else 0)))
+    cdef double* area = <double*> malloc(sizeof(double) * n)
+    cdef double* acc = <double*> malloc(sizeof(double) * n)
+    cdef INT64* neighbors_p = &neighbors[0] if custom_stride else NULL
+    cdef INT64* neighbor_start_p = &neighbor_start[0] if custom_stride else NULL
+    cdef long n_candidates
 
-    # update TFCE image
     for i in range(n):
-        cid = label_image[i]
-        if cid > 0:
-            image[i] += area[cid]
+        parent[i] = -1
+
+    for idx in range(n_active):
+        i = order[idx]
+        k = level[i]
+        parent[i] = i
+        since[i] = k
+        area[i] = 1.
+        acc[i] = 0.
+        root = i
+
+        n_candidates = _neighbors(
+            i, candidates, &grid_strides[0], &grid_lengths[0], n_grid,
+            custom_stride, neighbors_p, neighbor_start_p)
+
+        # merge with active neighbors
+        for j in range(n_candidates):
+            if parent[candidates[j]] < 0:
+                continue
+            other = _find_root(parent, acc, candidates[j], path)
+            if other == root:
+                continue
+            _flush(root, k, since, area, acc, &cum_h_factor[0], e)
+            _flush(other, k, since, area, acc, &cum_h_factor[0], e)
+            if area[other] > area[root]:
+                root, other = other, root
+            parent[other] = root
+            acc[other] -= acc[root]
+            area[root] += area[other]
+
+    # contributions down to the lowest threshold
+    for idx in range(n_active):
+        i = order[idx]
+        if parent[i] == i:
+            _flush(i, -1, since, area, acc, &cum_h_factor[0], e)
+
+    # sum along the path to the root
+    for idx in range(n_active):
+        i = order[idx]
+        root = _find_root(parent, acc, i, path)
+        if root == i:
+            out[i] += acc[i]
+        else:
+            out[i] += acc[i] + acc[root]
 
+    free(parent)
+    free(since)
+    free(path)
+    free(candidates)
     free(area)
+    free(acc)
@@ -418,13 +418,15 @@ class _NDANOVA(object):
             p_maps[i] = ftest_p(f_maps[i], self.dfs_nom[i], self.dfs_denom[i])
         return p_maps
 
-    def preallocate(self, y_shape):
+    def preallocate(self, y_shape, dtype=np.float64):
         """Pre-allocate an output array container.
 
         Parameters
         ----------
         y_shape : tuple
             Data shape, will allow preallocation of containers for results.
+        dtype : numpy dtype
+            Data type of the data (and the F-maps).
 
         Returns
         -------
@@ -434,7 +436,7 @@ class _NDANOVA(object):
             anything)
         """
         shape = (self.n_effects,) + y_shape[1:]
-        f_map = np.empty(shape)
+        f_map = np.empty(shape, dtype)
         self._flat_f_map = f_map.reshape((self.n_effects, -1))
         return f_map
 
@@ -537,8 +539,8 @@ class _IncrementalNDANOVA(_NDANOVA):
                 x_orig[i] = (p.x, p.projector)
         self._x_perm = None
 
-    def preallocate(self, y_shape):
-        f_map = _NDANOVA.preallocate(self, y_shape)
+    def preallocate(self, y_shape, dtype=np.float64):
+        f_map = _NDANOVA.preallocate(self, y_shape, dtype)
 
         shape = self._flat_f_map.shape[1]
         self._SS_diff = np.empty(shape)
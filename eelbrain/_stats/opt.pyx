@@ -11,11 +11,16 @@ ctypedef cnp.int8_t INT8
 ctypedef cnp.int64_t INT64
 ctypedef cnp.float64_t FLOAT64
 
+# data types for permutation tests (sums are always accumulated in double)
+ctypedef fused FLOAT:
+    cnp.float32_t
+    cnp.float64_t
 
-def anova_full_fmaps(cnp.ndarray[FLOAT64, ndim=2] y,
+
+def anova_full_fmaps(cnp.ndarray[FLOAT, ndim=2] y,
                      cnp.ndarray[FLOAT64, ndim=2] x,
                      cnp.ndarray[FLOAT64, ndim=2] xsinv,
-                     cnp.ndarray[FLOAT64, ndim=2] f_map,
+                     cnp.ndarray[FLOAT, ndim=2] f_map,
                      cnp.ndarray[INT64, ndim=2] effects,
                      cnp.ndarray[INT8, ndim=2] e_ms):
     """Compute f-maps for a balanced, fully specified ANOVA model
@@ -78,10 +83,10 @@ def anova_full_fmaps(cnp.ndarray[FLOAT64, ndim=2] y,
     free(mss)
 
 
-def anova_fmaps(cnp.ndarray[FLOAT64, ndim=2] y,
+def anova_fmaps(cnp.ndarray[FLOAT, ndim=2] y,
                 cnp.ndarray[FLOAT64, ndim=2] x,
                 cnp.ndarray[FLOAT64, ndim=2] xsinv,
-                cnp.ndarray[FLOAT64, ndim=2] f_map,
+                cnp.ndarray[FLOAT, ndim=2] f_map,
                 cnp.ndarray[INT64, ndim=2] effects,
                 int df_res):
     """Compute f-maps for a balanced ANOVA model with residuals
@@ -172,7 +177,7 @@ def sum_square(cnp.ndarray[FLOAT64, ndim=2] y,
         out[i] = ss
 
 
-def ss(cnp.ndarray[FLOAT64, ndim=2] y,
+def ss(cnp.ndarray[FLOAT, ndim=2] y,
        cnp.ndarray[FLOAT64, ndim=1] out):
     """Compute sum squares in the data (after subtracting the intercept)
 
@@ -205,7 +210,7 @@ def ss(cnp.ndarray[FLOAT64, ndim=2] y,
         out[i] = ss_
 
 
-cdef void _lm_betas(cnp.ndarray[FLOAT64, ndim=2] y,
+cdef void _lm_betas(cnp.ndarray[FLOAT, ndim=2] y,
                     unsigned long i,
                     cnp.ndarray[FLOAT64, ndim=2] xsinv,
                     double *betas):
@@ -240,7 +245,7 @@ cdef void _lm_betas(cnp.ndarray[FLOAT64, ndim=2] y,
         betas[i_beta] = beta
 
 
-cdef double _lm_res_ss(cnp.ndarray[FLOAT64, ndim=2] y,
+cdef double _lm_res_ss(cnp.ndarray[FLOAT, ndim=2] y,
                        int i,
                        cnp.ndarray[FLOAT64, ndim=2] x,
                        int df_x,
@@ -344,7 +349,7 @@ def lm_res(cnp.ndarray[FLOAT64, ndim=2] y,
     free(betas)
 
 
-def lm_res_ss(cnp.ndarray[FLOAT64, ndim=2] y,
+def lm_res_ss(cnp.ndarray[FLOAT, ndim=2] y,
               cnp.ndarray[FLOAT64, ndim=2] x,
               cnp.ndarray[FLOAT64, ndim=2] xsinv,
               cnp.ndarray[FLOAT64, ndim=1] ss):
@@ -375,8 +380,8 @@ def lm_res_ss(cnp.ndarray[FLOAT64, ndim=2] y,
     free(betas)
 
 
-def t_1samp(cnp.ndarray[FLOAT64, ndim=2] y,
-            cnp.ndarray[FLOAT64, ndim=1] out):
+def t_1samp(cnp.ndarray[FLOAT, ndim=2] y,
+            cnp.ndarray[FLOAT, ndim=1] out):
     """T-values for 1-sample t-test
 
     Parameters
@@ -415,8 +420,8 @@ def t_1samp(cnp.ndarray[FLOAT64, ndim=2] y,
         out[i] = mean / denom
 
 
-def t_1samp_perm(cnp.ndarray[FLOAT64, ndim=2] y,
-                 cnp.ndarray[FLOAT64, ndim=1] out, 
+def t_1samp_perm(cnp.ndarray[FLOAT, ndim=2] y,
+                 cnp.ndarray[FLOAT, ndim=1] out, 
                  cnp.ndarray[INT8, ndim=1] sign):
     """T-values for 1-sample t-test
 
@@ -460,7 +465,82 @@ def t_1samp_perm(cnp.ndarray[FLOAT64, ndim=2] y,
         out[i] = mean / denom
 
 
-def has_zero_variance(cnp.ndarray[FLOAT64, ndim=2] y):
+def t_1samp_perm_batch(cnp.ndarray[FLOAT, ndim=2] y,
+                       cnp.ndarray[FLOAT, ndim=2] out,
+                       cnp.ndarray[INT8, ndim=2] signs):
+    """T-values for 1-sample t-test for a block of sign-flip permutations
+
+    Parameters
+    ----------
+    y : array (n_cases, n_tests)
+        Dependent Measurement.
+    out : array (n_perm, n_tests)
+        Container for output.
+    signs : array (n_perm, n_cases)
+        Sign for each case in each permutation.
+
+    Notes
+    -----
+    Tests are processed in blocks that stay in the cache while all
+    permutations are applied. For each test, the arithmetic is identical to
+    :func:`t_1samp_perm`.
+    """
+    cdef unsigned long i, i_chunk, case, perm, start, stop
+    cdef double sign
+
+    cdef unsigned long n_tests = y.shape[1]
+    cdef unsigned int n_cases = y.shape[0]
+    cdef unsigned long n_perm = signs.shape[0]
+    cdef unsigned long chunk = 512
+    cdef double div = (n_cases - 1) * n_cases
+    cdef double *case_buffer = <double *>malloc(sizeof(double) * chunk)
+    cdef double *mean = <double *>malloc(sizeof(double) * chunk)
+    cdef double *denom = <double *>malloc(sizeof(double) * chunk)
+
+    for start in range(0, n_tests, chunk):
+        stop = min(start + chunk, n_tests)
+        for perm in range(n_perm):
+            # mean
+            for i_chunk in range(stop - start):
+                mean[i_chunk] = 0
+            for case in range(n_cases):
+                sign = signs[perm, case]
+                for i in range(start, stop):
+                    case_buffer[i - start] = y[case, i] * sign
+                for i_chunk in range(stop - start):
+                    mean[i_chunk] += case_buffer[i_chunk]
+            for i_chunk in range(stop - start):
+                mean[i_chunk] /= n_cases
+
+            # variance
+            for i_chunk in range(stop - start):
+                denom[i_chunk] = 0
+            for case in range(n_cases):
+                sign = signs[perm, case]
+                for i in range(start, stop):
+                    case_buffer[i - start] = y[case, i] * sign
+                for i_chunk in range(stop - start):
+                    denom[i_chunk] += (case_buffer[i_chunk] - mean[i_chunk]) ** 2
+
+            # t
+            for i_chunk in range(stop - start):
+                denom[i_chunk] /= div
+                denom[i_chunk] **= 0.5
+                i = start + i_chunk
+                if denom[i_chunk] == 0:
+                    if mean[i_chunk] == 0:
+                        out[perm, i] = 0
+                    else:
+                        out[perm, i] = np.inf
+                    continue
+                out[perm, i] = mean[i_chunk] / denom[i_chunk]
+
+    free(case_buffer)
+    free(mean)
+    free(denom)
+
+
+def has_zero_variance(cnp.ndarray[FLOAT, ndim=2] y):
     "True if any data-columns have zero variance"
     cdef double value
     cdef unsigned long case, i
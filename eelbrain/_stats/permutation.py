@@ -1,6 +1,6 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 from itertools import izip
-from math import ceil
+from math import ceil, log
 import random
 
 import numpy as np
@@ -156,6 +156,9 @@ def permute_sign_flip(n, samples=10000, seed=0, out=None):
     if samples < 0:
         # do all permutations
         sample_sequences = xrange(1, n_perm_possible)
+    elif samples > n_perm_possible - 1:
+        raise ValueError("samples=%i is larger than the number of possible "
+                         "permutations (%i)" % (samples, n_perm_possible - 1))
     else:
         # random resampling
         sample_sequences = random.sample(xrange(1, n_perm_possible), samples)
@@ -167,6 +170,82 @@ def permute_sign_flip(n, samples=10000, seed=0, out=None):
         yield out
 
 
+def _sample_uses_pool(n, k):
+    "Whether :func:`random.sample` draws ``k`` of ``n`` items from a pool"
+    # same criterion as in random.sample()
+    setsize = 21
+    if k > 5:
+        setsize += 4 ** ceil(log(k * 3, 4))
+    return n <= setsize
+
+
+def permutation_key(n, samples, unit=None, sign_flip=False):
+    """Key for the sequence of permutations yielded by a permutation iterator
+
+    Parameters
+    ----------
+    n : int
+        Number of cases.
+    samples : int
+        Number of samples.
+    unit : None | categorial
+        ``unit`` parameter for :func:`permute_order`.
+    sign_flip : bool
+        Key for :func:`permute_sign_flip` (default is :func:`permute_order`).
+
+    Returns
+    -------
+    key : tuple
+        Iterators with the same key yield the same sequence of permutations,
+        up to the smaller of their ``samples``.
+    """
+    if not sign_flip:
+        if unit is not None:
+            unit = tuple(unit)
+        return 'order', n, unit
+    elif samples < 0:
+        return 'sign-flip', n, 'all'
+    elif n > 62:
+        # groups are sampled one after the other
+        return 'sign-flip', n, samples
+    elif _sample_uses_pool(2 ** n - 1, samples):
+        return 'sign-flip', n, 'pool'
+    else:
+        return 'sign-flip', n, 'set'
+
+
+def permutation_batches(iterator, batch_size):
+    """Group the indices yielded by a permutation iterator into blocks
+
+    Parameters
+    ----------
+    iterator : iterator over array  (n,)
+        Permutation iterator, e.g. from :func:`permute_order` or
+        :func:`permute_sign_flip`.
+    batch_size : int
+        Number of permutations per block.
+
+    Yields
+    ------
+    batch : array  (n_perm, n)
+        Block of permutations in the order in which they are yielded by
+        ``iterator`` (the last block can contain fewer than ``batch_size``
+        permutations).
+    """
+    batch = None
+    i = 0
+    for perm in iterator:
+        if i == 0:
+            batch = np.empty((batch_size, len(perm)), perm.dtype)
+        batch[i] = perm
+        i += 1
+        if i == batch_size:
+            yield batch
+            i = 0
+    if i:
+        yield batch[:i]
+
+
 def resample(Y, samples=10000, replacement=False, unit=None, seed=0):
     """
     Generator function to resample a dependent variable (Y) multiple times
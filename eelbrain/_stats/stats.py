@@ -1,5 +1,6 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 """Statistics functions that work on numpy arrays."""
+from itertools import izip
 import re
 
 import numpy as np
@@ -131,6 +132,60 @@ def corr(y, x, out=None, perm=None):
     return out
 
 
+def corr_perm_batch(y, x, out, perms):
+    """Correlation parameter maps for a block of permutations
+
+    Parameters
+    ----------
+    y : array, shape = (n_cases, n_tests)
+        Dependent variable with case in the first axis and case mean zero.
+    x : array, shape = (n_cases, )
+        Covariate.
+    out : array, shape = (n_perm, n_tests)
+        Container for output.
+    perms : array of int, shape = (n_perm, n_cases)
+        Permutation index for each map.
+
+    Returns
+    -------
+    r : array, shape = (n_perm, n_tests)
+        The correlations, equal to ``corr(y, x, out[i], perms[i])`` for each
+        ``i``.
+
+    Notes
+    -----
+    ``y`` is z-scored only once for the whole block. Products are accumulated
+    case by case, in the same order as the reduction in :func:`corr`, so that
+    results are identical to permuting one map at a time.
+    """
+    n = len(x)
+    n_tests = y.shape[1]
+    z_y = scipy.stats.zscore(y, ddof=1)
+    z_x = np.empty(perms.shape)
+    for z_x_i, perm in izip(z_x, perms):
+        z_x_i[:] = scipy.stats.zscore(x[perm], ddof=1)
+
+    # process blocks of columns that fit into the cache
+    chunk = max(1, 2 ** 16 // len(perms))
+    buf = np.empty((len(perms), min(chunk, n_tests)))
+    for start in xrange(0, n_tests, chunk):
+        stop = min(start + chunk, n_tests)
+        out_ = out[:, start:stop]
+        z_y_ = z_y[:, start:stop]
+        buf_ = buf[:, :stop - start]
+        np.multiply(z_x[:, 0, None], z_y_[0], out_)
+        for case in xrange(1, n):
+            np.multiply(z_x[:, case, None], z_y_[case], buf_)
+            out_ += buf_
+    out /= n - 1
+
+    # replace NaN values
+    isnan = np.isnan(out)
+    if np.any(isnan):
+        out.place(isnan, 0)
+    return out
+
+
 def lm_betas_se_1d(y, b, p):
     """Regression coefficient standard errors
 
@@ -167,6 +222,43 @@ def lm_t(y, p):
     return b.reshape((len(b), ) + y.shape[1:])
 
 
+def rankdata(a):
+    """Rank data along the last axis
+
+    Equivalent to :func:`scipy.stats.rankdata` (ties receive the average
+    rank) applied to each row of ``a``.
+
+    Parameters
+    ----------
+    a : array (..., n)
+        Data.
+
+    Returns
+    -------
+    ranks : array of float (..., n)
+        Ranks (starting at 1).
+    """
+    a = np.asarray(a)
+    n = a.shape[-1]
+    a_ = a.reshape((-1, n))
+    n_rows = len(a_)
+    rows = np.arange(n_rows)[:, None]
+    index = np.argsort(a_, -1, kind='mergesort')
+    sorted_ = a_[rows, index].ravel()
+    # groups of equal values (never across rows)
+    obs = np.empty(len(sorted_), bool)
+    obs[0] = True
+    np.not_equal(sorted_[1:], sorted_[:-1], obs[1:])
+    obs[::n] = True
+    dense = np.cumsum(obs)
+    count = np.append(np.flatnonzero(obs), len(obs))
+    rank = 0.5 * (count[dense] + count[dense - 1] + 1)
+    rank = rank.reshape((n_rows, n)) - np.arange(0, n_rows * n, n)[:, None]
+    out = np.empty(a_.shape)
+    out[rows, index] = rank
+    return out.reshape(a.shape)
+
+
 def residual_mean_square(y, x=None):
     """Mean square of the residuals
 
@@ -282,7 +374,7 @@ def t_1samp(y, out=None):
     "T-value for 1-sample t-test"
     n_cases = len(y)
     if out is None:
-        out = np.empty(y.shape[1:])
+        out = np.empty(y.shape[1:], y.dtype)
 
     if out.ndim == 1:
         out_ = out
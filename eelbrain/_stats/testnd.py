@@ -22,17 +22,14 @@ n_samples : None | int
 '''
 from __future__ import division, print_function
 
+import cPickle as pickle
 from datetime import datetime, timedelta
-from itertools import chain, izip
+from itertools import chain, islice, izip
 from math import ceil
-from multiprocessing import Process
-from multiprocessing.queues import SimpleQueue
-from multiprocessing.sharedctypes import RawArray
 import logging
 import operator
 import os
 import re
-import signal
 import socket
 from time import time as current_time
 from warnings import warn
@@ -40,7 +37,6 @@ from warnings import warn
 import numpy as np
 import scipy.stats
 from scipy import ndimage
-from tqdm import trange
 
 from .. import fmtxt
 from .. import _colorspaces as _cs
@@ -52,20 +48,36 @@ from .._exceptions import OldVersionError, ZeroVariance
 from .._report import enumeration, format_timewindow, ms
 from .._utils import LazyProperty
 from .._utils.numpy_utils import FULL_AXIS_SLICE
+from .._utils.parallel import SharedArray, worker_pool
 from . import opt, stats
 from .connectivity import Connectivity, find_peaks
-from .connectivity_opt import merge_labels, tfce_increment
+from .connectivity_opt import (
+    cluster_extent, label_clusters as label_clusters_opt, tfce_union_find)
 from .glm import _nd_anova
-from .permutation import _resample_params, permute_order, permute_sign_flip
+from .permutation import (
+    _resample_params, permutation_batches, permutation_key, permute_order,
+    permute_sign_flip)
 from .t_contrast import TContrastRel
 from .test import star_factor
-from functools import reduce
+from functools import partial, reduce
 
 
 __test__ = False
 
-# toggle multiprocessing for problematic functions on Windows
-MP_FOR_NON_TOP_LEVEL_FUNCTIONS = os.name != 'nt'  # FIXME
+# maximum number of permutations that are evaluated together in one worker
+# call (set to 0 to evaluate permutations one at a time)
+PERMUTATION_BATCH_SIZE = 128
+# maximum number of values in the buffer for a block of permuted maps
+PERMUTATION_BATCH_MAP_BUFFER = 2 ** 21
+# adaptive stopping: significance level, error rate for each decision, and
+# number of permutations before the first decision
+ADAPTIVE_ALPHA = 0.05
+ADAPTIVE_ERROR = 0.001
+ADAPTIVE_MIN_SAMPLES = 100
+# maximum number of permutations between saving checkpoints
+CHECKPOINT_INTERVAL = 1000
+# stat_map argument for label_clusters_opt() when no masses are computed
+_NO_STAT_MAP = np.empty(0)
 
 
 def check_variance(x):
@@ -103,10 +115,14 @@ class _Result(object):
         else:
             self.match = None
         self.sub = sub
+        self._cdist = cdist
+        # with adaptive stopping, samples is only the maximum
+        first_cdist = self._first_cdist
+        if first_cdist is not None and first_cdist.max_samples:
+            samples = first_cdist.samples
         self.samples = samples
         self.tfce = tfce
         self.pmin = pmin
-        self._cdist = cdist
         self.tstart = tstart
         self.tstop = tstop
         self._dims = Y.dims[1:]
@@ -327,6 +343,9 @@ class _Result(object):
         # n samples
         if self.samples == -1:
             l.add_item("In all %s possible permutations" % self.n_samples)
+        elif cdist.max_samples:
+            l.add_item("In %s random permutations (adaptive stopping, maximum "
+                       "%s)" % (self.samples, cdist.max_samples))
         else:
             l.add_item("In %s random permutations" % self.samples)
 
@@ -392,6 +411,23 @@ class t_contrast_rel(_Result):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    adaptive : bool
+        Stop permuting early once the outcome of the test is clear (default
+        False). Permutations are computed in rounds (100, 200, 400, ...
+        permutations) and stop when, for every p-value, the 99.9%
+        Clopper-Pearson confidence interval excludes 0.05. ``samples`` is the
+        maximum number of permutations, ``res.samples`` the number of
+        permutations actually computed.
+    checkpoint : str
+        File for saving partial permutation distributions while permutations
+        are computed. If the file exists from an interrupted test with the same
+        data and parameters, permutation resumes where it stopped (see
+        :func:`write_checkpoint` for extending an existing test). The file is
+        removed when the test is complete.
+    dtype : np.float64 | np.float32
+        Data type for computing the permutation distribution. With
+        ``np.float32``, permutations need half the memory and memory bandwidth;
+        the original statistical map is always computed with ``np.float64``.
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -433,7 +469,8 @@ class t_contrast_rel(_Result):
 
     def __init__(self, Y, X, contrast, match=None, sub=None, ds=None, tail=0,
                  samples=0, pmin=None, tmin=None, tfce=False, tstart=None,
-                 tstop=None, parc=None, force_permutation=False, **criteria):
+                 tstop=None, parc=None, force_permutation=False, adaptive=False,
+                 checkpoint=None, dtype=np.float64, **criteria):
         if match is None:
             raise TypeError("The `match` parameter needs to be specified for "
                             "repeated measures test t_contrast_rel")
@@ -466,12 +503,14 @@ class t_contrast_rel(_Result):
 
             cdist = _ClusterDist(ct.Y, samples, threshold, tail, 't',
                                  "t-contrast", tstart, tstop, criteria,
-                                 parc, force_permutation)
+                                 parc, force_permutation, adaptive,
+                                 checkpoint, dtype)
             cdist.add_original(tmap)
             if cdist.do_permutation:
+                cdist.permutation = permutation_key(len(ct.Y), samples,
+                                                    ct.match)
                 iterator = permute_order(len(ct.Y), samples, unit=ct.match)
-                run_permutation(t_contrast, cdist, iterator,
-                                MP_FOR_NON_TOP_LEVEL_FUNCTIONS)
+                run_permutation(t_contrast, cdist, iterator)
 
         # store attributes
         _Result.__init__(self, ct.Y, ct.match, sub, samples, tfce, pmin, cdist,
@@ -537,6 +576,23 @@ class corr(_Result):
         Collect permutation extrema for all regions of the parcellation of
         this dimension. For threshold-based test, the regions are
         disconnected.
+    adaptive : bool
+        Stop permuting early once the outcome of the test is clear (default
+        False). Permutations are computed in rounds (100, 200, 400, ...
+        permutations) and stop when, for every p-value, the 99.9%
+        Clopper-Pearson confidence interval excludes 0.05. ``samples`` is the
+        maximum number of permutations, ``res.samples`` the number of
+        permutations actually computed.
+    checkpoint : str
+        File for saving partial permutation distributions while permutations
+        are computed. If the file exists from an interrupted test with the same
+        data and parameters, permutation resumes where it stopped (see
+        :func:`write_checkpoint` for extending an existing test). The file is
+        removed when the test is complete.
+    dtype : np.float64 | np.float32
+        Data type for computing the permutation distribution. With
+        ``np.float32``, permutations need half the memory and memory bandwidth;
+        the original statistical map is always computed with ``np.float64``.
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -561,7 +617,8 @@ class corr(_Result):
 
     def __init__(self, Y, X, norm=None, sub=None, ds=None, samples=0,
                  pmin=None, rmin=None, tfce=False, tstart=None, tstop=None,
-                 match=None, parc=None, **criteria):
+                 match=None, parc=None, adaptive=False,
+                 checkpoint=None, dtype=np.float64, **criteria):
         sub = assub(sub, ds)
         Y = asndvar(Y, sub=sub, ds=ds, dtype=np.float64)
         if not Y.has_case:
@@ -613,14 +670,16 @@ class corr(_Result):
             info = _cs.stat_info('r', threshold)
 
             cdist = _ClusterDist(Y, samples, threshold, 0, 'r', name, tstart,
-                                 tstop, criteria, parc)
+                                 tstop, criteria, parc, False, adaptive,
+                                 checkpoint, dtype)
             cdist.add_original(rmap)
             if cdist.do_permutation:
-                def test_func(y, out, perm):
-                    return stats.corr(y, x, out, perm)
+                test_func = partial(_corr_perm, x)
+                batch_func = partial(_corr_perm_batch, x)
+                cdist.permutation = permutation_key(n, samples, match)
                 iterator = permute_order(n, samples, unit=match)
                 run_permutation(test_func, cdist, iterator,
-                                MP_FOR_NON_TOP_LEVEL_FUNCTIONS)
+                                batch_func=batch_func)
 
         # compile results
         dims = Y.dims[1:]
@@ -706,6 +765,23 @@ class ttest_1samp(_Result):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    adaptive : bool
+        Stop permuting early once the outcome of the test is clear (default
+        False). Permutations are computed in rounds (100, 200, 400, ...
+        permutations) and stop when, for every p-value, the 99.9%
+        Clopper-Pearson confidence interval excludes 0.05. ``samples`` is the
+        maximum number of permutations, ``res.samples`` the number of
+        permutations actually computed.
+    checkpoint : str
+        File for saving partial permutation distributions while permutations
+        are computed. If the file exists from an interrupted test with the same
+        data and parameters, permutation resumes where it stopped (see
+        :func:`write_checkpoint` for extending an existing test). The file is
+        removed when the test is complete.
+    dtype : np.float64 | np.float32
+        Data type for computing the permutation distribution. With
+        ``np.float32``, permutations need half the memory and memory bandwidth;
+        the original statistical map is always computed with ``np.float64``.
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -734,7 +810,8 @@ class ttest_1samp(_Result):
 
     def __init__(self, Y, popmean=0, match=None, sub=None, ds=None, tail=0,
                  samples=0, pmin=None, tmin=None, tfce=False, tstart=None,
-                 tstop=None, parc=None, force_permutation=False, **criteria):
+                 tstop=None, parc=None, force_permutation=False, adaptive=False,
+                 checkpoint=None, dtype=np.float64, **criteria):
         ct = Celltable(Y, match=match, sub=sub, ds=ds, coercion=asndvar,
                        dtype=np.float64)
 
@@ -770,13 +847,20 @@ class ttest_1samp(_Result):
             else:
                 y_perm = ct.Y
             n_samples, samples = _resample_params(len(y_perm), samples)
+            if samples < 0:  # complete set, can't be stopped or resumed
+                adaptive = False
+                checkpoint = None
             cdist = _ClusterDist(y_perm, n_samples, threshold, tail, 't',
                                  '1-Sample t-Test', tstart, tstop, criteria,
-                                 parc, force_permutation)
+                                 parc, force_permutation, adaptive,
+                                 checkpoint, dtype)
             cdist.add_original(tmap)
             if cdist.do_permutation:
+                cdist.permutation = permutation_key(n, samples,
+                                                    sign_flip=True)
                 iterator = permute_sign_flip(n, samples)
-                run_permutation(opt.t_1samp_perm, cdist, iterator)
+                run_permutation(opt.t_1samp_perm, cdist, iterator,
+                                batch_func=opt.t_1samp_perm_batch)
 
         # NDVar map of t-values
         dims = ct.Y.dims[1:]
@@ -875,6 +959,23 @@ class ttest_ind(_Result):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    adaptive : bool
+        Stop permuting early once the outcome of the test is clear (default
+        False). Permutations are computed in rounds (100, 200, 400, ...
+        permutations) and stop when, for every p-value, the 99.9%
+        Clopper-Pearson confidence interval excludes 0.05. ``samples`` is the
+        maximum number of permutations, ``res.samples`` the number of
+        permutations actually computed.
+    checkpoint : str
+        File for saving partial permutation distributions while permutations
+        are computed. If the file exists from an interrupted test with the same
+        data and parameters, permutation resumes where it stopped (see
+        :func:`write_checkpoint` for extending an existing test). The file is
+        removed when the test is complete.
+    dtype : np.float64 | np.float32
+        Data type for computing the permutation distribution. With
+        ``np.float32``, permutations need half the memory and memory bandwidth;
+        the original statistical map is always computed with ``np.float64``.
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -906,7 +1007,8 @@ class ttest_ind(_Result):
 
     def __init__(self, Y, X, c1=None, c0=None, match=None, sub=None, ds=None,
                  tail=0, samples=0, pmin=None, tmin=None, tfce=False,
-                 tstart=None, tstop=None, parc=None, force_permutation=False, **criteria):
+                 tstart=None, tstop=None, parc=None, force_permutation=False, adaptive=False,
+                 checkpoint=None, dtype=np.float64, **criteria):
         ct = Celltable(Y, X, match, sub, cat=(c1, c0), ds=ds, coercion=asndvar,
                        dtype=np.float64)
         check_variance(ct.Y.x)
@@ -935,14 +1037,14 @@ class ttest_ind(_Result):
 
             cdist = _ClusterDist(ct.Y, samples, threshold, tail, 't',
                                  'Independent Samples t-Test', tstart, tstop,
-                                 criteria, parc, force_permutation)
+                                 criteria, parc, force_permutation, adaptive,
+                                 checkpoint, dtype)
             cdist.add_original(tmap)
             if cdist.do_permutation:
-                def test_func(y, out, perm):
-                    return stats.t_ind(y, n1, n0, True, out, perm)
+                test_func = partial(_t_ind_perm, n1, n0)
+                cdist.permutation = permutation_key(n, samples)
                 iterator = permute_order(n, samples)
-                run_permutation(test_func, cdist, iterator,
-                                MP_FOR_NON_TOP_LEVEL_FUNCTIONS)
+                run_permutation(test_func, cdist, iterator)
 
         dims = ct.Y.dims[1:]
 
@@ -1078,6 +1180,23 @@ class ttest_rel(_Result):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    adaptive : bool
+        Stop permuting early once the outcome of the test is clear (default
+        False). Permutations are computed in rounds (100, 200, 400, ...
+        permutations) and stop when, for every p-value, the 99.9%
+        Clopper-Pearson confidence interval excludes 0.05. ``samples`` is the
+        maximum number of permutations, ``res.samples`` the number of
+        permutations actually computed.
+    checkpoint : str
+        File for saving partial permutation distributions while permutations
+        are computed. If the file exists from an interrupted test with the same
+        data and parameters, permutation resumes where it stopped (see
+        :func:`write_checkpoint` for extending an existing test). The file is
+        removed when the test is complete.
+    dtype : np.float64 | np.float32
+        Data type for computing the permutation distribution. With
+        ``np.float32``, permutations need half the memory and memory bandwidth;
+        the original statistical map is always computed with ``np.float64``.
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -1114,7 +1233,8 @@ class ttest_rel(_Result):
 
     def __init__(self, Y, X, c1=None, c0=None, match=None, sub=None, ds=None,
                  tail=0, samples=0, pmin=None, tmin=None, tfce=False,
-                 tstart=None, tstop=None, parc=None, force_permutation=False, **criteria):
+                 tstart=None, tstop=None, parc=None, force_permutation=False, adaptive=False,
+                 checkpoint=None, dtype=np.float64, **criteria):
         if match is None:
             raise TypeError("The `match` argument needs to be specified for a "
                             "related measures t-test.")
@@ -1149,13 +1269,20 @@ class ttest_rel(_Result):
                 threshold = None
 
             n_samples, samples = _resample_params(len(diff), samples)
+            if samples < 0:  # complete set, can't be stopped or resumed
+                adaptive = False
+                checkpoint = None
             cdist = _ClusterDist(diff, n_samples, threshold, tail, 't',
                                  'Related Samples t-Test', tstart, tstop,
-                                 criteria, parc, force_permutation)
+                                 criteria, parc, force_permutation,
+                                 adaptive, checkpoint, dtype)
             cdist.add_original(tmap)
             if cdist.do_permutation:
+                cdist.permutation = permutation_key(n, samples,
+                                                    sign_flip=True)
                 iterator = permute_sign_flip(n, samples)
-                run_permutation(opt.t_1samp_perm, cdist, iterator)
+                run_permutation(opt.t_1samp_perm, cdist, iterator,
+                                batch_func=opt.t_1samp_perm_batch)
 
         dims = ct.Y.dims[1:]
         t0, t1, t2 = stats.ttest_t((.05, .01, .001), df, tail)
@@ -1436,6 +1563,23 @@ class anova(_MultiEffectResult):
         disconnected.
     force_permutation: bool
         Conduct permutations regardless of whether there are any clusters.
+    adaptive : bool
+        Stop permuting early once the outcome of the test is clear (default
+        False). Permutations are computed in rounds (100, 200, 400, ...
+        permutations) and stop when, for every p-value, the 99.9%
+        Clopper-Pearson confidence interval excludes 0.05. ``samples`` is the
+        maximum number of permutations, ``res.samples`` the number of
+        permutations actually computed.
+    checkpoint : str
+        File for saving partial permutation distributions while permutations
+        are computed. If the file exists from an interrupted test with the same
+        data and parameters, permutation resumes where it stopped (see
+        :func:`write_checkpoint` for extending an existing test). The file is
+        removed when the test is complete.
+    dtype : np.float64 | np.float32
+        Data type for computing the permutation distribution. With
+        ``np.float32``, permutations need half the memory and memory bandwidth;
+        the original statistical map is always computed with ``np.float64``.
     mintime : scalar
         Minimum duration for clusters (in seconds).
     minsource : int
@@ -1462,7 +1606,8 @@ class anova(_MultiEffectResult):
 
     def __init__(self, Y, X, sub=None, ds=None, samples=0, pmin=None,
                  fmin=None, tfce=False, tstart=None, tstop=None, match=None,
-                 parc=None, force_permutation=False, **criteria):
+                 parc=None, force_permutation=False, adaptive=False,
+                 checkpoint=None, dtype=np.float64, **criteria):
         sub_arg = sub
         sub = assub(sub, ds)
         Y = asndvar(Y, sub, ds, dtype=np.float64)
@@ -1493,7 +1638,8 @@ class anova(_MultiEffectResult):
                 thresholds = (None for _ in xrange(len(effects)))
 
             cdists = [_ClusterDist(Y, samples, thresh, 1, 'F', e.name, tstart,
-                                   tstop, criteria, parc, force_permutation)
+                                   tstop, criteria, parc, force_permutation,
+                                   adaptive, checkpoint, dtype)
                       for e, thresh in izip(effects, thresholds)]
 
             # Find clusters in the actual data
@@ -1503,6 +1649,9 @@ class anova(_MultiEffectResult):
                 do_permutation += cdist.do_permutation
 
             if do_permutation:
+                key = permutation_key(len(Y), samples, match)
+                for cdist in cdists:
+                    cdist.permutation = key
                 iterator = permute_order(len(Y), samples, unit=match)
                 run_permutation_me(lm, cdists, iterator)
 
@@ -1585,30 +1734,6 @@ class anova(_MultiEffectResult):
         return super(anova, self)._plot_sub()
 
 
-def flatten(array, connectivity):
-    """Reshape SPM buffer array to 2-dimensional map for connectivity processing
-
-    Parameters
-    ----------
-    array : ndarray
-        N-dimensional array (with non-adjacent dimension at first position).
-    connectivity : Connectivity
-        N-dimensional connectivity.
-
-    Returns
-    -------
-    flat_array : ndarray
-        The input array reshaped if necessary, making sure that input and output
-        arrays share the same underlying data buffer.
-    """
-    if array.ndim == 2 or not connectivity.custom:
-        return array
-    else:
-        out = array.reshape((array.shape[0], -1))
-        assert out.base is array
-        return out
-
-
 def flatten_1d(array):
     if array.ndim == 1:
         return array
@@ -1636,22 +1761,16 @@ def label_clusters(stat_map, threshold, tail, connectivity, criteria):
         criterion.
     """
     cmap = np.empty(stat_map.shape, np.uint32)
-    bin_buff = np.empty(stat_map.shape, np.bool8)
-    cmap_flat = flatten(cmap, connectivity)
-
-    if tail == 0:
-        int_buff = np.empty(stat_map.shape, np.uint32)
-        int_buff_flat = flatten(int_buff, connectivity)
-    else:
-        int_buff = int_buff_flat = None
-
-    cids = _label_clusters(stat_map, threshold, tail, connectivity, criteria,
-                           cmap, cmap_flat, bin_buff, int_buff, int_buff_flat)
+    sign_buff = np.empty(stat_map.shape, np.int8)
+    bin_buff = np.empty(stat_map.shape, np.bool8) if tail == 0 else None
+    graph = connectivity.graph(stat_map.shape)
+    cids = _label_clusters(stat_map, threshold, tail, graph, criteria, cmap,
+                           sign_buff, bin_buff)
     return cmap, cids
 
 
-def _label_clusters(stat_map, threshold, tail, conn, criteria, cmap, cmap_flat,
-                    bin_buff, int_buff, int_buff_flat):
+def _label_clusters(stat_map, threshold, tail, graph, criteria, cmap,
+                    sign_buff, bin_buff, mass=None):
     """Find clusters on a statistical parameter map
 
     Parameters
@@ -1659,8 +1778,24 @@ def _label_clusters(stat_map, threshold, tail, conn, criteria, cmap, cmap_flat,
     stat_map : array
         Statistical parameter map (non-adjacent dimension on the first
         axis).
-    cmap : array of int
+    threshold : scalar
+        Threshold for forming clusters.
+    tail : 0 | -1 | 1
+        Which tail(s) to label.
+    graph : tuple
+        Connectivity graph for ``stat_map`` (see :meth:`Connectivity.graph`).
+    criteria : None | list
+        Cluster size criteria (see :func:`_label_clusters_binary`).
+    cmap : array of uint32
         Buffer for the cluster id map (will be modified).
+    sign_buff : array of int8
+        Buffer with the same shape as ``stat_map``.
+    bin_buff : None | array of bool
+        Buffer with the same shape as ``stat_map`` (only needed for
+        ``tail=0``).
+    mass : array of float
+        Buffer for cluster masses (``stat_map.size + 1``; only needed to
+        retrieve the cluster masses as ``mass[cluster_ids]``).
 
     Returns
     -------
@@ -1668,27 +1803,16 @@ def _label_clusters(stat_map, threshold, tail, conn, criteria, cmap, cmap_flat,
         Identifiers of the clusters that survive the minimum duration
         criterion.
     """
-    # compute clusters
-    if tail >= 0:
-        bin_map_above = np.greater(stat_map, threshold, bin_buff)
-        cids = _label_clusters_binary(bin_map_above, cmap, cmap_flat, conn,
-                                      criteria)
-
-    if tail <= 0:
-        bin_map_below = np.less(stat_map, -threshold, bin_buff)
-        if tail < 0:
-            cids = _label_clusters_binary(bin_map_below, cmap, cmap_flat, conn,
-                                          criteria)
-        else:
-            cids_l = _label_clusters_binary(bin_map_below, int_buff,
-                                            int_buff_flat, conn, criteria)
-            x = cmap.max()
-            int_buff[bin_map_below] += x
-            cids_l += x
-            cmap += int_buff
-            cids = np.concatenate((cids, cids_l))
-
-    return cids
+    if tail > 0:
+        np.greater(stat_map, threshold, sign_buff)
+    elif tail < 0:
+        np.less(stat_map, -threshold, sign_buff)
+    else:
+        np.greater(stat_map, threshold, sign_buff)
+        np.less(stat_map, -threshold, bin_buff)
+        np.subtract(sign_buff, bin_buff, sign_buff)
+    return _label_clusters_binary(sign_buff, cmap, graph, criteria, stat_map,
+                                  mass)
 
 
 def label_clusters_binary(bin_map, connectivity, criteria=None):
@@ -1711,28 +1835,33 @@ def label_clusters_binary(bin_map, connectivity, criteria=None):
         Sorted identifiers of the clusters that survive the selection criteria.
     """
     cmap = np.empty(bin_map.shape, np.uint32)
-    cmap_flat = flatten(cmap, connectivity)
-    cids = _label_clusters_binary(bin_map, cmap, cmap_flat, connectivity, criteria)
+    sign_map = np.ascontiguousarray(bin_map, np.bool8).view(np.int8)
+    cids = _label_clusters_binary(sign_map, cmap,
+                                  connectivity.graph(bin_map.shape), criteria)
     return cmap, cids
 
 
-def _label_clusters_binary(bin_map, cmap, cmap_flat, connectivity, criteria):
+def _label_clusters_binary(sign_map, cmap, graph, criteria, stat_map=None,
+                           mass=None):
     """Label clusters in a binary array
 
     Parameters
     ----------
-    bin_map : np.ndarray
-        Binary map of where the parameter map exceeds the threshold for a
-        cluster (non-adjacent dimension on the first axis).
+    sign_map : np.ndarray of int8
+        Map of where the parameter map exceeds the threshold for a cluster
+        (1 for positive and -1 for negative clusters; non-adjacent dimension
+        on the first axis).
     cmap : np.ndarray
         Array in which to label the clusters.
-    cmap_flat : np.ndarray
-        Flat copy of cmap (ndim=2, only used when all_adjacent==False)
-    connectivity : Connectivity
-        Connectivity.
+    graph : tuple
+        Connectivity graph (see :meth:`Connectivity.graph`).
     criteria : None | list
         Cluster size criteria, list of (axes, v) tuples. Collapse over axes
         and apply v minimum length).
+    stat_map : np.ndarray
+        Statistical parameter map (only needed for ``mass``).
+    mass : np.ndarray
+        Buffer for cluster masses.
 
     Returns
     -------
@@ -1740,72 +1869,65 @@ def _label_clusters_binary(bin_map, cmap, cmap_flat, connectivity, criteria):
         Sorted identifiers of the clusters that survive the selection criteria.
     """
     # find clusters
-    n = ndimage.label(bin_map, connectivity.struct, cmap)
-    if n <= 1:
-        # in older versions, n is 1 even when no cluster is found
-        if n == 0 or cmap.max() == 0:
-            return np.array((), np.uint32)
-        else:
-            cids = np.array((1,), np.uint32)
-    elif connectivity.custom:
-        cids = merge_labels(cmap_flat, n, *connectivity.custom[0])
+    if mass is None:
+        stat_map_1d = _NO_STAT_MAP
     else:
-        cids = np.arange(1, n + 1, 1, np.uint32)
+        stat_map_1d = np.ravel(stat_map)
+    n = label_clusters_opt(np.ravel(sign_map), flatten_1d(cmap),
+                           stat_map_1d, mass, *graph)
+    cids = np.arange(1, n + 1, dtype=np.uint32)
 
     # apply minimum cluster size criteria
     if criteria and cids.size:
+        cmap_1d = flatten_1d(cmap)
+        keep = np.ones(n + 1, bool)
         for axes, v in criteria:
-            cids = np.setdiff1d(cids,
-                                [i for i in cids if np.count_nonzero(np.equal(cmap, i).any(axes)) < v],
-                                True)
-            if cids.size == 0:
-                break
+            ax, = set(xrange(cmap.ndim)).difference(axes)
+            stride = reduce(operator.mul, cmap.shape[ax + 1:], 1)
+            extent = cluster_extent(cmap_1d, n, stride, cmap.shape[ax])
+            keep &= extent >= v
+        cids = cids[keep[1:]]
 
     return cids
 
 
 def tfce(stat_map, tail, connectivity):
-    tfce_im = np.empty(stat_map.shape, np.float64)
-    tfce_im_1d = flatten_1d(tfce_im)
-    bin_buff = np.empty(stat_map.shape, np.bool8)
-    int_buff = np.empty(stat_map.shape, np.uint32)
-    int_buff_flat = flatten(int_buff, connectivity)
-    int_buff_1d = flatten_1d(int_buff)
-    return _tfce(stat_map, tail, connectivity, tfce_im, tfce_im_1d, bin_buff, int_buff,
-                 int_buff_flat, int_buff_1d)
-
-
-def _tfce(stat_map, tail, conn, out, out_1d, bin_buff, int_buff,
-          int_buff_flat, int_buff_1d, dh=0.1, e=0.5, h=2.0):
-    "Threshold-free cluster enhancement"
-    out.fill(0)
-
-    # determine slices
-    if tail == 0:
-        hs = chain(np.arange(-dh, stat_map.min(), -dh),
-                   np.arange(dh, stat_map.max(), dh))
-    elif tail < 0:
-        hs = np.arange(-dh, stat_map.min(), -dh)
-    else:
-        hs = np.arange(dh, stat_map.max(), dh)
-
-    # label clusters in slices at different heights
-    # fill each cluster with total section value
-    # each point's value is the vertical sum
-    for h_ in hs:
-        if h_ > 0:
-            np.greater_equal(stat_map, h_, bin_buff)
-            h_factor = h_ ** h
-        else:
-            np.less_equal(stat_map, h_, bin_buff)
-            h_factor = (-h_) ** h
+    out = np.empty(stat_map.shape, np.float64)
+    return _tfce(stat_map, tail, connectivity.graph(stat_map.shape), out)
+
 
-        c_ids = _label_clusters_binary(bin_buff, int_buff, int_buff_flat, conn, None)
-        tfce_increment(c_ids, int_buff_1d, out_1d, e, h_factor)
+def _tfce(stat_map, tail, graph, out, dh=0.1, e=0.5, h=2.0):
+    """Threshold-free cluster enhancement
 
+    Equivalent to labeling clusters at each height in steps of ``dh`` and
+    adding ``area ** e * height ** h`` to each element, but computed in a
+    single sweep over the elements sorted by value (see
+    :func:`tfce_union_find`). ``graph`` is from :meth:`Connectivity.graph`.
+    """
+    out_1d = flatten_1d(out)
+    out_1d.fill(0)
+    stat_map_1d = stat_map.ravel()
+    if tail >= 0:
+        _tfce_tail(stat_map_1d, graph, out_1d, dh, e, h)
+    if tail <= 0:
+        _tfce_tail(-stat_map_1d, graph, out_1d, dh, e, h)
     return out
 
 
+def _tfce_tail(stat_map, graph, out, dh, e, h):
+    "Add TFCE values for one tail (``stat_map`` and ``out`` are flat)"
+    hs = np.arange(dh, stat_map.max(), dh)
+    if len(hs) == 0:
+        return
+    # index of the highest height reached by each element
+    level = np.searchsorted(hs, stat_map, 'right') - 1
+    order = np.flatnonzero(level >= 0)
+    order = order[np.argsort(-level[order], kind='mergesort')]
+    cum_h_factor = np.zeros(len(hs) + 1)
+    np.cumsum(hs ** h, out=cum_h_factor[1:])
+    tfce_union_find(order, level, cum_h_factor, out, e, *graph)
+
+
 class StatMapProcessor(object):
 
     def __init__(self, tail, max_axes, parc):
@@ -1813,6 +1935,19 @@ class StatMapProcessor(object):
         self.tail = tail
         self.max_axes = max_axes
         self.parc = parc
+        if parc is not None:
+            # elements sorted by parcel, and the start of each parcel, for
+            # reducing with np.maximum.reduceat()
+            parc = [np.atleast_1d(idx) for idx in parc]
+            self._parc_order = np.concatenate(parc)
+            self._parc_start = np.cumsum([0] + map(len, parc[:-1]))
+
+    def _max_parc(self, v):
+        "Maximum of ``v`` in each parcel (parcellated dimension on last axis)"
+        if self.parc is None:
+            return v
+        return np.maximum.reduceat(v[..., self._parc_order], self._parc_start,
+                                   -1)
 
     def max_stat(self, stat_map):
         if self.tail == 0:
@@ -1821,11 +1956,22 @@ class StatMapProcessor(object):
             v = stat_map.max(self.max_axes)
         else:
             v = -stat_map.min(self.max_axes)
+        return self._max_parc(v)
 
-        if self.parc is None:
-            return v
+    def max_stats(self, stat_maps):
+        "Maximum statistic for each map in a block (first axis)"
+        if self.max_axes is None:
+            axes = tuple(xrange(1, stat_maps.ndim))
+        else:
+            axes = tuple(ax + 1 for ax in self.max_axes)
+
+        if self.tail == 0:
+            v = np.abs(stat_maps, stat_maps).max(axes)
+        elif self.tail > 0:
+            v = stat_maps.max(axes)
         else:
-            return [v[idx].max() for idx in self.parc]
+            v = -stat_maps.min(axes)
+        return self._max_parc(v)
 
 
 class TFCEProcessor(StatMapProcessor):
@@ -1836,23 +1982,17 @@ class TFCEProcessor(StatMapProcessor):
         self.connectivity = connectivity
 
         # Pre-allocate memory buffers used for cluster processing
-        self._bin_buff = np.empty(shape, np.bool8)
-        self._int_buff = np.empty(shape, np.uint32)
+        self._graph = connectivity.graph(shape)
         self._tfce_im = np.empty(shape, np.float64)
-        self._tfce_im_1d = flatten_1d(self._tfce_im)
-        self._int_buff_flat = flatten(self._int_buff, connectivity)
-        self._int_buff_1d = flatten_1d(self._int_buff)
 
     def max_stat(self, stat_map):
-        v = _tfce(
-            stat_map, self.tail, self.connectivity, self._tfce_im,
-            self._tfce_im_1d,
-            self._bin_buff, self._int_buff, self._int_buff_flat, self._int_buff_1d,
-        ).max(self.max_axes)
-        if self.parc is None:
-            return v
-        else:
-            return [v[idx].max() for idx in self.parc]
+        v = _tfce(stat_map, self.tail, self._graph,
+                  self._tfce_im).max(self.max_axes)
+        return self._max_parc(v)
+
+    def max_stats(self, stat_maps):
+        "Maximum statistic for each map in a block (first axis)"
+        return np.array([self.max_stat(stat_map) for stat_map in stat_maps])
 
 
 class ClusterProcessor(StatMapProcessor):
@@ -1866,44 +2006,53 @@ class ClusterProcessor(StatMapProcessor):
         self.criteria = criteria
 
         # Pre-allocate memory buffers used for cluster processing
-        self._bin_buff = np.empty(shape, np.bool8)
-
+        self._graph = connectivity.graph(shape)
         self._cmap = np.empty(shape, np.uint32)
-        self._cmap_flat = flatten(self._cmap, connectivity)
-
-        if tail == 0:
-            self._int_buff = np.empty(shape, np.uint32)
-            self._int_buff_flat = flatten(self._int_buff, connectivity)
-        else:
-            self._int_buff = self._int_buff_flat = None
+        self._sign_buff = np.empty(shape, np.int8)
+        self._bin_buff = np.empty(shape, np.bool8) if tail == 0 else None
+        n = reduce(operator.mul, shape)
+        self._mass = np.empty(n + 1)
+        if parc is not None:
+            # parcel of each element, and buffer for the parcel of each cluster
+            parc_ax, = set(xrange(len(shape))).difference(max_axes)
+            element_parc = np.empty(shape[parc_ax], np.intp)
+            for i, idx in enumerate(parc):
+                element_parc[idx] = i
+            index = [None] * len(shape)
+            index[parc_ax] = slice(None)
+            self._parc_map = np.empty(shape, np.intp)
+            self._parc_map[...] = element_parc[tuple(index)]
+            self._cluster_parc = np.empty(n + 1, np.intp)
 
     def max_stat(self, stat_map, threshold=None):
         if threshold is None:
             threshold = self.threshold
         cmap = self._cmap
-        cids = _label_clusters(stat_map, threshold, self.tail, self.connectivity,
-                               self.criteria, cmap, self._cmap_flat,
-                               self._bin_buff, self._int_buff,
-                               self._int_buff_flat)
+        cids = _label_clusters(stat_map, threshold, self.tail, self._graph,
+                               self.criteria, cmap, self._sign_buff,
+                               self._bin_buff, self._mass)
         if self.parc is not None:
-            v = []
-            for idx in self.parc:
-                clusters_v = ndimage.sum(stat_map[idx], cmap[idx], cids)
-                if len(clusters_v):
-                    if self.tail <= 0:
-                        np.abs(clusters_v, clusters_v)
-                    v.append(clusters_v.max())
-                else:
-                    v.append(0)
+            v = np.zeros(len(self.parc))
+            if len(cids):
+                # clusters do not extend across parcels
+                self._cluster_parc[cmap.ravel()] = self._parc_map.ravel()
+                clusters_v = self._mass[cids]
+                if self.tail <= 0:
+                    np.abs(clusters_v, clusters_v)
+                np.maximum.at(v, self._cluster_parc[cids], clusters_v)
             return v
         elif len(cids):
-            clusters_v = ndimage.sum(stat_map, cmap, cids)
+            clusters_v = self._mass[cids]
             if self.tail <= 0:
                 np.abs(clusters_v, clusters_v)
             return clusters_v.max()
         else:
             return 0
 
+    def max_stats(self, stat_maps):
+        "Maximum statistic for each map in a block (first axis)"
+        return np.array([self.max_stat(stat_map) for stat_map in stat_maps])
+
 
 def get_map_processor(kind, *args):
     if kind == 'tfce':
@@ -1932,8 +2081,15 @@ class _ClusterDist:
       - proceed to add statistical maps from permuted data with
         ``cdist.add_perm(pmap)``.
     """
+    # attributes that need to match for resuming permutations from a checkpoint
+    _checkpoint_attrs = ('name', 'kind', 'threshold', 'tail', 'criteria',
+                         'tstart', 'tstop', 'parc', 'shape', 'dtype',
+                         'permutation')
+
     def __init__(self, y, samples, threshold, tail=0, meas='?', name=None,
-                 tstart=None, tstop=None, criteria={}, parc=None, force_permutation=False):
+                 tstart=None, tstop=None, criteria={}, parc=None,
+                 force_permutation=False, adaptive=False, checkpoint=None,
+                 dtype=np.float64):
         """Accumulate information on a cluster statistic.
 
         Parameters
@@ -1966,9 +2122,20 @@ class _ClusterDist:
             disconnected.
         force_permutation : bool
             Conduct permutations regardless of whether there are any clusters.
+        adaptive : bool
+            Stop permuting once all p-values are decided (``samples`` is the
+            maximum number of permutations, see :func:`permutation_rounds`).
+        checkpoint : str
+            File for saving and resuming partial permutation distributions.
+        dtype : np.float64 | np.float32
+            Data type for computing permuted maps.
         """
         assert y.has_case
         assert parc is None or isinstance(parc, basestring)
+        dtype = np.dtype(dtype)
+        if dtype not in (np.float32, np.float64):
+            raise ValueError("dtype=%r: needs to be np.float64 or np.float32" %
+                             (dtype,))
         if threshold is None:
             kind = 'raw'
         elif isinstance(threshold, str):
@@ -2125,6 +2292,11 @@ class _ClusterDist:
         self._init_time = current_time()
         self._host = socket.gethostname()
         self.force_permutation = force_permutation
+        self.max_samples = samples if adaptive else None
+        self.checkpoint = checkpoint
+        self.dtype = dtype
+        # key for the sequence of permutations (set by the test)
+        self.permutation = None
 
         from .. import __version__
         self._version = __version__
@@ -2193,22 +2365,11 @@ class _ClusterDist:
             self._create_dist()
             self.do_permutation = True
         else:
-            self.dist_array = None
             self.finalize()
 
     def _create_dist(self):
         "Create the distribution container"
-        if CONFIG['n_workers']:
-            n = reduce(operator.mul, self.dist_shape)
-            dist_array = RawArray('d', n)
-            dist = np.frombuffer(dist_array, np.float64, n)
-            dist.shape = self.dist_shape
-        else:
-            dist_array = None
-            dist = np.zeros(self.dist_shape)
-
-        self.dist_array = dist_array
-        self.dist = dist
+        self.dist = np.zeros(self.dist_shape)
 
     def _aggregate_dist(self, **sub):
         """Aggregate permutation distribution to one value per permutation
@@ -2238,6 +2399,86 @@ class _ClusterDist:
 
         return dist
 
+    def _p_decided(self, n):
+        """Whether all p-values are decided after the first ``n`` permutations
+
+        A p-value is decided when its Clopper-Pearson confidence interval (with
+        confidence level ``1 - ADAPTIVE_ERROR``) excludes ``ADAPTIVE_ALPHA``.
+        With ``parc``, p-values are decided both corrected across parcels and
+        within each parcel.
+        """
+        if self.kind == 'cluster':
+            v = np.abs(ndimage.sum(self._original_param_map,
+                                   self._original_cluster_map, self._cids))
+        elif self.kind == 'tfce':
+            v = self._original_cluster_map
+        elif self.tail == 0:
+            v = np.abs(self._original_param_map)
+        elif self.tail < 0:
+            v = -self._original_param_map
+        else:
+            v = self._original_param_map
+
+        dist = self.dist[:n]
+        if dist.ndim == 1:
+            return _p_decided(v, dist)
+        # p-values corrected across parcels
+        elif not _p_decided(v, dist.max(1)):
+            return False
+
+        # p-values within each parcel are based on the parcel's own column
+        element_parc = self._element_parc()
+        if self.kind == 'cluster':
+            # clusters do not extend across parcels
+            v_parc = np.asarray(ndimage.minimum(
+                element_parc, self._original_cluster_map, self._cids), np.intp)
+        else:
+            v_parc = element_parc.ravel()
+            v = np.ravel(v)
+        order = np.argsort(v_parc, kind='mergesort')
+        v = v[order]
+        bounds = np.searchsorted(v_parc[order], np.arange(dist.shape[1] + 1))
+        return all(_p_decided(v[start:stop], dist[:, i]) for i, (start, stop) in
+                   enumerate(izip(bounds[:-1], bounds[1:])))
+
+    def _element_parc(self):
+        "Parcel index for each element of the (internal) map"
+        parc_indexes = self.map_args[3]
+        parc_ax, = set(xrange(len(self.shape))).difference(self._max_axes)
+        element_parc = np.empty(self.shape[parc_ax], np.intp)
+        for i, idx in enumerate(parc_indexes):
+            element_parc[idx] = i
+        index = [None] * len(self.shape)
+        index[parc_ax] = slice(None)
+        out = np.empty(self.shape, np.intp)
+        out[...] = element_parc[tuple(index)]
+        return out
+
+    def _checkpoint_state(self, n):
+        "State for resuming after the first ``n`` permutations"
+        state = {name: getattr(self, name) for name in self._checkpoint_attrs}
+        state['_original_param_map'] = self._original_param_map
+        state['dist'] = None if self.dist is None else np.array(self.dist[:n])
+        return state
+
+    def _matches_checkpoint(self, state):
+        "Whether a checkpoint state belongs to the same test"
+        if any(state[name] != getattr(self, name) for name in
+               self._checkpoint_attrs):
+            return False
+        elif not np.array_equal(state['_original_param_map'],
+                                self._original_param_map):
+            return False
+        elif self.do_permutation:
+            return state['dist'] is not None
+        return True
+
+    def _truncate(self, n):
+        "Discard permutations after the first ``n``"
+        if self.do_permutation:
+            self.dist = np.array(self.dist[:n])
+        self.samples = n
+
     def __repr__(self):
         items = []
         if self.has_original:
@@ -2260,7 +2501,7 @@ class _ClusterDist:
         attrs = ('name', 'meas', '_version', '_host', '_init_time',
                  # settings ...
                  'kind', 'threshold', 'tail', 'criteria', 'samples', 'tstart',
-                 'tstop', 'parc',
+                 'tstop', 'parc', 'max_samples', 'dtype', 'permutation',
                  # data properties ...
                  'dims', 'shape', '_nad_ax', '_criteria', '_connectivity',
                  # results ...
@@ -2310,6 +2551,13 @@ class _ClusterDist:
                 (dims[nad_ax],) + dims[:nad_ax] + dims[nad_ax + 1:],
                 state['parc'])
 
+        if 'max_samples' not in state:
+            state['max_samples'] = None
+        if 'dtype' not in state:
+            state['dtype'] = np.dtype(np.float64)
+        if 'permutation' not in state:
+            state['permutation'] = None
+
         for k, v in state.iteritems():
             setattr(self, k, v)
         self.has_original = True
@@ -2318,6 +2566,10 @@ class _ClusterDist:
     def _repr_test_args(self, pmin):
         "Argument representation for TestResult repr"
         args = ['samples=%r' % self.samples]
+        if self.max_samples:
+            args.append("adaptive=True")
+        if self.dtype != np.float64:
+            args.append("dtype=np.%s" % self.dtype.name)
         if pmin:
             args.append("pmin=%r" % pmin)
         if self.tstart:
@@ -2391,20 +2643,19 @@ class _ClusterDist:
         Parameters
         ----------
         raw : bool
-            Return a RawArray and a shape tuple instead of a numpy array.
+            Return a :class:`SharedArray` and a shape tuple instead of a numpy
+            array.
         """
         # get data in the right shape
         x = self.y_perm.x
         if self._nad_ax:
             x = x.swapaxes(1, 1 + self._nad_ax)
+        x_flat = x.reshape((len(x), -1)).astype(self.dtype, copy=False)
 
         if not raw:
-            return x.reshape((len(x), -1))
+            return x_flat
 
-        n = reduce(operator.mul, self.y_perm.shape)
-        ra = RawArray('d', n)
-        ra[:] = x.ravel()  # OPT: don't copy data
-        return ra, x.shape
+        return SharedArray.from_array(x_flat), x.shape
 
     def _cluster_properties(self, cluster_map, cids):
         """Create a Dataset with cluster properties
@@ -2825,86 +3076,418 @@ class _MergedTemporalClusterDist:
         return clusters
 
 
-def distribution_worker(dist_array, dist_shape, in_queue):
-    "Worker that accumulates values and places them into the distribution"
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-    n = reduce(operator.mul, dist_shape)
-    dist = np.frombuffer(dist_array, np.float64, n)
-    dist.shape = dist_shape
-    samples = dist_shape[0]
-    for i in trange(samples, desc="Permutation test", unit=' permutations'):
-        dist[i] = in_queue.get()
-
-
-def permutation_worker(in_queue, out_queue, y, shape, test_func, map_args):
-    "Worker for 1 sample t-test"
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-    n = reduce(operator.mul, shape)
-    y = np.frombuffer(y, np.float64, n).reshape((shape[0], -1))
-    stat_map = np.empty(shape[1:])
-    stat_map_flat = stat_map.ravel()
-    map_processor = get_map_processor(*map_args)
-    while True:
-        perm = in_queue.get()
-        if perm is None:
+def _corr_perm(x, y, out, perm):
+    return stats.corr(y, x, out, perm)
+
+
+def _corr_perm_batch(x, y, out, perms):
+    return stats.corr_perm_batch(y, x, out, perms)
+
+
+def _t_ind_perm(n1, n0, y, out, perm):
+    return stats.t_ind(y, n1, n0, True, out, perm)
+
+
+class PermutationJob(object):
+    """Compute maximum statistics for blocks of permutations in a worker
+
+    Each item is a ``(start, perms)`` tuple, and the resulting maximum
+    statistics are written directly to the shared distribution at
+    ``dist[start: start + len(perms)]``.
+
+    Parameters
+    ----------
+    test_func : callable
+        ``test_func(y, out, perm)`` for a single permutation.
+    batch_func : None | callable
+        ``batch_func(y, out, perms)`` for a block of permutations.
+    y : SharedArray  (n_cases, n_tests)
+        Data.
+    shape : tuple of int
+        Shape of the data, including the case dimension.
+    map_args : tuple
+        Arguments for :func:`get_map_processor`.
+    dist : SharedArray
+        Distribution.
+    """
+    def __init__(self, test_func, batch_func, y, shape, map_args, dist):
+        self.test_func = test_func
+        self.batch_func = batch_func
+        self.y = y
+        self.shape = shape
+        self.map_args = map_args
+        self.dist = dist
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in
+                ('test_func', 'batch_func', 'y', 'shape', 'map_args', 'dist')}
+
+    def setup(self):
+        self.map_processor = get_map_processor(*self.map_args)
+        self.stat_maps = self.stat_maps_flat = None
+
+    def __call__(self, item):
+        start, perms = item
+        n_perm = len(perms)
+        if self.stat_maps is None or len(self.stat_maps) < n_perm:
+            self.stat_maps = np.empty((n_perm,) + self.shape[1:],
+                                      self.y.dtype)
+            self.stat_maps_flat = self.stat_maps.reshape((n_perm, -1))
+        map_batch(self.test_func, self.batch_func, self.y.x,
+                  self.stat_maps_flat[:n_perm], perms)
+        self.dist.x[start: start + n_perm] = \
+            self.map_processor.max_stats(self.stat_maps[:n_perm])
+        return n_perm
+
+
+class PermutationJobMe(object):
+    """Compute maximum statistics for all effects of an ANOVA in a worker
+
+    Parameters
+    ----------
+    test : _nd_anova
+        ANOVA model.
+    y : SharedArray  (n_cases, n_tests)
+        Data.
+    shape : tuple of int
+        Shape of the data, including the case dimension.
+    map_args : tuple
+        Arguments for :func:`get_map_processor`.
+    thresholds : None | tuple
+        Cluster-forming threshold for each effect.
+    dists : list of (None | SharedArray)
+        Distribution for each effect (None to skip the effect).
+    """
+    def __init__(self, test, y, shape, map_args, thresholds, dists):
+        self.test = test
+        self.y = y
+        self.shape = shape
+        self.map_args = map_args
+        self.thresholds = thresholds
+        self.dists = dists
+
+    def __getstate__(self):
+        return {k: getattr(self, k) for k in
+                ('test', 'y', 'shape', 'map_args', 'thresholds', 'dists')}
+
+    def setup(self):
+        self.map_processor = get_map_processor(*self.map_args)
+        stat_maps = list(self.test.preallocate(self.shape, self.y.dtype))
+        if self.thresholds:
+            items = zip(stat_maps, self.dists, self.thresholds)
+        else:
+            items = [(m, d, None) for m, d in izip(stat_maps, self.dists)]
+        self.items = [item for item in items if item[1] is not None]
+
+    def __call__(self, item):
+        start, perms = item
+        y = self.y.x
+        for i, perm in enumerate(perms, start):
+            self.test.map(y, perm)
+            for m, dist, t in self.items:
+                if t is None:
+                    dist.x[i] = self.map_processor.max_stat(m)
+                else:
+                    dist.x[i] = self.map_processor.max_stat(m, t)
+        return len(perms)
+
+
+def map_batch(test_func, batch_func, y, out, perms):
+    """Compute statistical maps for a block of permutations
+
+    Parameters
+    ----------
+    test_func : callable
+        ``test_func(y, out, perm)`` for a single permutation.
+    batch_func : None | callable
+        ``batch_func(y, out, perms)`` for a block of permutations (None to
+        call ``test_func`` for each permutation).
+    y : array  (n_cases, n_tests)
+        Data.
+    out : array  (n_perm, n_tests)
+        Container for the maps.
+    perms : array  (n_perm, n_cases)
+        Block of permutations.
+    """
+    if batch_func is None:
+        for out_i, perm in izip(out, perms):
+            test_func(y, out_i, perm)
+    else:
+        batch_func(y, out, perms)
+
+
+def permutation_batch_size(samples, n_workers, map_size):
+    """Number of permutations per block
+
+    Blocks are limited so that each worker receives several blocks, and so
+    that the buffer for a block of maps does not exceed
+    ``PERMUTATION_BATCH_MAP_BUFFER`` values.
+    """
+    batch_size = min(PERMUTATION_BATCH_SIZE,
+                     PERMUTATION_BATCH_MAP_BUFFER // map_size)
+    if n_workers:
+        batch_size = min(batch_size, samples // (n_workers * 4))
+    return max(1, batch_size)
+
+
+def permutation_items(iterator, start=0):
+    "Add the index of the first permutation to each block of permutations"
+    for perms in iterator:
+        yield start, perms
+        start += len(perms)
+
+
+def _p_decided(v, dist):
+    """Whether the p-values of ``v`` in ``dist`` are decided
+
+    See :meth:`_ClusterDist._p_decided`.
+    """
+    n = len(dist)
+    dist = np.sort(dist)
+    # number of permutations with a larger value than each p-value
+    k = n - np.unique(np.searchsorted(dist, np.ravel(v), 'right'))
+    lower = np.zeros(len(k))
+    upper = np.ones(len(k))
+    idx = k > 0
+    lower[idx] = scipy.stats.beta.ppf(ADAPTIVE_ERROR / 2, k[idx],
+                                      n - k[idx] + 1)
+    idx = k < n
+    upper[idx] = scipy.stats.beta.ppf(1 - ADAPTIVE_ERROR / 2, k[idx] + 1,
+                                      n - k[idx])
+    return np.all((upper < ADAPTIVE_ALPHA) | (lower > ADAPTIVE_ALPHA))
+
+
+def permutation_rounds(dists, iterator):
+    """Divide the permutations into rounds
+
+    Parameters
+    ----------
+    dists : list of _ClusterDist
+        Distributions that are computed from the same permutations.
+    iterator : iterator
+        Iterator over permutations.
+
+    Yields
+    ------
+    start, stop : int
+        Range of permutations in the round.
+    perms : iterator
+        Iterator over the permutations in the round. All permutations should
+        be processed before the next item is requested.
+
+    Notes
+    -----
+    Without adaptive stopping or checkpoints, all permutations are computed in
+    a single round.
+
+    With adaptive stopping, rounds end after ``ADAPTIVE_MIN_SAMPLES``
+    permutations, and then whenever the number of permutations has doubled.
+    After each of these rounds, permutation stops if all p-values of all
+    distributions are decided (:meth:`_ClusterDist._p_decided`), and the
+    distributions are truncated to the permutations computed so far. Since the
+    decision for each p-value is made with error rate ``ADAPTIVE_ERROR`` at
+    every look, the probability of a wrong decision is at most
+    ``ADAPTIVE_ERROR`` times the number of rounds.
+
+    With a checkpoint file, permutation resumes from the file if it matches the
+    test, rounds are limited to ``CHECKPOINT_INTERVAL`` permutations, and the
+    distributions are saved to the file after each round. Since permutation
+    iterators are seeded, skipping the permutations contained in the file
+    continues the same sequence of permutations.
+    """
+    dist = dists[0]
+    samples = dist.samples
+    checkpoint = dist.checkpoint
+    permuted = [d for d in dists if d.do_permutation]
+    start = _read_checkpoint(checkpoint, dists)
+    # skip permutations that were already computed
+    for _ in islice(iterator, start):
+        pass
+
+    looks = []
+    if dist.max_samples:
+        look = ADAPTIVE_MIN_SAMPLES
+        while look < samples:
+            looks.append(look)
+            look *= 2
+    looks.append(samples)
+
+    while start < samples:
+        stop = min(look for look in looks if look > start)
+        if checkpoint:
+            stop = min(stop, start + CHECKPOINT_INTERVAL)
+        yield start, stop, islice(iterator, stop - start)
+        if (stop < samples and stop in looks and
+                all(d._p_decided(stop) for d in permuted)):
+            logger = logging.getLogger(__name__)
+            logger.info("Adaptive stopping after %i permutations", stop)
+            for d in dists:
+                d._truncate(stop)
             break
-        test_func(y, stat_map_flat, perm)
-        max_v = map_processor.max_stat(stat_map)
-        out_queue.put(max_v)
+        elif checkpoint and stop < samples:
+            _write_checkpoint(checkpoint, dists, stop)
+        start = stop
+
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
 
 
-def run_permutation(test_func, dist, iterator, use_mp=True):
-    if use_mp and CONFIG['n_workers']:
-        workers, out_queue = setup_workers(test_func, dist)
+def write_checkpoint(res, path):
+    """Save the permutations of a test result for extending it
 
-        for perm in iterator:
-            out_queue.put(perm)
+    Parameters
+    ----------
+    res : testnd result
+        Test result with permutations.
+    path : str
+        Destination.
 
-        for _ in xrange(len(workers) - 1):
-            out_queue.put(None)
+    Notes
+    -----
+    To add permutations to an existing test, save its permutations with this
+    function, then repeat the test with the same data and parameters, but with
+    a larger ``samples`` and ``checkpoint=path``. Only the additional
+    permutations will be computed. If the larger ``samples`` changes the
+    sequence of permutations (:func:`random.sample` changes its algorithm for
+    sign-flip permutations depending on the number of samples), the checkpoint
+    is ignored and all permutations are computed.
+    """
+    if res._cdist is None or res.samples <= 0:
+        raise ValueError("%r: can only write checkpoints for tests with random "
+                         "permutations" % (res,))
+    elif isinstance(res._cdist, list):
+        dists = res._cdist
+    else:
+        dists = [res._cdist]
+    if any(d.dist is not None and d.permutation is None for d in dists):
+        raise ValueError("%r: the test was computed with a previous version of "
+                         "Eelbrain and can not be extended" % (res,))
+    _write_checkpoint(path, dists, res.samples)
+
+
+def _write_checkpoint(path, dists, n):
+    "Save the first ``n`` permutations of ``dists``"
+    state = {'version': 2, 'n': n,
+             'dists': [d._checkpoint_state(n) for d in dists]}
+    # write to a temporary file first so that an interruption can not leave
+    # a corrupted checkpoint behind
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as fid:
+        pickle.dump(state, fid, pickle.HIGHEST_PROTOCOL)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:  # Windows does not replace existing files
+        os.remove(path)
+        os.rename(tmp_path, path)
+
+
+def _read_checkpoint(path, dists):
+    """Fill ``dists`` from a checkpoint file
 
-        logger = logging.getLogger(__name__)
-        for w in workers:
-            w.join()
-            logger.debug("worker joined")
+    Returns
+    -------
+    n : int
+        Number of permutations that were filled in (0 if there is no matching
+        checkpoint).
+    """
+    if not path or not os.path.exists(path):
+        return 0
+    logger = logging.getLogger(__name__)
+    with open(path, 'rb') as fid:
+        state = pickle.load(fid)
+    if (state.get('version') != 2 or len(state['dists']) != len(dists) or
+            not all(d._matches_checkpoint(d_state) for d, d_state in
+                    izip(dists, state['dists']))):
+        logger.warning("Ignoring checkpoint that does not match the test: %s",
+                       path)
+        return 0
+    n = min(state['n'], dists[0].samples)
+    for d, d_state in izip(dists, state['dists']):
+        if d.do_permutation:
+            d.dist[:n] = d_state['dist'][:n]
+    logger.info("Resuming after %i permutations from checkpoint %s", n, path)
+    return n
+
+
+def run_permutation_job(pool, job, iterator, start, stop):
+    "Process a range of permutations with the worker pool"
+    pool.run(job, permutation_items(iterator, start), stop - start,
+             "Permutation test", ' permutations')
+
+
+def run_permutation(test_func, dist, iterator, use_mp=True, batch_func=None):
+    """Compute the permutation distribution
+
+    Parameters
+    ----------
+    test_func : callable
+        ``test_func(y, out, perm)``, computing the map for one permutation
+        (needs to be picklable for multiprocessing).
+    dist : _ClusterDist
+        Distribution to fill.
+    iterator : iterator
+        Iterator over permutations.
+    use_mp : bool
+        Use multiprocessing (if enabled in the configuration).
+    batch_func : callable
+        ``batch_func(y, out, perms)``, computing maps for a block of
+        permutations in a single call (optional, only used when
+        ``PERMUTATION_BATCH_SIZE > 1``).
+    """
+    n_workers = CONFIG['n_workers'] if use_mp else 0
+    map_size = reduce(operator.mul, dist.shape)
+    if PERMUTATION_BATCH_SIZE <= 1:
+        batch_func = None
+
+    def batch_size(n):
+        if PERMUTATION_BATCH_SIZE > 1:
+            return permutation_batch_size(n, n_workers, map_size)
+        else:
+            return 1
+
+    if n_workers:
+        y, shape = dist.data_for_permutation()
+        dist_array = SharedArray(dist.dist_shape)
+        dist.dist = dist_array.x
+        try:
+            job = PermutationJob(test_func, batch_func, y, shape,
+                                 dist.map_args, dist_array)
+            with worker_pool() as pool:
+                for start, stop, perms in permutation_rounds([dist], iterator):
+                    batches = permutation_batches(perms,
+                                                  batch_size(stop - start))
+                    run_permutation_job(pool, job, batches, start, stop)
+        finally:
+            dist.dist = np.array(dist.dist)
+            y.close()
+            dist_array.close()
+    elif batch_size(dist.samples) > 1:
+        y = dist.data_for_permutation(False)
+        map_processor = get_map_processor(*dist.map_args)
+        n_buffer = batch_size(dist.samples)
+        stat_maps = np.empty((n_buffer,) + dist.shape, dist.dtype)
+        stat_maps_flat = stat_maps.reshape((n_buffer, -1))
+        for start, stop, perms in permutation_rounds([dist], iterator):
+            i = start
+            for batch in permutation_batches(perms, n_buffer):
+                n_perm = len(batch)
+                map_batch(test_func, batch_func, y, stat_maps_flat[:n_perm],
+                          batch)
+                dist.dist[i: i + n_perm] = \
+                    map_processor.max_stats(stat_maps[:n_perm])
+                i += n_perm
     else:
         y = dist.data_for_permutation(False)
         map_processor = get_map_processor(*dist.map_args)
-        stat_map = np.empty(dist.shape)
+        stat_map = np.empty(dist.shape, dist.dtype)
         stat_map_flat = stat_map.ravel()
-        for i, perm in enumerate(iterator):
-            test_func(y, stat_map_flat, perm)
-            dist.dist[i] = map_processor.max_stat(stat_map)
+        for start, stop, perms in permutation_rounds([dist], iterator):
+            for i, perm in enumerate(perms, start):
+                test_func(y, stat_map_flat, perm)
+                dist.dist[i] = map_processor.max_stat(stat_map)
     dist.finalize()
 
 
-def setup_workers(test_func, dist):
-    "Initialize workers for permutation tests"
-    logger = logging.getLogger(__name__)
-    logger.debug("Setting up %i worker processes..." % CONFIG['n_workers'])
-    permutation_queue = SimpleQueue()
-    dist_queue = SimpleQueue()
-
-    # permutation workers
-    y, shape = dist.data_for_permutation()
-    args = (permutation_queue, dist_queue, y, shape, test_func, dist.map_args)
-    workers = []
-    for _ in xrange(CONFIG['n_workers']):
-        w = Process(target=permutation_worker, args=args)
-        w.daemon = True
-        w.start()
-        workers.append(w)
-
-    # distribution worker
-    args = (dist.dist_array, dist.dist_shape, dist_queue)
-    w = Process(target=distribution_worker, args=args)
-    w.daemon = True
-    w.start()
-    workers.append(w)
-
-    return workers, permutation_queue
-
-
 def run_permutation_me(test, dists, iterator):
     dist = dists[0]
     if dist.kind == 'cluster':
@@ -2913,104 +3496,53 @@ def run_permutation_me(test, dists, iterator):
         thresholds = None
 
     if CONFIG['n_workers']:
-        workers, out_queue = setup_workers_me(test, dists, thresholds)
-
-        for perm in iterator:
-            out_queue.put(perm)
-
-        for _ in xrange(len(workers) - 1):
-            out_queue.put(None)
-
-        logger = logging.getLogger(__name__)
-        for w in workers:
-            w.join()
-            logger.debug("worker joined")
+        y, shape = dist.data_for_permutation()
+        dist_arrays = [SharedArray(d.dist_shape) if d.do_permutation else None
+                       for d in dists]
+        for d, dist_array in izip(dists, dist_arrays):
+            if dist_array is not None:
+                d.dist = dist_array.x
+        try:
+            job = PermutationJobMe(test, y, shape, dist.map_args, thresholds,
+                                   dist_arrays)
+            with worker_pool() as pool:
+                for start, stop, perms in permutation_rounds(dists, iterator):
+                    if PERMUTATION_BATCH_SIZE > 1:
+                        batch_size = permutation_batch_size(
+                            stop - start, CONFIG['n_workers'], 1)
+                    else:
+                        batch_size = 1
+                    batches = permutation_batches(perms, batch_size)
+                    run_permutation_job(pool, job, batches, start, stop)
+        finally:
+            for d, dist_array in izip(dists, dist_arrays):
+                if dist_array is not None:
+                    d.dist = np.array(d.dist)
+                    dist_array.close()
+            y.close()
     else:
         y = dist.data_for_permutation(False)
         map_processor = get_map_processor(*dist.map_args)
 
-        stat_maps = test.preallocate((0,) + dist.shape)
+        stat_maps = test.preallocate((0,) + dist.shape, dist.dtype)
         stat_maps_iter = [stat_maps[i] for i in xrange(len(stat_maps))]
         if thresholds:
             stat_maps_iter = zip(stat_maps_iter, thresholds, dists)
         else:
             stat_maps_iter = zip(stat_maps_iter, dists)
 
-        for i, perm in enumerate(iterator):
-            test.map(y, perm)
-            if thresholds:
-                for m, t, d in stat_maps_iter:
-                    if d.do_permutation:
-                        d.dist[i] = map_processor.max_stat(m, t)
-            else:
-                for m, d in stat_maps_iter:
-                    if d.do_permutation:
-                        d.dist[i] = map_processor.max_stat(m)
+        for start, stop, perms in permutation_rounds(dists, iterator):
+            for i, perm in enumerate(perms, start):
+                test.map(y, perm)
+                if thresholds:
+                    for m, t, d in stat_maps_iter:
+                        if d.do_permutation:
+                            d.dist[i] = map_processor.max_stat(m, t)
+                else:
+                    for m, d in stat_maps_iter:
+                        if d.do_permutation:
+                            d.dist[i] = map_processor.max_stat(m)
 
     for d in dists:
         if d.do_permutation:
             d.finalize()
-
-
-def setup_workers_me(test_func, dists, thresholds):
-    "Initialize workers for permutation tests"
-    logger = logging.getLogger(__name__)
-    logger.debug("Setting up %i worker processes..." % CONFIG['n_workers'])
-    permutation_queue = SimpleQueue()
-    dist_queue = SimpleQueue()
-
-    # permutation workers
-    dist = dists[0]
-    y, shape = dist.data_for_permutation()
-    args = (permutation_queue, dist_queue, y, shape, test_func, dist.map_args,
-            thresholds)
-    workers = []
-    for _ in xrange(CONFIG['n_workers']):
-        w = Process(target=permutation_worker_me, args=args)
-        w.daemon = True
-        w.start()
-        workers.append(w)
-
-    # distribution worker
-    args = ([d.dist_array for d in dists], dist.dist_shape, dist_queue)
-    w = Process(target=distribution_worker_me, args=args)
-    w.daemon = True
-    w.start()
-    workers.append(w)
-
-    return workers, permutation_queue
-
-
-def permutation_worker_me(in_queue, out_queue, y, shape, test, map_args,
-                          thresholds):
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-    n = reduce(operator.mul, shape)
-    y = np.frombuffer(y, np.float64, n).reshape((shape[0], -1))
-    iterator = list(test.preallocate(shape))
-    if thresholds:
-        iterator = zip(iterator, thresholds)
-    map_processor = get_map_processor(*map_args)
-    while True:
-        perm = in_queue.get()
-        if perm is None:
-            break
-        test.map(y, perm)
-
-        if thresholds:
-            max_v = [map_processor.max_stat(m, t) for m, t in iterator]
-        else:
-            max_v = [map_processor.max_stat(m) for m in iterator]
-        out_queue.put(max_v)
-
-
-def distribution_worker_me(dist_arrays, dist_shape, in_queue):
-    "Worker that accumulates values and places them into the distribution"
-    signal.signal(signal.SIGINT, signal.SIG_IGN)
-    n = reduce(operator.mul, dist_shape)
-    dists = [d if d is None else np.frombuffer(d, np.float64, n).reshape(dist_shape)
-             for d in dist_arrays]
-    samples = dist_shape[0]
-    for i in trange(samples, desc="Permutation test", unit=' permutations'):
-        for dist, v in izip(dists, in_queue.get()):
-            if dist is not None:
-                dist[i] = v
@@ -1,7 +1,7 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 import numpy as np
 import scipy.stats
-from numpy.testing import assert_allclose
+from numpy.testing import assert_allclose, assert_array_equal
 from eelbrain import datasets
 from eelbrain._stats import opt
 from eelbrain._stats.permutation import permute_sign_flip
@@ -25,3 +25,20 @@ def test_t_1samp():
         opt.t_1samp_perm(y, t_perm, sign)
         opt.t_1samp(y * sign[:,None], t)
         assert_allclose(t_perm, t)
+
+    # batch
+    signs = np.array(list(map(np.copy, permute_sign_flip(n_cases, 5))))
+    t_batch = np.empty((5, len(t)))
+    opt.t_1samp_perm_batch(y, t_batch, signs)
+    for sign, t_b in zip(signs, t_batch):
+        opt.t_1samp_perm(y, t_perm, sign)
+        assert_array_equal(t_b, t_perm)
+
+    # float32
+    y32 = y.astype(np.float32)
+    t32 = np.empty(len(t), np.float32)
+    opt.t_1samp(y32, t32)
+    assert_allclose(t32, t_sp, 1e-5)
+    t_batch32 = np.empty((5, len(t)), np.float32)
+    opt.t_1samp_perm_batch(y32, t_batch32, signs)
+    assert_allclose(t_batch32, t_batch, 1e-5)
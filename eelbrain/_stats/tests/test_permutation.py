@@ -4,7 +4,8 @@ import numpy as np
 
 from eelbrain import Factor, Var
 from eelbrain._stats.permutation import (
-    resample, permute_order, permute_sign_flip)
+    permutation_batches, permutation_key, resample, permute_order,
+    permute_sign_flip)
 
 
 def test_permutation():
@@ -53,3 +54,31 @@ def test_permutation_sign_flip():
     # make sure sequence is stable
     eq_(map(tuple, permute_sign_flip(4, 3)),
         [(-1, 1, -1, -1), (-1, -1, 1, -1), (1, -1, -1, 1)])
+
+    # permutations with the same key start with the same sequence
+    for n, k1, k2 in ((5, 10, 20), (10, 10, 20), (7, 10, 30)):
+        res1 = map(tuple, permute_sign_flip(n, k1))
+        res2 = map(tuple, permute_sign_flip(n, k2))
+        if permutation_key(n, k1, sign_flip=True) == \
+                permutation_key(n, k2, sign_flip=True):
+            eq_(res2[:k1], res1)
+        else:
+            assert_not_equal(res2[:k1], res1)
+    # random.sample() switches algorithm between 10 and 30 samples for n=7
+    assert_not_equal(permutation_key(7, 10, sign_flip=True),
+                     permutation_key(7, 30, sign_flip=True))
+    eq_(permutation_key(66, 10, sign_flip=True),
+        ('sign-flip', 66, 10))
+
+
+def test_permutation_batches():
+    "Test permutation_batches()"
+    perms = map(tuple, permute_order(5, 7))
+    batches = list(permutation_batches(permute_order(5, 7), 3))
+    eq_(map(len, batches), [3, 3, 1])
+    eq_(map(tuple, np.vstack(batches)), perms)
+
+    signs = map(tuple, permute_sign_flip(5, 7))
+    batches = list(permutation_batches(permute_sign_flip(5, 7), 4))
+    eq_(batches[0].dtype, np.int8)
+    eq_(map(tuple, np.vstack(batches)), signs)
@@ -90,6 +90,16 @@ def test_lm():
     assert_allclose(betas, sp_betas)
 
 
+def test_rankdata():
+    "Test rankdata()"
+    np.random.seed(0)
+    x = np.random.randint(0, 5, (3, 4, 20)).astype(float)
+    ranks = stats.rankdata(x)
+    eq_(ranks.shape, x.shape)
+    for index in np.ndindex(3, 4):
+        assert_equal(ranks[index], scipy.stats.rankdata(x[index]))
+
+
 def test_sem_and_variability():
     "Test variability() and standard_error_of_the_mean() functions"
     ds = datasets.get_loftus_masson_1994()
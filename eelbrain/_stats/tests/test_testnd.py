@@ -4,21 +4,111 @@ from __future__ import print_function
 from itertools import izip
 import cPickle as pickle
 import logging
+import os
 
 from nose.tools import (eq_, ok_, assert_equal, assert_not_equal,
                         assert_greater, assert_greater_equal, assert_less,
                         assert_in, assert_not_in, assert_raises)
 import numpy as np
 from numpy.testing import assert_array_equal, assert_allclose
+from scipy import ndimage
 
 import eelbrain
-from eelbrain import (NDVar, Categorial, Scalar, UTS, Sensor, configure,
-                      datasets, testnd, set_log_level, cwt_morlet)
+from eelbrain import (Factor, NDVar, Categorial, Scalar, UTS, Sensor,
+                      configure, datasets, testnd, set_log_level, cwt_morlet)
 from eelbrain._exceptions import ZeroVariance
-from eelbrain._stats.testnd import (Connectivity, _ClusterDist, label_clusters,
-                                    _MergedTemporalClusterDist, find_peaks)
+from eelbrain._stats import testnd as _testnd
+from eelbrain._stats.testnd import (
+    Connectivity, _ClusterDist, label_clusters, label_clusters_binary, tfce,
+    _MergedTemporalClusterDist, find_peaks, get_map_processor)
+from eelbrain._utils import parallel
 from eelbrain._utils.testing import (assert_dataobj_equal, assert_dataset_equal,
-                                     requires_mne_sample_data)
+                                     requires_mne_sample_data, TempDir)
+
+
+def test_adaptive():
+    "Test adaptive stopping of permutations"
+    ds = datasets.get_uts(True)
+    tests = (
+        (testnd.ttest_ind, ('utsnd', 'A', 'a1', 'a0'), {'pmin': 0.05}),
+        (testnd.anova, ('utsnd', 'A*B*rm'), {'pmin': 0.05}),
+    )
+    for n_workers in (0, True):
+        configure(n_workers=n_workers)
+        for func, args, kwargs in tests:
+            res = func(*args, ds=ds, samples=10000, adaptive=True, **kwargs)
+            assert_less(res.samples, 10000)
+            # the first permutations are the same as for a fixed number
+            res0 = func(*args, ds=ds, samples=res.samples, **kwargs)
+            if isinstance(res, testnd.anova):
+                pairs = izip(res._cdist, res0._cdist)
+            else:
+                pairs = ((res._cdist, res0._cdist),)
+            for cdist, cdist0 in pairs:
+                eq_(cdist.samples, res.samples)
+                eq_(cdist.max_samples, 10000)
+                assert_array_equal(cdist.dist, cdist0.dist)
+            assert_dataobj_equal(res.clusters, res0.clusters)
+    configure(n_workers=True)
+
+    # sign-flip permutations are drawn differently depending on samples
+    res = testnd.ttest_rel('utsnd', 'A', 'a1', 'a0', 'rm', ds=ds,
+                           samples=10000, pmin=0.05, adaptive=True)
+    assert_less(res.samples, 10000)
+    eq_(res._cdist.dist.shape, (res.samples,))
+
+    # info and pickling
+    res = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, samples=10000,
+                           pmin=0.05, adaptive=True)
+    assert_in("samples=%i, adaptive=True" % res.samples, repr(res))
+    assert_in("adaptive stopping, maximum 10000", res.info_list().get_html())
+    res_ = pickle.loads(pickle.dumps(res, pickle.HIGHEST_PROTOCOL))
+    eq_(res_.samples, res.samples)
+    eq_(res_._cdist.max_samples, 10000)
+
+    # no stopping for a complete set of permutations
+    res = testnd.ttest_1samp('utsnd', ds=ds[:12], samples=10000, pmin=0.05,
+                             adaptive=True)
+    eq_(res.samples, -1)
+    eq_(res._cdist.max_samples, None)
+
+    # parc: p-values within each parcel need to be decided
+    y = NDVar(np.zeros((20, 5, 2)),
+              ('case', UTS(0, 0.01, 5), Categorial('parc', ('a', 'b'))))
+    stat_map = np.ones((5, 2))
+    stat_map[:, 0] = 10
+    cdist = _ClusterDist(y, 200, None, parc='parc', adaptive=True)
+    cdist.add_original(stat_map)
+    cdist.dist[:, 0] = 5
+    cdist.dist[:, 1] = 0
+    ok_(cdist._p_decided(200))
+    # p = 0.05 in parcel b, which is hidden by the maximum across parcels
+    cdist.dist[:10, 1] = 2
+    ok_(not cdist._p_decided(200))
+    cdist.dist[:100, 1] = 2
+    ok_(cdist._p_decided(200))
+    # the same with clusters
+    cdist = _ClusterDist(y, 200, 0.5, parc='parc', adaptive=True)
+    cdist.add_original(stat_map)
+    eq_(cdist.n_clusters, 2)
+    cdist.dist[:, 0] = 100
+    cdist.dist[:, 1] = 0
+    cdist.dist[:10, 1] = 10
+    ok_(not cdist._p_decided(200))
+    cdist.dist[:100, 1] = 10
+    ok_(cdist._p_decided(200))
+
+    # parc test with adaptive stopping
+    x = np.random.RandomState(0).normal(0, 1, (20, 5, 2))
+    x[:10, :, 0] += 2
+    y = NDVar(x, ('case', UTS(0, 0.01, 5), Categorial('parc', ('a', 'b'))))
+    a = Factor('ab', repeat=10)
+    res = testnd.ttest_ind(y, a, 'a', 'b', samples=10000, parc='parc',
+                           adaptive=True)
+    res0 = testnd.ttest_ind(y, a, 'a', 'b', samples=res.samples, parc='parc')
+    eq_(res._cdist.dist.shape, (res.samples, 2))
+    assert_array_equal(res._cdist.dist, res0._cdist.dist)
+    assert_dataobj_equal(res.p, res0.p)
 
 
 def test_anova():
@@ -183,6 +273,63 @@ def test_anova_parc():
                   tfce=True, parc='source', **kwa)
 
 
+def test_checkpoint():
+    "Test resuming and extending permutations from checkpoints"
+    ds = datasets.get_uts(True)
+    tempdir = TempDir()
+    path = os.path.join(tempdir, 'test.checkpoint')
+    tests = (
+        (testnd.ttest_rel, ('utsnd', 'A', 'a1', 'a0', 'rm'), {'pmin': 0.05}),
+        (testnd.ttest_ind, ('utsnd', 'A', 'a1', 'a0'), {'tfce': True}),
+        (testnd.anova, ('utsnd', 'A*B*rm'), {'pmin': 0.05}),
+    )
+    for func, args, kwargs in tests:
+        res = func(*args, ds=ds, samples=20, **kwargs)
+        # extend an existing result
+        testnd.write_checkpoint(res, path)
+        res_ext = func(*args, ds=ds, samples=40, checkpoint=path, **kwargs)
+        ok_(not os.path.exists(path))
+        res_full = func(*args, ds=ds, samples=40, **kwargs)
+        eq_(res_ext.samples, 40)
+        if isinstance(res, testnd.anova):
+            pairs = izip(res_ext._cdist, res_full._cdist)
+        else:
+            pairs = ((res_ext._cdist, res_full._cdist),)
+        for cdist, cdist_full in pairs:
+            assert_array_equal(cdist.dist, cdist_full.dist)
+
+    # checkpoint from a different test is ignored
+    res = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, samples=20,
+                           pmin=0.05)
+    testnd.write_checkpoint(res, path)
+    res = testnd.ttest_ind('utsnd', 'B', 'b1', 'b0', ds=ds, samples=40,
+                           pmin=0.05, checkpoint=path)
+    res_full = testnd.ttest_ind('utsnd', 'B', 'b1', 'b0', ds=ds, samples=40,
+                                pmin=0.05)
+    assert_array_equal(res._cdist.dist, res_full._cdist.dist)
+
+    # checkpoint with a different sequence of permutations is ignored
+    res = testnd.ttest_rel('utsnd', 'A', 'a1', 'a0', 'rm', ds=ds, samples=20,
+                           pmin=0.05)
+    res._cdist.permutation = res._cdist.permutation[:2] + ('pool',)
+    res._cdist.dist[:] = 0
+    testnd.write_checkpoint(res, path)
+    res = testnd.ttest_rel('utsnd', 'A', 'a1', 'a0', 'rm', ds=ds, samples=40,
+                           pmin=0.05, checkpoint=path)
+    res_full = testnd.ttest_rel('utsnd', 'A', 'a1', 'a0', 'rm', ds=ds,
+                                samples=40, pmin=0.05)
+    assert_array_equal(res._cdist.dist, res_full._cdist.dist)
+
+    # tests without permutations
+    res = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds)
+    assert_raises(ValueError, testnd.write_checkpoint, res, path)
+    # tests from previous versions
+    res = testnd.ttest_ind('utsnd', 'A', 'a1', 'a0', ds=ds, samples=20,
+                           pmin=0.05)
+    res._cdist.permutation = None
+    assert_raises(ValueError, testnd.write_checkpoint, res, path)
+
+
 def test_clusterdist():
     "Test _ClusterDist class"
     shape = (10, 6, 6, 4)
@@ -358,6 +505,151 @@ def test_corr():
     assert_dataobj_equal(res.p, res_.p)
 
 
+def test_float32():
+    "Test permutation tests computed with float32"
+    ds = datasets.get_uts(True)
+    tests = (
+        (testnd.ttest_rel, ('utsnd', 'A', 'a1', 'a0', 'rm'), {'pmin': 0.05}),
+        (testnd.ttest_ind, ('utsnd', 'A', 'a1', 'a0'), {'tfce': True}),
+        (testnd.t_contrast_rel, ('utsnd', 'A', 'a1>a0', 'rm'), {'pmin': 0.05}),
+        (testnd.corr, ('utsnd', 'Y', 'rm'), {'pmin': 0.05}),
+        (testnd.anova, ('utsnd', 'A*B*rm'), {'pmin': 0.05}),
+        (testnd.ttest_1samp, ('utsnd',), {}),
+    )
+    for n_workers in (0, True):
+        configure(n_workers=n_workers)
+        for func, args, kwargs in tests:
+            res = func(*args, ds=ds, samples=100, **kwargs)
+            res32 = func(*args, ds=ds, samples=100, dtype=np.float32, **kwargs)
+            if isinstance(res, testnd.anova):
+                pairs = izip(res._cdist, res32._cdist)
+            else:
+                pairs = ((res._cdist, res32._cdist),)
+            for cdist, cdist32 in pairs:
+                eq_(cdist32.dtype, np.float32)
+                assert_allclose(cdist32.dist, cdist.dist, 1e-4)
+            if 'pmin' in kwargs:
+                assert_allclose(res32.clusters['p'].x, res.clusters['p'].x,
+                                atol=0.02)
+            else:
+                assert_allclose(res32.p.x, res.p.x, atol=0.02)
+            assert_in("dtype=np.float32", repr(res32))
+    configure(n_workers=True)
+
+    # pickling
+    res_ = pickle.loads(pickle.dumps(res32, pickle.HIGHEST_PROTOCOL))
+    eq_(res_._cdist.dtype, np.float32)
+    # invalid dtype
+    assert_raises(ValueError, testnd.ttest_ind, 'utsnd', 'A', ds=ds,
+                  samples=10, dtype=np.int32)
+
+
+def test_parc_processors():
+    "Test map processors with parcellation"
+    np.random.seed(0)
+    dims = (Categorial('parc', ('a', 'b', 'c', 'd')), UTS(0, 0.01, 20))
+    connectivity = Connectivity(dims)
+    shape = (4, 20)
+    parc = (np.array([0, 2]), np.array([1]), np.array([3]))
+    stat_maps = np.random.normal(0, 2, (5,) + shape)
+    for tail in (-1, 0, 1):
+        raw = get_map_processor('raw', tail, (1,), parc)
+        tfce_ = get_map_processor('tfce', tail, (1,), parc, shape,
+                                  connectivity)
+        cluster = get_map_processor('cluster', tail, (1,), parc, shape,
+                                    connectivity, 1.5, None)
+        v_raw = raw.max_stats(stat_maps.copy())
+        for stat_map, v_raw_i in izip(stat_maps, v_raw):
+            # raw
+            if tail == 0:
+                v = np.abs(stat_map).max(1)
+            elif tail > 0:
+                v = stat_map.max(1)
+            else:
+                v = -stat_map.min(1)
+            target = [v[idx].max() for idx in parc]
+            assert_array_equal(raw.max_stat(stat_map.copy()), target)
+            assert_array_equal(v_raw_i, target)
+            # TFCE
+            v = tfce(stat_map, tail, connectivity).max(1)
+            assert_allclose(tfce_.max_stat(stat_map),
+                            [v[idx].max() for idx in parc])
+            # clusters
+            cmap, cids = label_clusters(stat_map, 1.5, tail, connectivity,
+                                        None)
+            target = []
+            for idx in parc:
+                clusters_v = ndimage.sum(stat_map[idx], cmap[idx], cids)
+                target.append(np.abs(clusters_v).max() if len(cids) else 0)
+            assert_allclose(cluster.max_stat(stat_map), target)
+
+
+def test_permutation_batch():
+    "Test that evaluating permutations in blocks does not change results"
+    ds = datasets.get_uts(True)
+    Y = ds['Y']
+    ds['utsnd'].x[:, 3:5, 50:65] += Y.x[:, None, None]
+    thresholds = ({}, {'pmin': 0.05}, {'tfce': True})
+    tests = (
+        (testnd.ttest_1samp, ('utsnd',), {'sub': "A == 'a1'"}, thresholds),
+        (testnd.ttest_rel, ('utsnd', 'A', 'a1', 'a0', 'rm'), {}, thresholds),
+        (testnd.ttest_ind, ('utsnd', 'A', 'a1', 'a0'), {}, thresholds),
+        (testnd.corr, ('utsnd', 'Y'), {}, thresholds[:2]),
+        (testnd.corr, ('utsnd', 'Y'), {'match': 'rm'}, thresholds[:2]),
+    )
+    batch_size = _testnd.PERMUTATION_BATCH_SIZE
+    configure(n_workers=0)
+    try:
+        for func, args, kwargs, thresholds_ in tests:
+            for threshold in thresholds_:
+                kwargs_ = dict(kwargs, ds=ds, samples=30, **threshold)
+                _testnd.PERMUTATION_BATCH_SIZE = 0
+                res0 = func(*args, **kwargs_)
+                _testnd.PERMUTATION_BATCH_SIZE = 8
+                res = func(*args, **kwargs_)
+                assert_array_equal(res._cdist.dist, res0._cdist.dist)
+                # multiprocessing
+                configure(n_workers=True)
+                res = func(*args, **kwargs_)
+                assert_array_equal(np.sort(res._cdist.dist),
+                                   np.sort(res0._cdist.dist))
+                configure(n_workers=0)
+    finally:
+        _testnd.PERMUTATION_BATCH_SIZE = batch_size
+        configure(n_workers=True)
+
+
+def test_persistent_workers():
+    "Test running several tests with the same worker processes"
+    ds = datasets.get_uts(True)
+    tests = (
+        (testnd.ttest_1samp, ('utsnd',), {'pmin': 0.05}),
+        (testnd.ttest_ind, ('utsnd', 'A', 'a1', 'a0'), {}),
+        (testnd.corr, ('utsnd', 'Y'), {'pmin': 0.05}),
+        (testnd.anova, ('utsnd', 'A*B*rm'), {'pmin': 0.05}),
+    )
+    configure(n_workers=0)
+    ress = [func(*args, ds=ds, samples=20, **kwargs) for func, args, kwargs in
+            tests]
+    configure(n_workers=True, persistent_workers=True)
+    pool = None
+    for (func, args, kwargs), res0 in izip(tests, ress):
+        res = func(*args, ds=ds, samples=20, **kwargs)
+        if pool is None:
+            pool = parallel._POOL
+        assert parallel._POOL is pool
+        if isinstance(res, testnd.anova):
+            for cdist, cdist0 in izip(res._cdist, res0._cdist):
+                assert_array_equal(cdist.dist, cdist0.dist)
+        else:
+            assert_array_equal(res._cdist.dist, res0._cdist.dist)
+    assert pool.is_alive()
+    configure(persistent_workers=False)
+    assert parallel._POOL is None
+    assert not pool.is_alive()
+    configure(n_workers=True)
+
+
 def test_t_contrast():
     ds = datasets.get_uts()
 
@@ -422,6 +714,55 @@ def test_labeling():
     assert_equal(len(cids), 6)
     assert_array_equal(cmap > 0, np.abs(pmap) > 2)
 
+    # cluster size criteria
+    np.random.seed(0)
+    bin_map = np.random.normal(0, 1, shape) > 0.5
+    cmap, cids_all = label_clusters_binary(bin_map, conn)
+    for criteria in ([((0,), 3)], [((1,), 2)], [((0,), 2), ((1,), 2)]):
+        cmap, cids = label_clusters_binary(bin_map, conn, criteria)
+        target = [i for i in cids_all if
+                  all(np.equal(cmap, i).any(axes).sum() >= v for axes, v in
+                      criteria)]
+        assert_array_equal(cids, target)
+
+
+def test_tfce():
+    "Test TFCE against labeling clusters at each threshold"
+    dh, e, h = 0.1, 0.5, 2.
+
+    def tfce_by_labeling(stat_map, tail, conn):
+        out = np.zeros(stat_map.shape)
+        heights = []
+        if tail >= 0:
+            heights.extend(np.arange(dh, stat_map.max(), dh))
+        if tail <= 0:
+            heights.extend(np.arange(-dh, stat_map.min(), -dh))
+        for height in heights:
+            if height > 0:
+                bin_map = stat_map >= height
+            else:
+                bin_map = stat_map <= height
+            cmap, cids = label_clusters_binary(bin_map, conn)
+            for cid in cids:
+                index = cmap == cid
+                out[index] += index.sum() ** e * abs(height) ** h
+        return out
+
+    edges = np.array([(0, 1), (0, 3), (1, 2), (2, 3), (3, 4)], np.uint32)
+    dims_list = (
+        (Scalar('graph', range(5), connectivity=edges), UTS(0, 0.01, 20)),
+        (UTS(0, 0.01, 20), Scalar('scalar', range(5))),
+        (Scalar('graph', range(5), connectivity=edges),
+         Scalar('none', range(3), connectivity='none'), UTS(0, 0.01, 10)),
+    )
+    np.random.seed(0)
+    for dims in dims_list:
+        conn = Connectivity(dims)
+        x = np.random.normal(0, 3, [len(dim) for dim in dims])
+        for tail in (-1, 0, 1):
+            assert_allclose(tfce(x, tail, conn),
+                            tfce_by_labeling(x, tail, conn), 1e-10)
+
 
 def test_ttest_1samp():
     "Test testnd.ttest_1samp()"
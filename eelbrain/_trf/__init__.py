@@ -1 +1,4 @@
-from ._boosting import boosting, BoostingResult
+from ._boosting import (
+    boosting, boosting_permutation, boosting_sweep, BoostingPermutation,
+    BoostingResult, BoostingSweep)
+from ._cache import BoostingCache
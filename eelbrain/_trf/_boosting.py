@@ -14,7 +14,8 @@ x2 = ds['x2']
 from __future__ import division
 from inspect import getargspec
 from itertools import chain, izip, product
-from math import floor
+from math import ceil, floor
+from numbers import Real
 from multiprocessing import Process, Queue
 from multiprocessing.sharedctypes import RawArray
 import signal
@@ -22,14 +23,17 @@ import time
 from threading import Event, Thread
 
 import numpy as np
-from scipy.stats import spearmanr
 from tqdm import tqdm
 
+from .. import _colorspaces as cs
 from .._config import CONFIG
 from .._data_obj import NDVar, UTS, dataobj_repr
-from .._stats.error_functions import (l1, l2, l1_for_delta, l2_for_delta,
-                                      update_error)
+from .._stats.error_functions import l1, l2
+from .._stats.stats import rankdata
 from .._utils import LazyProperty
+from ._boosting_opt import (
+    boost_segs as boost_segs_opt, kernel_at, l2_xx, l2_xy)
+from ._cache import BoostingCache, boosting_key
 from .shared import RevCorrData
 
 
@@ -39,12 +43,21 @@ VERSION = 6
 # cross-validation
 N_SEGS = 10
 
+# maximum number of y signals that are boosted together
+Y_BLOCK_SIZE = 64
+
+# minimum FFT length for applying kernels
+FFT_BLOCK_SIZE = 4096
+
+# maximum number of elements in the l2_xx table, (n_stims * trf_length) ** 2
+# (for larger kernels the l2 error is updated directly)
+L2_XX_MAX_SIZE = 2 ** 22
+
 # process messages
 JOB_TERMINATE = -1
 
 # error functions
 ERROR_FUNC = {'l2': l2, 'l1': l1}
-DELTA_ERROR_FUNC = {'l2': l2_for_delta, 'l1': l1_for_delta}
 
 
 class BoostingResult(object):
@@ -127,6 +140,8 @@ class BoostingResult(object):
         argspec = getargspec(boosting)
         names = argspec.args[-len(argspec.defaults):]
         for name, default in izip(names, argspec.defaults):
+            if name == 'cache':
+                continue
             value = getattr(self, name)
             if value != default:
                 items.append('%s=%r' % (name, value))
@@ -169,16 +184,20 @@ class BoostingResult(object):
 
 
 def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
-             error='l2'):
+             error='l2', cache=None):
     """Estimate a temporal response function through boosting
 
     Parameters
     ----------
-    y : NDVar
-        Signal to predict.
+    y : NDVar | sequence of NDVar
+        Signal to predict. For data in multiple discontinuous segments (e.g.,
+        trials or runs), ``y`` can have a case dimension (each case is a
+        segment), or it can be a sequence with one NDVar per segment.
     x : NDVar | sequence of NDVar
         Signal to use to predict ``y``. Can be sequence of NDVars to include
-        multiple predictors. Time dimension must correspond to ``y``.
+        multiple predictors. Time dimension must correspond to ``y``. If
+        ``y`` is a sequence of segments, ``x`` is a sequence of the same
+        length with the predictor(s) for each segment.
     tstart : float
         Start of the TRF in seconds.
     tstop : float
@@ -197,6 +216,11 @@ def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
         i.e. ``delta`` is constant.
     error : 'l2' | 'l1'
         Error function to use (default is ``l2``).
+    cache : str | BoostingCache
+        Cache results in this directory (or :class:`BoostingCache`). If a
+        result for identical ``y``, ``x`` and parameters is in the cache, it
+        is returned without boosting (can not be combined with
+        ``scale_data='inplace'``).
 
     Returns
     -------
@@ -208,6 +232,11 @@ def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
     -----
     The boosting algorithm is described in [1]_.
 
+    With multiple segments, the kernel is never applied across segment
+    boundaries. If there are at least 10 segments, the cross-validation folds
+    consist of whole segments; otherwise, each segment is divided into 10
+    parts and each fold tests on one part of every segment.
+
     References
     ----------
     .. [1] David, S. V., Mesgarani, N., & Shamma, S. A. (2007). Estimating
@@ -218,99 +247,616 @@ def boosting(y, x, tstart, tstop, scale_data=True, delta=0.005, mindelta=None,
     # check arguments
     mindelta_ = delta if mindelta is None else mindelta
 
+    if cache is not None:
+        if scale_data == 'inplace':
+            raise ValueError("scale_data='inplace' can not be combined with "
+                             "cache, because cached results are returned "
+                             "without scaling y and x")
+        if not isinstance(cache, BoostingCache):
+            cache = BoostingCache(cache)
+        key = boosting_key(y, x, tstart, tstop, scale_data, delta, mindelta,
+                           error, VERSION)
+        res = cache.get(key)
+        if res is not None:
+            return res
+
     data = RevCorrData(y, x, error, scale_data)
-    y_data = data.y
-    x_data = data.x
-    n_y = len(y_data)
-    n_x = len(x_data)
+    i_start, trf_length = trf_samples(data.time.tstep, tstart, tstop)
+    n_y = len(data.y)
+    pbar = tqdm(desc="Boosting %i signals" % n_y if n_y > 1 else "Boosting",
+                total=n_y * N_SEGS)
+    booster = Booster(data, error)
+    try:
+        h_x, _, res, dt = booster.run(i_start, trf_length, delta, mindelta_,
+                                      pbar=pbar)
+    finally:
+        booster.close()
+        pbar.close()
+    res = booster.package(h_x, res, dt, tstart, tstop, delta, mindelta,
+                          scale_data)
+    if cache is not None:
+        cache.put(key, res)
+    return res
+
+
+def boosting_sweep(y, x, tstart, tstop, scale_data=True, delta=0.005,
+                   mindelta=None, error='l2', warm_start=True):
+    """Estimate temporal response functions for a grid of parameters
+
+    Equivalent to calling :func:`boosting` for each combination of the
+    parameter values, but the data are prepared and the worker processes are
+    started only once (once per ``error`` function).
+
+    Parameters
+    ----------
+    y : NDVar | sequence of NDVar
+        Signal to predict (see :func:`boosting`).
+    x : NDVar | sequence of NDVar
+        Signal to use to predict ``y`` (see :func:`boosting`).
+    tstart : float | sequence of float
+        Start of the TRF in seconds.
+    tstop : float | sequence of float
+        Stop of the TRF in seconds.
+    scale_data : bool
+        Scale ``y`` and ``x`` before boosting (see :func:`boosting`; scaling
+        in place is not supported).
+    delta : scalar | sequence of scalar
+        Step for changes in the kernel.
+    mindelta : None | scalar | sequence of (None | scalar)
+        Smallest step (see :func:`boosting`).
+    error : 'l2' | 'l1' | sequence of str
+        Error function to use.
+    warm_start : bool
+        Start boosting with each ``delta`` value from the kernels estimated
+        with the next larger ``delta`` value (with the same other parameters),
+        instead of from 0 (default ``True``). Results for smaller ``delta``
+        are then not identical to the result of a separate call to
+        :func:`boosting`.
+
+    Returns
+    -------
+    sweep : BoostingSweep
+        Collection of :class:`BoostingResult` objects.
+    """
+    if not isinstance(scale_data, bool):
+        raise TypeError("scale_data=%r, need bool" % (scale_data,))
+    tstarts, tstops, deltas, mindeltas, errors = (
+        _sweep_values(v) for v in (tstart, tstop, delta, mindelta, error))
+    for error_ in errors:
+        if error_ not in ERROR_FUNC:
+            raise ValueError("error=%r" % (error_,))
+    # coarse to fine
+    deltas_desc = sorted(deltas, reverse=True)
+
+    results = {}
+    pbar = None
+    try:
+        for error_ in errors:
+            data = RevCorrData(y, x, error_, scale_data)
+            n_y = len(data.y)
+            if pbar is None:
+                n_runs = len(tstarts) * len(tstops) * len(deltas) * \
+                         len(mindeltas) * len(errors)
+                pbar = tqdm(desc="Boosting sweep (%i settings)" % n_runs,
+                            total=n_runs * n_y * N_SEGS)
+            booster = Booster(data, error_)
+            try:
+                for tstart_, tstop_, mindelta_ in product(tstarts, tstops,
+                                                          mindeltas):
+                    i_start, trf_length = trf_samples(data.time.tstep, tstart_,
+                                                      tstop_)
+                    h_init = None
+                    for delta_ in deltas_desc:
+                        h_x, h_folds, res, dt = booster.run(
+                            i_start, trf_length, delta_,
+                            delta_ if mindelta_ is None else mindelta_,
+                            h_init, warm_start, pbar)
+                        if warm_start:
+                            h_init = h_folds
+                        key = (tstart_, tstop_, delta_, mindelta_, error_)
+                        results[key] = booster.package(
+                            h_x, res, dt, tstart_, tstop_, delta_, mindelta_,
+                            scale_data)
+            finally:
+                booster.close()
+    finally:
+        if pbar is not None:
+            pbar.close()
+    return BoostingSweep(tstarts, tstops, deltas, mindeltas, errors, results)
+
+
+def _sweep_values(value):
+    if value is None or isinstance(value, (basestring, Real)):
+        return (value,)
+    values = tuple(value)
+    if not values:
+        raise ValueError("Empty parameter sequence")
+    elif len(set(values)) < len(values):
+        raise ValueError("Duplicate parameter values: %r" % (values,))
+    return values
+
+
+class BoostingSweep(object):
+    """Results from :func:`boosting_sweep`
+
+    Results for individual parameter combinations can be retrieved with
+    :meth:`get`, or by indexing with a ``(tstart, tstop, delta, mindelta,
+    error)`` tuple. Iterating yields the keys in the order of the parameter
+    grid.
+
+    Attributes
+    ----------
+    tstart, tstop, delta, mindelta, error : tuple
+        Parameter values.
+    results : dict
+        ``{(tstart, tstop, delta, mindelta, error): BoostingResult}``
+        dictionary.
+    """
+    _params = ('tstart', 'tstop', 'delta', 'mindelta', 'error')
+
+    def __init__(self, tstart, tstop, delta, mindelta, error, results):
+        self.tstart = tstart
+        self.tstop = tstop
+        self.delta = delta
+        self.mindelta = mindelta
+        self.error = error
+        self.results = results
+
+    def __getstate__(self):
+        return {attr: getattr(self, attr) for attr in
+                getargspec(self.__init__).args[1:]}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __repr__(self):
+        items = ['%i results' % len(self.results)]
+        for param in self._params:
+            values = getattr(self, param)
+            if len(values) > 1:
+                items.append('%s=%r' % (param, values))
+        return '<BoostingSweep: %s>' % ', '.join(items)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __iter__(self):
+        return product(*(getattr(self, param) for param in self._params))
+
+    def __getitem__(self, key):
+        return self.results[key]
+
+    def get(self, **params):
+        """Retrieve the result for one combination of parameters
+
+        Parameters
+        ----------
+        tstart, tstop, delta, mindelta, error
+            Parameter values (parameters with a single value can be omitted).
+
+        Returns
+        -------
+        result : BoostingResult
+            Result for the specified parameters.
+        """
+        key = []
+        for param in self._params:
+            values = getattr(self, param)
+            if param in params:
+                value = params.pop(param)
+                if value not in values:
+                    raise ValueError("%s=%r: not in sweep (%r)" %
+                                     (param, value, values))
+            elif len(values) == 1:
+                value = values[0]
+            else:
+                raise TypeError("Need to specify %s" % param)
+            key.append(value)
+        if params:
+            raise TypeError("Invalid parameters: %s" % ', '.join(params))
+        return self.results[tuple(key)]
+
+
+def boosting_permutation(y, x, tstart, tstop, samples=100, permute='shift',
+                         scale_data=True, delta=0.005, mindelta=None,
+                         error='l2', seed=0):
+    """Estimate the distribution of boosting fit statistics under the null
+
+    Boosting is done for ``y`` with ``samples`` permuted versions of ``x``
+    (and with the original ``x``) in a single pooled run: the data are
+    prepared and the worker processes are started only once, and each
+    worker generates the permuted ``x`` from the shared data.
+
+    Parameters
+    ----------
+    y : NDVar | sequence of NDVar
+        Signal to predict (see :func:`boosting`).
+    x : NDVar | sequence of NDVar
+        Signal to use to predict ``y`` (see :func:`boosting`).
+    tstart : float
+        Start of the TRF in seconds.
+    tstop : float
+        Stop of the TRF in seconds.
+    samples : int
+        Number of permutations (default 100).
+    permute : 'shift' | 'segments'
+        How to permute ``x``: ``'shift'`` (default) circularly shifts ``x``
+        within each segment by a random amount between 10% and 90% of the
+        segment length; ``'segments'`` randomly reassigns the segments of
+        ``x`` to the segments of ``y`` (requires multiple segments of equal
+        length).
+    scale_data : bool | 'inplace'
+        Scale ``y`` and ``x`` before boosting (see :func:`boosting`).
+    delta : scalar
+        Step for changes in the kernel.
+    mindelta : scalar
+        Smallest step (see :func:`boosting`).
+    error : 'l2' | 'l1'
+        Error function to use (default is ``l2``).
+    seed : None | int
+        Seed for :mod:`numpy.random` to make the permutations replicable
+        (``None`` to skip seeding; default 0).
+
+    Returns
+    -------
+    result : BoostingPermutation
+        Result with the original ``x`` and fit statistics for the permutations.
+    """
+    if samples < 1:
+        raise ValueError("samples=%r" % (samples,))
+    mindelta_ = delta if mindelta is None else mindelta
 
-    # prepare trf (by cropping data)
-    tstep = data.time.tstep
+    data = RevCorrData(y, x, error, scale_data)
+    permutations = x_permutations(data.y.shape[1], data.segments, samples,
+                                  permute, seed)
+    i_start, trf_length = trf_samples(data.time.tstep, tstart, tstop)
+    n_y = len(data.y)
+    pbar = tqdm(desc="Boosting %i permutations" % samples,
+                total=(samples + 1) * n_y * N_SEGS)
+    booster = Booster(data, error, permutations)
+    try:
+        h_x, res, res_perm, dt = booster.run_permutations(
+            i_start, trf_length, delta, mindelta_, pbar)
+    finally:
+        booster.close()
+        pbar.close()
+    result = booster.package(h_x, res, dt, tstart, tstop, delta, mindelta,
+                             scale_data)
+    rs, rrs, errs = res_perm.swapaxes(0, 1)
+    rs[np.isnan(rs)] = 0
+    r = data.package_distribution(rs, 'r', 'correlation')
+    rr = data.package_distribution(rrs, 'r', 'rank correlation')
+    err = data.package_distribution(errs, None, 'fit error')
+    return BoostingPermutation(result, r, rr, err, samples, permute, seed)
+
+
+class BoostingPermutation(object):
+    """Results from :func:`boosting_permutation`
+
+    Attributes
+    ----------
+    result : BoostingResult
+        Result with the original ``x``.
+    r : NDVar
+        Correlation between the measured and the predicted response for each
+        permutation (the case dimension corresponds to permutations).
+    spearmanr : NDVar
+        As ``r``, the Spearman rank correlation.
+    fit_error : NDVar
+        Fit error for each permutation.
+    r_p : float | NDVar
+        Proportion of permutations in which ``r`` is at least as large as with
+        the original ``x`` (with the original ``x`` counted as one of the
+        permutations).
+    samples : int
+        Number of permutations.
+    permute : str
+        How ``x`` was permuted.
+    seed : None | int
+        Seed used for the permutations.
+    """
+    def __init__(self, result, r, spearmanr, fit_error, samples, permute,
+                 seed):
+        self.result = result
+        self.r = r
+        self.spearmanr = spearmanr
+        self.fit_error = fit_error
+        self.samples = samples
+        self.permute = permute
+        self.seed = seed
+
+    def __getstate__(self):
+        return {attr: getattr(self, attr) for attr in
+                getargspec(self.__init__).args[1:]}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def __repr__(self):
+        return ('<BoostingPermutation: %s, samples=%i, permute=%r>' %
+                (repr(self.result)[1:-1], self.samples, self.permute))
+
+    @LazyProperty
+    def r_p(self):
+        r = self.result.r
+        if isinstance(r, NDVar):
+            n = (self.r.x >= r.x).sum(0)
+        else:
+            n = (self.r.x >= r).sum()
+        p = (n + 1) / (self.samples + 1)
+        if isinstance(r, NDVar):
+            return NDVar(p, r.dims, cs.sig_info(), 'p')
+        return p
+
+
+def trf_samples(tstep, tstart, tstop):
+    "Start index and length of the TRF in samples"
     i_start = int(round(tstart / tstep))
     i_stop = int(round(tstop / tstep))
-    trf_length = i_stop - i_start
-    if i_start < 0:
-        x_data = x_data[:, -i_start:]
-        y_data = y_data[:, :i_start]
-    elif i_start > 0:
-        x_data = x_data[:, :-i_start]
-        y_data = y_data[:, i_start:]
+    return i_start, i_stop - i_start
 
-    # progress bar
-    pbar = tqdm(desc="Boosting %i signals" % n_y if n_y > 1 else "Boosting",
-                total=n_y * 10)
-    # result containers
-    res = np.empty((3, n_y))  # r, rank-r, error
-    h_x = np.empty((n_y, n_x, trf_length))
-    # boosting
-    if CONFIG['n_workers']:
-        # Make sure cross-validations are added in the same order, otherwise
-        # slight numerical differences can occur
-        job_queue, result_queue = setup_workers(
-            y_data, x_data, trf_length, delta, mindelta_, N_SEGS, error)
-        stop_jobs = Event()
-        thread = Thread(target=put_jobs, args=(job_queue, n_y, N_SEGS, stop_jobs))
-        thread.daemon = True
-        thread.start()
-
-        # collect results
-        try:
-            h_segs = {}
-            for _ in xrange(n_y * N_SEGS):
-                y_i, seg_i, h = result_queue.get()
-                pbar.update()
-                if y_i in h_segs:
-                    h_seg = h_segs[y_i]
-                    h_seg[seg_i] = h
+
+class Booster(object):
+    """Boost TRFs for one dataset with different settings
+
+    The data and the worker processes are set up once and reused for each
+    call to :meth:`run`. Call :meth:`close` to terminate the workers.
+
+    Parameters
+    ----------
+    data : RevCorrData
+        Data.
+    error : 'l2' | 'l1'
+        Error function (the data need to be scaled for the same function).
+    """
+    def __init__(self, data, error, permutations=None):
+        self.data = data
+        self.error = error
+        self.n_y = len(data.y)
+        self.n_x = len(data.x)
+        self._cropped = CropCache(data.x, data.y, data.segments, permutations)
+        self._n_iter = None
+        if CONFIG['n_workers']:
+            self._job_queue, self._result_queue = setup_workers(
+                data.y, data.x, N_SEGS, error, data.segments, permutations)
+        else:
+            self._job_queue = self._result_queue = None
+
+    def close(self):
+        "Terminate the worker processes"
+        if self._job_queue is not None:
+            for _ in xrange(CONFIG['n_workers']):
+                self._job_queue.put(JOB_TERMINATE)
+            self._job_queue = self._result_queue = None
+
+    def _job_blocks(self, n_perm=1):
+        "Blocks of signals, the most expensive first if costs are known"
+        n_workers = CONFIG['n_workers'] or 1
+        blocks = y_blocks(self.n_y, int(ceil(n_workers / n_perm)))
+        if self._n_iter is None:
+            return [np.arange(start, stop) for start, stop in blocks]
+        order = np.argsort(-self._n_iter, kind='mergesort')
+        return [order[start:stop] for start, stop in blocks]
+
+    def run(self, i_start, trf_length, delta, mindelta, h_init=None,
+            return_folds=False, pbar=None):
+        """Boost TRFs with one setting
+
+        Parameters
+        ----------
+        i_start : int
+            TRF start (in samples).
+        trf_length : int
+            TRF length (in samples).
+        delta : scalar
+            Step of the adjustment.
+        mindelta : scalar
+            Smallest delta to use.
+        h_init : array (n_y, N_SEGS, n_x, trf_length)
+            Initial kernel for each cross-validation fold (warm start).
+        return_folds : bool
+            Return the kernel from each cross-validation fold.
+        pbar : tqdm
+            Progress bar to update.
+
+        Returns
+        -------
+        h_x : array (n_y, n_x, trf_length)
+            Kernels.
+        h_folds : None | array (n_y, N_SEGS, n_x, trf_length)
+            Kernel from each cross-validation fold (only with
+            ``return_folds=True``).
+        res : array (3, n_y)
+            Pearson r, rank r and fit error.
+        t_run : float
+            Time (in seconds).
+
+        Notes
+        -----
+        The number of boosting iterations for each signal is used as cost
+        estimate to schedule the most expensive signals first in the next
+        call.
+        """
+        t_start = time.time()
+        (h_x, h_folds, res), = self._boost(
+            i_start, trf_length, delta, mindelta, (None,), h_init,
+            return_folds, pbar)
+        return h_x, h_folds, res, time.time() - t_start
+
+    def run_permutations(self, i_start, trf_length, delta, mindelta,
+                         pbar=None):
+        """Boost TRFs for the original and all permuted versions of ``x``
+
+        Jobs for all permutations are submitted together, so that the workers
+        are kept busy throughout. Kernels for permutations are discarded as
+        soon as they are evaluated.
+
+        Parameters
+        ----------
+        i_start, trf_length, delta, mindelta, pbar
+            See :meth:`run`.
+
+        Returns
+        -------
+        h_x : array (n_y, n_x, trf_length)
+            Kernels for the original ``x``.
+        res : array (3, n_y)
+            Pearson r, rank r and fit error for the original ``x``.
+        res_perm : array (n_permutations, 3, n_y)
+            Pearson r, rank r and fit error for each permutation.
+        t_run : float
+            Time (in seconds).
+        """
+        t_start = time.time()
+        perms = [None]
+        perms.extend(xrange(self._cropped.n_permutations))
+        results = self._boost(i_start, trf_length, delta, mindelta, perms,
+                              None, False, pbar)
+        h_x = results[0][0]
+        res = results[0][2]
+        res_perm = np.array([res_ for _, _, res_ in results[1:]])
+        return h_x, res, res_perm, time.time() - t_start
+
+    def _boost(self, i_start, trf_length, delta, mindelta, perms, h_init,
+               return_folds, pbar):
+        """Boost TRFs for one or more versions of ``x``
+
+        Parameters
+        ----------
+        perms : sequence of (None | int)
+            Permutations of ``x`` to boost (``None`` for the original ``x``).
+
+        Returns
+        -------
+        results : list of tuple
+            ``(h_x, h_folds, res)`` for each permutation in ``perms`` (see
+            :meth:`run`; ``h_x`` is ``None`` for permutations, whose kernels
+            are discarded after evaluation).
+        """
+        n_y = self.n_y
+        error = self.error
+        # result containers (allocated when the first result for a permutation
+        # arrives, and released when it is evaluated)
+        h_x = {}
+        has_h = {}
+        h_folds = {}
+        h_segs = {}
+        remaining = dict.fromkeys(perms, n_y * N_SEGS)
+        results = {}
+        n_iter = np.zeros(n_y, int)
+
+        def add_result(perm, y_index, folds, h_sum, n_h, n_iter_, fold_hs):
+            if perm not in h_x:
+                h_x[perm] = np.zeros((n_y, self.n_x, trf_length))
+                has_h[perm] = np.zeros(n_y, bool)
+                if return_folds:
+                    h_folds[perm] = np.zeros((n_y, N_SEGS, self.n_x,
+                                              trf_length))
+            n_iter[y_index] += n_iter_
+            if return_folds:
+                for y_i, hs in izip(y_index, fold_hs):
+                    for i, h in izip(folds, hs):
+                        if h is not None:
+                            h_folds[perm][y_i, i] = h
+            if len(folds) == N_SEGS:
+                has_h[perm][y_index] = n_h > 0
+                for y_i, h, n in izip(y_index, h_sum, n_h):
+                    if n:
+                        np.divide(h, n, h_x[perm][y_i])
+            else:
+                # collect folds and average them in order
+                for y_i, hs in izip(y_index, fold_hs):
+                    h_seg = h_segs.setdefault((perm, y_i), {})
+                    h_seg.update(izip(folds, hs))
                     if len(h_seg) == N_SEGS:
-                        del h_segs[y_i]
+                        del h_segs[perm, y_i]
                         hs = [h for h in (h_seg[i] for i in xrange(N_SEGS)) if
                               h is not None]
                         if hs:
-                            h = np.mean(hs, 0, out=h_x[y_i])
-                            res[:, y_i] = evaluate_kernel(y_data[y_i], x_data, h, error)
-                        else:
-                            h_x[y_i] = 0
-                            res[:, y_i] = 0.
+                            np.mean(hs, 0, out=h_x[perm][y_i])
+                        has_h[perm][y_i] = bool(hs)
+            if pbar is not None:
+                pbar.update(len(y_index) * len(folds))
+            remaining[perm] -= len(y_index) * len(folds)
+            if not remaining[perm]:
+                evaluate(perm)
+
+        def evaluate(perm):
+            x_data, y_data, segments = self._cropped.get(i_start, perm)
+            h_x_perm = h_x.pop(perm)
+            has_h_perm = has_h.pop(perm)
+            res = np.zeros((3, n_y))  # r, rank-r, error
+            for start, stop in y_blocks(n_y, 1):
+                index = np.flatnonzero(has_h_perm[start:stop]) + start
+                if len(index):
+                    res[:, index] = evaluate_kernel(
+                        y_data[index], x_data, h_x_perm[index], error,
+                        segments)
+            if perm is not None:
+                h_x_perm = None
+            results[perm] = (h_x_perm, h_folds.pop(perm, None), res)
+
+        # boosting
+        blocks = self._job_blocks(len(perms))
+        if self._job_queue is not None:
+            # split folds between jobs only if there are not enough blocks
+            # for all workers
+            n_groups = int(ceil(CONFIG['n_workers'] /
+                                (len(blocks) * len(perms))))
+            fold_groups = [tuple(folds) for folds in
+                           np.array_split(np.arange(N_SEGS), min(n_groups, N_SEGS))]
+            run_args = (i_start, trf_length, delta, mindelta)
+            jobs = []
+            for perm, y_index, folds in product(perms, blocks, fold_groups):
+                if h_init is None:
+                    h_init_i = None
                 else:
-                    h_segs[y_i] = {seg_i: h}
-        except KeyboardInterrupt:
-            stop_jobs.set()
-            raise
-    else:
-        for y_i, y_ in enumerate(y_data):
-            hs = []
-            for i in xrange(N_SEGS):
-                h = boost_1seg(x_data, y_, trf_length, delta, N_SEGS, i,
-                               mindelta_, error)
-                if h is not None:
-                    hs.append(h)
-                pbar.update()
-
-            if hs:
-                h = np.mean(hs, 0, out=h_x[y_i])
-                res[:, y_i] = evaluate_kernel(y_, x_data, h, error)
-            else:
-                h_x[y_i].fill(0)
-                res[:, y_i].fill(0.)
-
-    pbar.close()
-    dt = time.time() - pbar.start_t
-
-    # fit-evaluation statistics
-    rs, rrs, errs = res
-    isnan = np.isnan(rs)
-    rs[isnan] = 0
-    r = data.package_statistic(rs, 'r', 'correlation')
-    rr = data.package_statistic(rrs, 'r', 'rank correlation')
-    err = data.package_value(errs, 'fit error')
-
-    y_mean, y_scale, x_mean, x_scale = data.data_scale_ndvars()
-
-    return BoostingResult(data.package_kernel(h_x, tstart), r, isnan, dt, VERSION,
-                          delta, mindelta, error, rr, err,
-                          scale_data, y_mean, y_scale, x_mean, x_scale,
-                          data.y_name, data.x_name, tstart, tstop)
+                    h_init_i = h_init[np.ix_(y_index, folds)]
+                jobs.append((perm, y_index, folds, run_args, h_init_i,
+                             return_folds))
+            stop_jobs = Event()
+            thread = Thread(target=put_jobs,
+                            args=(self._job_queue, jobs, stop_jobs))
+            thread.daemon = True
+            thread.start()
+
+            # collect results
+            try:
+                for _ in xrange(len(jobs)):
+                    add_result(*self._result_queue.get())
+            except KeyboardInterrupt:
+                stop_jobs.set()
+                raise
+        else:
+            folds = tuple(xrange(N_SEGS))
+            for perm in perms:
+                x_data, y_data, segments = self._cropped.get(i_start, perm)
+                for y_index in blocks:
+                    h_init_i = None if h_init is None else h_init[y_index]
+                    add_result(perm, y_index, folds, *boost_folds(
+                        x_data, y_data[y_index], trf_length, delta, mindelta,
+                        error, segments, N_SEGS, folds, h_init_i,
+                        return_folds))
+        self._n_iter = n_iter
+        return [results[perm] for perm in perms]
+
+    def package(self, h_x, res, dt, tstart, tstop, delta, mindelta, scale_data):
+        "Package the output of :meth:`run` as :class:`BoostingResult`"
+        data = self.data
+        # fit-evaluation statistics
+        rs, rrs, errs = res
+        isnan = np.isnan(rs)
+        rs[isnan] = 0
+        r = data.package_statistic(rs, 'r', 'correlation')
+        rr = data.package_statistic(rrs, 'r', 'rank correlation')
+        err = data.package_value(errs, 'fit error')
+
+        y_mean, y_scale, x_mean, x_scale = data.data_scale_ndvars()
+
+        return BoostingResult(data.package_kernel(h_x, tstart), r, isnan, dt,
+                              VERSION, delta, mindelta, self.error, rr, err,
+                              scale_data, y_mean, y_scale, x_mean, x_scale,
+                              data.y_name, data.x_name, tstart, tstop)
 
 
 def boost_1seg(x, y, trf_length, delta, nsegs, segno, mindelta, error,
@@ -351,27 +897,353 @@ def boost_1seg(x, y, trf_length, delta, nsegs, segno, mindelta, error,
     """
     assert x.ndim == 2
     assert y.shape == (x.shape[1],)
+    y_train, y_test, x_train, x_test = split_data(x, y, nsegs, segno)
+    return boost_segs(y_train, y_test, x_train, x_test, trf_length, delta,
+                      mindelta, error, return_history)
 
-    # separate training and testing signal
-    test_seg_len = int(floor(x.shape[1] / nsegs))
-    test_index = slice(test_seg_len * segno, test_seg_len * (segno + 1))
-    if segno == 0:
-        train_index = (slice(test_seg_len, None),)
-    elif segno == nsegs-1:
-        train_index = (slice(0, -test_seg_len),)
-    elif segno < 0 or segno >= nsegs:
+
+def boost_1seg_batch(x, y, trf_length, delta, nsegs, segno, mindelta, error,
+                     segments=None, h_init=None, return_history=False):
+    """Boost multiple signals with the same stimulus (see :func:`boost_1seg`)
+
+    Parameters
+    ----------
+    x : array (n_stims, n_times)
+        Stimulus.
+    y : array (n_y, n_times)
+        Dependent signals.
+    ...
+        See :func:`boost_1seg`.
+    segments : None | array (n_segments, 2)
+        Start and stop index of discontinuous segments in ``y`` and ``x``
+        (see :func:`split_data`).
+    h_init : array (n_y, n_stims, trf_length)
+        Initial kernels (see :func:`boost_segs_batch`).
+    return_history : bool
+        Return the test error history for each signal.
+
+    Returns
+    -------
+    hs : list of (None | array)
+        Winning kernel for each signal in ``y`` (or ``(h, test_sse_history)``
+        tuples if ``return_history=True``).
+    """
+    assert x.ndim == 2
+    assert y.ndim == 2 and y.shape[1] == x.shape[1]
+    y_train, y_test, x_train, x_test = split_data(x, y, nsegs, segno, segments)
+    return boost_segs_batch(y_train, y_test, x_train, x_test, trf_length,
+                            delta, mindelta, error, return_history, h_init)
+
+
+def boost_folds(x, y, trf_length, delta, mindelta, error, segments, nsegs,
+                folds, h_init=None, return_folds=False):
+    """Boost a block of signals for several cross-validation folds
+
+    Parameters
+    ----------
+    x : array (n_stims, n_times)
+        Stimulus.
+    y : array (n_y, n_times)
+        Dependent signals.
+    ...
+        See :func:`boost_1seg_batch`.
+    folds : sequence of int
+        Cross-validation folds to compute.
+    h_init : array (n_y, n_folds, n_stims, trf_length)
+        Initial kernels for each fold.
+    return_folds : bool
+        Return the kernels for each fold.
+
+    Returns
+    -------
+    h_sum : array (n_y, n_stims, trf_length)
+        Sum of the kernels across folds (in the order of ``folds``).
+    n_h : array of int (n_y,)
+        Number of folds contributing to ``h_sum`` (folds in which the 0
+        kernel is best are skipped).
+    n_iter : array of int (n_y,)
+        Number of boosting iterations, summed across folds.
+    fold_hs : None | list of list of (None | array)
+        For each signal, the kernel from each fold (only if
+        ``return_folds=True``).
+    """
+    n_y = len(y)
+    h_sum = np.zeros((n_y, len(x), trf_length))
+    n_h = np.zeros(n_y, int)
+    n_iter = np.zeros(n_y, int)
+    fold_hs = [[] for _ in xrange(n_y)] if return_folds else None
+    for i, fold in enumerate(folds):
+        h_init_i = None if h_init is None else h_init[:, i]
+        results = boost_1seg_batch(x, y, trf_length, delta, nsegs, fold,
+                                   mindelta, error, segments, h_init_i, True)
+        for y_i, (h, test_error_history) in enumerate(results):
+            n_iter[y_i] += len(test_error_history)
+            if h is not None:
+                h_sum[y_i] += h
+                n_h[y_i] += 1
+            if return_folds:
+                fold_hs[y_i].append(h)
+    return h_sum, n_h, n_iter, fold_hs
+
+
+def split_data(x, y, nsegs, segno, segments=None):
+    """Separate training and testing signal
+
+    Parameters
+    ----------
+    x : array (n_stims, n_times)
+        Stimulus.
+    y : array ([n_y,] n_times)
+        Dependent signal.
+    nsegs : int
+        Number of cross-validation folds.
+    segno : int [0, nsegs-1]
+        Which fold to use for testing.
+    segments : None | array (n_segments, 2)
+        Start and stop index of discontinuous segments in ``y`` and ``x``. With
+        at least ``nsegs`` segments, each fold consists of whole segments;
+        otherwise, each segment is divided into ``nsegs`` parts.
+
+    Returns
+    -------
+    y_train, y_test, x_train, x_test : tuple of array
+        Segments for :func:`boost_segs` (``y`` is indexed along the last axis).
+    """
+    if segno < 0 or segno >= nsegs:
         raise ValueError("segno=%r" % segno)
+    elif segments is None:
+        train_index, test_index = _split_segment(0, x.shape[1], nsegs, segno)
+    elif len(segments) >= nsegs:
+        i_test = int(floor(len(segments) * segno / nsegs))
+        i_test_stop = int(floor(len(segments) * (segno + 1) / nsegs))
+        test_index = [slice(start, stop) for start, stop in
+                      segments[i_test:i_test_stop]]
+        train_index = [slice(start, stop) for start, stop in
+                       chain(segments[:i_test], segments[i_test_stop:])]
     else:
-        train_index = (slice(0, test_seg_len * segno),
-                       slice(test_seg_len * (segno + 1), None))
+        train_index = []
+        test_index = []
+        for start, stop in segments:
+            seg_train, seg_test = _split_segment(start, stop, nsegs, segno)
+            train_index.extend(seg_train)
+            test_index.extend(seg_test)
 
     y_train = tuple(y[..., i] for i in train_index)
-    y_test = (y[..., test_index],)
+    y_test = tuple(y[..., i] for i in test_index)
     x_train = tuple(x[:, i] for i in train_index)
-    x_test = (x[:, test_index],)
+    x_test = tuple(x[:, i] for i in test_index)
+    return y_train, y_test, x_train, x_test
 
-    return boost_segs(y_train, y_test, x_train, x_test, trf_length, delta,
-                      mindelta, error, return_history)
+
+def _split_segment(start, stop, nsegs, segno):
+    "Training and testing slices for regular division of one segment"
+    test_seg_len = int(floor((stop - start) / nsegs))
+    test_start = start + test_seg_len * segno
+    test_index = (slice(test_start, test_start + test_seg_len),)
+    if segno == 0:
+        train_index = (slice(start + test_seg_len, stop),)
+    elif segno == nsegs-1:
+        train_index = (slice(start, stop - test_seg_len),)
+    else:
+        train_index = (slice(start, test_start),
+                       slice(test_start + test_seg_len, stop))
+    return train_index, test_index
+
+
+class CropCache(object):
+    """Data cropped for different TRF starts (see :func:`crop_data`)
+
+    Cropped data are kept for each TRF start. Data for permutations of ``x``
+    (see :func:`permute_x`) are only kept for the most recent permutation.
+
+    Parameters
+    ----------
+    x : array (n_stims, n_times)
+        Stimulus.
+    y : array (n_y, n_times)
+        Dependent signals.
+    segments : None | array (n_segments, 2)
+        Segments in ``x`` and ``y``.
+    permutations : None | list of tuple
+        ``(order, shifts)`` tuple for each permutation of ``x`` (see
+        :func:`x_permutations`).
+    """
+    def __init__(self, x, y, segments, permutations=None):
+        self.x = x
+        self.y = y
+        self.segments = segments
+        self.permutations = permutations
+        self.n_permutations = 0 if permutations is None else len(permutations)
+        self._cropped = {}
+        self._perm_cropped = {}
+
+    def get(self, i_start, perm=None):
+        """Cropped data
+
+        Parameters
+        ----------
+        i_start : int
+            TRF start (in samples).
+        perm : None | int
+            Index of the permutation of ``x`` (``None`` for the original
+            ``x``).
+
+        Returns
+        -------
+        x, y : array
+            Cropped data.
+        segments : None | array (n_segments, 2)
+            Segments in the cropped data.
+        """
+        if perm is None:
+            if i_start not in self._cropped:
+                self._cropped[i_start] = crop_data(
+                    self.x, self.y, self.segments, i_start)
+            return self._cropped[i_start]
+        key = (perm, i_start)
+        if key not in self._perm_cropped:
+            self._perm_cropped.clear()
+            x = permute_x(self.x, self.segments, *self.permutations[perm])
+            self._perm_cropped[key] = crop_data(x, self.y, self.segments,
+                                                i_start)
+        return self._perm_cropped[key]
+
+
+def x_permutations(n_times, segments, samples, permute='shift', seed=0):
+    """Random permutations of ``x`` for estimating a null model
+
+    Parameters
+    ----------
+    n_times : int
+        Number of time points.
+    segments : None | array (n_segments, 2)
+        Segments in the data.
+    samples : int
+        Number of permutations.
+    permute : 'shift' | 'segments'
+        ``'shift'``: circularly shift ``x`` within each segment by a random
+        amount between 10% and 90% of the segment length; ``'segments'``:
+        randomly reassign the ``x`` segments to the ``y`` segments (all
+        segments need to have the same length; the original order is
+        excluded).
+    seed : None | int
+        Seed for :mod:`numpy.random` (``None`` to skip seeding).
+
+    Returns
+    -------
+    permutations : list of tuple
+        For each permutation, an ``(order, shifts)`` tuple of arrays with one
+        entry per segment (see :func:`permute_x`).
+    """
+    if segments is None:
+        segments = np.array([[0, n_times]], np.int64)
+    lengths = segments[:, 1] - segments[:, 0]
+    n_segs = len(segments)
+    if seed is not None:
+        np.random.seed(seed)
+    permutations = []
+    if permute == 'shift':
+        order = np.arange(n_segs)
+        low = np.maximum(1, np.ceil(lengths * 0.1)).astype(int)
+        high = np.maximum(low + 1, np.floor(lengths * 0.9).astype(int) + 1)
+        for _ in xrange(samples):
+            shifts = np.array([np.random.randint(lo, hi) for lo, hi in
+                               izip(low, high)])
+            permutations.append((order, shifts))
+    elif permute == 'segments':
+        if n_segs < 2:
+            raise ValueError("permute='segments' requires data with multiple "
+                             "segments")
+        elif np.any(lengths != lengths[0]):
+            raise ValueError("permute='segments' requires segments of equal "
+                             "length")
+        shifts = np.zeros(n_segs, int)
+        identity = np.arange(n_segs)
+        for _ in xrange(samples):
+            # the original order is not a sample from the null distribution
+            order = np.random.permutation(n_segs)
+            while np.all(order == identity):
+                order = np.random.permutation(n_segs)
+            permutations.append((order, shifts))
+    else:
+        raise ValueError("permute=%r" % (permute,))
+    return permutations
+
+
+def permute_x(x, segments, order, shifts):
+    """Permute ``x`` relative to ``y``
+
+    Parameters
+    ----------
+    x : array (n_stims, n_times)
+        Stimulus.
+    segments : None | array (n_segments, 2)
+        Segments in ``x``.
+    order : array of int (n_segments,)
+        For each segment, the segment of ``x`` to use.
+    shifts : array of int (n_segments,)
+        For each segment, the circular shift to apply.
+
+    Returns
+    -------
+    x : array (n_stims, n_times)
+        Permuted stimulus (a copy).
+    """
+    if segments is None:
+        segments = np.array([[0, x.shape[1]]], np.int64)
+    out = np.empty_like(x)
+    for (start, stop), i_src, shift in izip(segments, order, shifts):
+        src_start, src_stop = segments[i_src]
+        out[:, start:stop] = np.roll(x[:, src_start:src_stop], shift, 1)
+    return out
+
+
+def crop_data(x, y, segments, i_start):
+    """Crop data to shift ``y`` relative to ``x`` by ``i_start``
+
+    Returns
+    -------
+    x, y : array
+        Cropped data.
+    segments : None | array (n_segments, 2)
+        Segments in the cropped data.
+    """
+    if segments is not None:
+        if i_start:
+            x, y, segments = shift_segments(x, y, segments, i_start)
+    elif i_start < 0:
+        x = x[:, -i_start:]
+        y = y[:, :i_start]
+    elif i_start > 0:
+        x = x[:, :-i_start]
+        y = y[:, i_start:]
+    return x, y, segments
+
+
+def shift_segments(x, y, segments, i_start):
+    """Crop each segment to shift ``y`` relative to ``x`` by ``i_start``
+
+    Returns
+    -------
+    x, y : array
+        Cropped data.
+    segments : array (n_segments, 2)
+        Segments in the cropped data.
+    """
+    n = abs(i_start)
+    if i_start < 0:
+        x_index = [slice(start + n, stop) for start, stop in segments]
+        y_index = [slice(start, stop - n) for start, stop in segments]
+    else:
+        x_index = [slice(start, stop - n) for start, stop in segments]
+        y_index = [slice(start + n, stop) for start, stop in segments]
+    x = np.hstack([x[:, index] for index in x_index])
+    y = np.hstack([y[:, index] for index in y_index])
+    lengths = segments[:, 1] - segments[:, 0] - n
+    if np.any(lengths <= 0):
+        raise ValueError("Segments are shorter than the TRF offset")
+    stops = np.cumsum(lengths)
+    return x, y, np.column_stack((stops - lengths, stops))
 
 
 def boost_segs(y_train, y_test, x_train, x_test, trf_length, delta, mindelta,
@@ -404,109 +1276,108 @@ def boost_segs(y_train, y_test, x_train, x_test, trf_length, delta, mindelta,
     test_sse_history : list (only if ``return_history==True``)
         SSE for test data at each iteration.
     """
-    delta_error = DELTA_ERROR_FUNC[error]
-    error = ERROR_FUNC[error]
+    if any(y.ndim != 1 for y in chain(y_train, y_test)):
+        raise ValueError("y needs to be 1-dimensional")
+    return boost_segs_batch(tuple(y[None] for y in y_train),
+                            tuple(y[None] for y in y_test), x_train, x_test,
+                            trf_length, delta, mindelta, error,
+                            return_history)[0]
+
+
+def boost_segs_batch(y_train, y_test, x_train, x_test, trf_length, delta,
+                     mindelta, error, return_history=False, h_init=None):
+    """Boost multiple signals with the same stimulus (see :func:`boost_segs`)
+
+    Quantities that depend only on the stimulus are computed once for all
+    signals in ``y``.
+
+    Parameters
+    ----------
+    y_train, y_test : tuple of array (n_y, n_times)
+        Dependent signals, time series to predict.
+    ...
+        See :func:`boost_segs`.
+    h_init : array (n_y, n_stims, trf_length)
+        Start boosting from these kernels instead of from 0 (warm start). The
+        initial kernel is returned instead of None if it is the best kernel.
+
+    Returns
+    -------
+    results : list
+        The return value of :func:`boost_segs` for each signal in ``y``.
+    """
+    if error not in ERROR_FUNC:
+        raise ValueError("error=%r" % (error,))
     n_stims = len(x_train[0])
     if any(len(x) != n_stims for x in chain(x_train, x_test)):
         raise ValueError("Not all x have same number of stimuli")
-    n_times = [len(y) for y in chain(y_train, y_test)]
+    n_times = [y.shape[-1] for y in chain(y_train, y_test)]
     if any(x.shape[1] != n for x, n in izip(chain(x_train, x_test), n_times)):
         raise ValueError("y and x have inconsistent number of time points")
 
-    h = np.zeros((n_stims, trf_length))
-
-    # buffers
-    y_train_error = tuple(y.copy() for y in y_train)
-    y_test_error = tuple(y.copy() for y in y_test)
-
-    ys_error = y_train_error + y_test_error
-    xs = x_train + x_test
-
-    new_error = np.empty(h.shape)
-    new_sign = np.empty(h.shape, np.int8)
-
-    # history lists
-    history = []
-    test_error_history = []
-    # pre-assign iterators
-    iter_h = tuple(product(xrange(h.shape[0]), xrange(h.shape[1])))
-    iter_train_error = zip(y_train_error, x_train)
-    iter_error = zip(ys_error, xs)
-    for i_boost in xrange(999999):
-        history.append(h.copy())
-
-        # evaluate current h
-        e_test = sum(error(y) for y in y_test_error)
-        e_train = sum(error(y) for y in y_train_error)
-
-        test_error_history.append(e_test)
-
-        # stop the iteration if all the following requirements are met
-        # 1. more than 10 iterations are done
-        # 2. The testing error in the latest iteration is higher than that in
-        #    the previous two iterations
-        if (i_boost > 10 and e_test > test_error_history[-2] and
-                e_test > test_error_history[-3]):
-            # print("error(test) not improving in 2 steps")
-            break
-
-        # generate possible movements -> training error
-        for i_stim, i_time in iter_h:
-            # +/- delta
-            e_add = e_sub = 0.
-            for y_err, x in iter_train_error:
-                e_add_, e_sub_ = delta_error(y_err, x[i_stim], delta, i_time)
-                e_add += e_add_
-                e_sub += e_sub_
-
-            if e_add > e_sub:
-                new_error[i_stim, i_time] = e_sub
-                new_sign[i_stim, i_time] = -1
-            else:
-                new_error[i_stim, i_time] = e_add
-                new_sign[i_stim, i_time] = 1
-
-        i_stim, i_time = np.unravel_index(np.argmin(new_error), h.shape)
-        new_train_error = new_error[i_stim, i_time]
-        delta_signed = new_sign[i_stim, i_time] * delta
-
-        # If no improvements can be found reduce delta
-        if new_train_error > e_train:
-            delta *= 0.5
-            if delta >= mindelta:
-                # print("new delta: %s" % delta)
-                continue
+    # concatenate segments (the error buffers are copies of y)
+    y_train_error = np.concatenate(y_train, 1)
+    y_test_error = np.concatenate(y_test, 1)
+    x_train_ = np.concatenate(x_train, 1)
+    x_test_ = np.concatenate(x_test, 1)
+    train_segs = segments(y_train)
+    test_segs = segments(y_test)
+    if h_init is None:
+        h_init = (None,) * len(y_train_error)
+    else:
+        # residual of the initial kernels
+        for y_error, x, segs in ((y_train_error, x_train_, train_segs),
+                                 (y_test_error, x_test_, test_segs)):
+            for start, stop in segs:
+                y_error[:, start:stop] -= apply_kernel(x[:, start:stop], h_init)
+    if error == 'l2' and (n_stims * trf_length) ** 2 <= L2_XX_MAX_SIZE:
+        xx_train = l2_xx(x_train_, train_segs, trf_length)
+        xx_test = l2_xx(x_test_, test_segs, trf_length)
+        xy_train = l2_xy(y_train_error, x_train_, train_segs, trf_length)
+        xy_test = l2_xy(y_test_error, x_test_, test_segs, trf_length)
+    else:
+        # update the error directly (l1, or xx table too large)
+        xx_train = xx_test = None
+        xy_train = xy_test = (None,) * len(y_train_error)
+
+    out = []
+    h_buffer = np.empty((n_stims, trf_length))
+    for y_train_i, y_test_i, xy_train_i, xy_test_i, h_init_i in izip(
+            y_train_error, y_test_error, xy_train, xy_test, h_init):
+        if h_init_i is None:
+            h_buffer.fill(0)
+        else:
+            h_buffer[:] = h_init_i
+        steps, test_error_history = boost_segs_opt(
+            y_train_i, y_test_i, x_train_, x_test_, train_segs, test_segs,
+            h_buffer, delta, mindelta, error, xx_train, xx_test, xy_train_i,
+            xy_test_i)
+        best_iter = np.argmin(test_error_history)
+        if best_iter:
+            if h_init_i is None:
+                h = np.zeros_like(h_buffer)
             else:
-                # print("No improvement possible for training data")
-                break
-
-        # update h with best movement
-        h[i_stim, i_time] += delta_signed
-
-        # abort if we're moving in circles
-        if i_boost >= 2 and h[i_stim, i_time] == history[-2][i_stim, i_time]:
-            # print("Same h after 2 iterations")
-            break
-        elif i_boost >= 3 and h[i_stim, i_time] == history[-3][i_stim, i_time]:
-            # print("Same h after 3 iterations")
-            break
-
-        # update error
-        for err, x in iter_error:
-            update_error(err, x[i_stim], delta_signed, i_time)
-    # else:
-    #     print("maxiter exceeded")
+                h = h_init_i.copy()
+            h = kernel_at(steps, best_iter, h)
+        elif h_init_i is None:
+            h = None
+        else:
+            h = h_init_i.copy()
+        if return_history:
+            out.append((h, test_error_history))
+        else:
+            out.append(h)
+    return out
 
-    best_iter = np.argmin(test_error_history)
-    # print('  (%i iterations)' % (i_boost + 1))
 
-    if return_history:
-        return history[best_iter] if best_iter else None, test_error_history
-    else:
-        return history[best_iter] if best_iter else None
+def segments(ys):
+    "Start and stop index of each array in the concatenation of ``ys``"
+    lengths = [y.shape[-1] for y in ys]
+    stops = np.cumsum(lengths)
+    return np.column_stack((stops - lengths, stops)).astype(np.int64)
 
 
-def setup_workers(y, x, trf_length, delta, mindelta, nsegs, error):
+def setup_workers(y, x, nsegs, error, segments=None, permutations=None):
     n_y, n_times = y.shape
     n_x, _ = x.shape
 
@@ -518,8 +1389,8 @@ def setup_workers(y, x, trf_length, delta, mindelta, nsegs, error):
     job_queue = Queue(200)
     result_queue = Queue(200)
 
-    args = (y_buffer, x_buffer, n_y, n_times, n_x, trf_length, delta,
-            mindelta, nsegs, error, job_queue, result_queue)
+    args = (y_buffer, x_buffer, n_y, n_times, n_x, nsegs, error, segments,
+            permutations, job_queue, result_queue)
     for _ in xrange(CONFIG['n_workers']):
         process = Process(target=boosting_worker, args=args)
         process.daemon = True
@@ -528,54 +1399,110 @@ def setup_workers(y, x, trf_length, delta, mindelta, nsegs, error):
     return job_queue, result_queue
 
 
-def boosting_worker(y_buffer, x_buffer, n_y, n_times, n_x, trf_length,
-                    delta, mindelta, nsegs, error, job_queue, result_queue):
+def boosting_worker(y_buffer, x_buffer, n_y, n_times, n_x, nsegs, error,
+                    segments, permutations, job_queue, result_queue):
     signal.signal(signal.SIGINT, signal.SIG_IGN)
 
     y = np.frombuffer(y_buffer, np.float64, n_y * n_times).reshape((n_y, n_times))
     x = np.frombuffer(x_buffer, np.float64, n_x * n_times).reshape((n_x, n_times))
 
+    cropped = CropCache(x, y, segments, permutations)
     while True:
-        y_i, seg_i = job_queue.get()
-        if y_i == JOB_TERMINATE:
+        job = job_queue.get()
+        if job == JOB_TERMINATE:
             return
-        h = boost_1seg(x, y[y_i], trf_length, delta, nsegs, seg_i, mindelta,
-                       error)
-        result_queue.put((y_i, seg_i, h))
+        perm, y_index, folds, run_args, h_init, return_folds = job
+        i_start, trf_length, delta, mindelta = run_args
+        x_, y_, segments_ = cropped.get(i_start, perm)
+        # incomplete folds are averaged in the main process
+        return_folds = return_folds or len(folds) < nsegs
+        result = boost_folds(x_, y_[y_index], trf_length, delta, mindelta,
+                             error, segments_, nsegs, folds, h_init,
+                             return_folds)
+        result_queue.put((perm, y_index, folds) + result)
+
+
+def y_blocks(n_y, n_workers):
+    """Divide ``n_y`` signals into blocks that are boosted together
+
+    Blocks are at most ``Y_BLOCK_SIZE`` long, but small enough to give each
+    worker a block.
+    """
+    block_size = int(ceil(n_y / n_workers))
+    n_blocks = int(ceil(n_y / min(block_size, Y_BLOCK_SIZE)))
+    block_size = int(ceil(n_y / n_blocks))
+    return [(start, min(start + block_size, n_y)) for start in
+            xrange(0, n_y, block_size)]
 
 
-def put_jobs(queue, n_y, n_segs, stop):
-    "Feed boosting jobs into a Queue"
-    for job in product(xrange(n_y), xrange(n_segs)):
+def put_jobs(queue, jobs, stop):
+    """Feed boosting jobs into a Queue
+
+    Workers are terminated separately (see :meth:`Booster.close`).
+    """
+    for job in jobs:
         queue.put(job)
         if stop.isSet():
             while not queue.empty():
                 queue.get()
             break
-    for _ in xrange(CONFIG['n_workers']):
-        queue.put((JOB_TERMINATE, None))
 
 
 def apply_kernel(x, h, out=None):
     """Predict ``y`` by applying kernel ``h`` to ``x``
 
-    x.shape is (n_stims, n_samples)
-    h.shape is (n_stims, n_trf_samples)
+    The convolution is computed with the overlap-add method.
+
+    Parameters
+    ----------
+    x : array (n_stims, n_times)
+        Stimulus.
+    h : array ([n_y,] n_stims, trf_length)
+        Kernel (a 3d array to predict multiple ``y`` at once).
+    out : array ([n_y,] n_times)
+        Buffer for the prediction.
+
+    Returns
+    -------
+    y : array ([n_y,] n_times)
+        Prediction (sum of the convolution of each stimulus with the
+        corresponding kernel, truncated to the length of ``x``).
     """
+    n_times = x.shape[1]
+    trf_length = h.shape[-1]
     if out is None:
-        out = np.zeros(x.shape[1])
+        out = np.zeros(h.shape[:-2] + (n_times,))
     else:
         out.fill(0)
 
-    for ind in xrange(len(h)):
-        out += np.convolve(h[ind], x[ind])[:len(out)]
-
+    n_fft = 2 ** int(ceil(np.log2(max(FFT_BLOCK_SIZE, 4 * trf_length))))
+    block_size = n_fft - trf_length + 1
+    h_fft = np.fft.rfft(h, n_fft)
+    for start in xrange(0, n_times, block_size):
+        stop = min(start + n_fft, n_times)
+        x_fft = np.fft.rfft(x[:, start:start + block_size], n_fft)
+        y_block = np.fft.irfft((h_fft * x_fft).sum(-2), n_fft)
+        out[..., start:stop] += y_block[..., :stop - start]
     return out
 
 
-def evaluate_kernel(y, x, h, error):
+def evaluate_kernel(y, x, h, error, segments=None):
     """Fit quality statistics
 
+    Parameters
+    ----------
+    y : array ([n_y,] n_times)
+        Measured signal (a 2d array to evaluate multiple signals at once).
+    x : array (n_stims, n_times)
+        Stimulus.
+    h : array ([n_y,] n_stims, trf_length)
+        Kernel.
+    error : 'l1' | 'l2'
+        Error function.
+    segments : None | array (n_segments, 2)
+        Start and stop index of discontinuous segments (the kernel is applied
+        to each segment separately).
+
     Returns
     -------
     r : float | array
@@ -585,14 +1512,32 @@ def evaluate_kernel(y, x, h, error):
     error : float | array
         Error corresponding to error_func.
     """
-    y_pred = apply_kernel(x, h)
-
     # discard onset (length of kernel)
     i0 = h.shape[-1] - 1
-    y = y[..., i0:]
-    y_pred = y_pred[..., i0:]
+    if segments is None:
+        y_pred = apply_kernel(x, h)
+        y = y[..., i0:]
+        y_pred = y_pred[..., i0:]
+    else:
+        y_pred = np.empty(h.shape[:-2] + (x.shape[1],))
+        for start, stop in segments:
+            apply_kernel(x[:, start:stop], h, y_pred[..., start:stop])
+        index = np.concatenate([np.arange(start + i0, stop) for start, stop in
+                                segments])
+        y = y[..., index]
+        y_pred = y_pred[..., index]
+
+    if error == 'l1':
+        err = np.abs(y - y_pred).sum(-1)
+    elif error == 'l2':
+        err = ((y - y_pred) ** 2).sum(-1)
+    else:
+        raise ValueError("error=%r" % (error,))
+    return _corr(y, y_pred), _corr(rankdata(y), rankdata(y_pred)), err
+
 
-    error_func = ERROR_FUNC[error]
-    return (np.corrcoef(y, y_pred)[0, 1],
-            spearmanr(y, y_pred)[0],
-            error_func(y - y_pred))
+def _corr(a, b):
+    "Pearson correlation along the last axis"
+    a = a - a.mean(-1, keepdims=True)
+    b = b - b.mean(-1, keepdims=True)
+    return (a * b).sum(-1) / np.sqrt((a ** 2).sum(-1) * (b ** 2).sum(-1))
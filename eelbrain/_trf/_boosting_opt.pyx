@@ -0,0 +1,424 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+#cython: boundscheck=False, wraparound=False
+"""Compiled boosting loop
+
+Data for multiple segments are concatenated along the time axis; ``segs``
+arrays specify ``start, stop`` indexes for each segment, and kernels are never
+applied across segment boundaries.
+
+For the ``l2`` error, the error after a step ``delta`` on ``h[i_stim, i_time]``
+is computed in closed form as ``sse - 2 * delta * xy[i_stim, i_time] +
+delta ** 2 * xx[i_stim, i_time, i_stim, i_time]``, where ``xy`` is the
+product of the residual with the shifted stimulus and ``xx`` contains the
+products of all pairs of shifted stimuli. After each step ``xy`` is updated
+from ``xx``, so that the cost of an iteration does not depend on the number of
+time points. Without ``xx`` (for kernels for which the ``xx`` table would be
+too large), the error is updated directly, as for the ``l1`` error.
+"""
+cimport cython
+import numpy as np
+cimport numpy as cnp
+
+ctypedef cnp.int8_t INT8
+ctypedef cnp.int64_t INT64
+ctypedef cnp.float64_t FLOAT64
+
+
+cdef double _error(cnp.ndarray[FLOAT64, ndim=1] y,
+                   cnp.ndarray[INT64, ndim=2] segs,
+                   bint l1):
+    "Error summed over segments (equivalent to ``l1`` and ``l2``)"
+    cdef:
+        double out = 0.
+        double out_seg
+        long i, i_seg
+
+    for i_seg in range(segs.shape[0]):
+        out_seg = 0.
+        if l1:
+            for i in range(segs[i_seg, 0], segs[i_seg, 1]):
+                out_seg += abs(y[i])
+        else:
+            for i in range(segs[i_seg, 0], segs[i_seg, 1]):
+                out_seg += y[i] ** 2
+        out += out_seg
+    return out
+
+
+cdef void _generate_options(cnp.ndarray[FLOAT64, ndim=1] y_error,
+                            cnp.ndarray[FLOAT64, ndim=2] x,
+                            cnp.ndarray[INT64, ndim=2] segs,
+                            double delta,
+                            bint l1,
+                            cnp.ndarray[FLOAT64, ndim=2] new_error,
+                            cnp.ndarray[INT8, ndim=2] new_sign):
+    cdef:
+        double e_add, e_sub, e_add_seg, e_sub_seg, d
+        long i_stim, i_time, i_seg, i, start, stop, shifted_start
+
+    for i_stim in range(new_error.shape[0]):
+        for i_time in range(new_error.shape[1]):
+            e_add = e_sub = 0.
+            for i_seg in range(segs.shape[0]):
+                start = segs[i_seg, 0]
+                stop = segs[i_seg, 1]
+                shifted_start = min(start + i_time, stop)
+                # samples before the kernel onset are unaffected
+                e_add_seg = 0.
+                if l1:
+                    for i in range(start, shifted_start):
+                        e_add_seg += abs(y_error[i])
+                    e_sub_seg = e_add_seg
+                    for i in range(shifted_start, stop):
+                        d = delta * x[i_stim, i - i_time]
+                        e_add_seg += abs(y_error[i] - d)
+                        e_sub_seg += abs(y_error[i] + d)
+                else:
+                    for i in range(start, shifted_start):
+                        e_add_seg += y_error[i] ** 2
+                    e_sub_seg = e_add_seg
+                    for i in range(shifted_start, stop):
+                        d = delta * x[i_stim, i - i_time]
+                        e_add_seg += (y_error[i] - d) ** 2
+                        e_sub_seg += (y_error[i] + d) ** 2
+                e_add += e_add_seg
+                e_sub += e_sub_seg
+
+            if e_add > e_sub:
+                new_error[i_stim, i_time] = e_sub
+                new_sign[i_stim, i_time] = -1
+            else:
+                new_error[i_stim, i_time] = e_add
+                new_sign[i_stim, i_time] = 1
+
+
+cdef void _update_error(cnp.ndarray[FLOAT64, ndim=1] y_error,
+                        cnp.ndarray[FLOAT64, ndim=2] x,
+                        cnp.ndarray[INT64, ndim=2] segs,
+                        double delta,
+                        long i_stim,
+                        long i_time):
+    cdef long i, i_seg
+
+    for i_seg in range(segs.shape[0]):
+        for i in range(segs[i_seg, 0] + i_time, segs[i_seg, 1]):
+            y_error[i] -= delta * x[i_stim, i - i_time]
+
+
+cdef void _generate_options_l2(double sse,
+                               cnp.ndarray[FLOAT64, ndim=2] xy,
+                               cnp.ndarray[FLOAT64, ndim=4] xx,
+                               double delta,
+                               cnp.ndarray[FLOAT64, ndim=2] new_error,
+                               cnp.ndarray[INT8, ndim=2] new_sign):
+    cdef:
+        double e_add, e_sub, d_xy, d_xx
+        long i_stim, i_time
+
+    for i_stim in range(new_error.shape[0]):
+        for i_time in range(new_error.shape[1]):
+            d_xy = 2 * delta * xy[i_stim, i_time]
+            d_xx = delta ** 2 * xx[i_stim, i_time, i_stim, i_time]
+            e_add = sse - d_xy + d_xx
+            e_sub = sse + d_xy + d_xx
+            if e_add > e_sub:
+                new_error[i_stim, i_time] = e_sub
+                new_sign[i_stim, i_time] = -1
+            else:
+                new_error[i_stim, i_time] = e_add
+                new_sign[i_stim, i_time] = 1
+
+
+cdef void _update_xy(cnp.ndarray[FLOAT64, ndim=2] xy,
+                     cnp.ndarray[FLOAT64, ndim=4] xx,
+                     double delta,
+                     long i_stim,
+                     long i_time):
+    cdef long i, j
+
+    for i in range(xy.shape[0]):
+        for j in range(xy.shape[1]):
+            xy[i, j] -= delta * xx[i, j, i_stim, i_time]
+
+
+def l2_xx(cnp.ndarray[FLOAT64, ndim=2] x,
+          cnp.ndarray[INT64, ndim=2] segs,
+          long trf_length):
+    """Products of all pairs of shifted stimuli
+
+    Parameters
+    ----------
+    x : array (n_stims, n_times)
+        Stimulus.
+    segs : array (n_segs, 2)
+        Start and stop index of each segment.
+    trf_length : int
+        Number of samples in the kernel.
+
+    Returns
+    -------
+    xx : array (n_stims, trf_length, n_stims, trf_length)
+        ``xx[s1, t1, s2, t2]`` is the product of ``x[s1]`` delayed by ``t1``
+        with ``x[s2]`` delayed by ``t2``, summed over all segments.
+    """
+    n_stims = x.shape[0]
+    xx = np.zeros((n_stims, trf_length, n_stims, trf_length))
+    # zero-padding makes samples before the segment onset contribute 0
+    pad = np.zeros((n_stims, trf_length))
+    for start, stop in segs:
+        n = stop - start
+        x_seg = x[:, start:stop]
+        x_pad = np.hstack((pad, x_seg))
+        stop_pad = trf_length + n
+        for lag in range(trf_length):
+            n_k = trf_length - lag
+            # x[s1] delayed by 0 with x[s2] delayed by lag
+            xx_0 = np.dot(x_seg[:, lag:], x_seg[:, :max(n - lag, 0)].T)
+            # delaying both by k more drops the last k products
+            tail_1 = x_pad[:, stop_pad - n_k + 1:stop_pad][:, ::-1]
+            tail_2 = x_pad[:, stop_pad - lag - n_k + 1:stop_pad - lag][:, ::-1]
+            dropped = np.cumsum(tail_1[:, None] * tail_2[None], 2)
+            xx_k = np.empty((n_stims, n_stims, n_k))
+            xx_k[:, :, 0] = xx_0
+            xx_k[:, :, 1:] = xx_0[:, :, None] - dropped
+            k = np.arange(n_k)
+            xx[:, k, :, k + lag] += xx_k.transpose(2, 0, 1)
+            if lag:
+                xx[:, k + lag, :, k] += xx_k.transpose(2, 1, 0)
+    return xx
+
+
+def l2_xy(y,
+          cnp.ndarray[FLOAT64, ndim=2] x,
+          cnp.ndarray[INT64, ndim=2] segs,
+          long trf_length):
+    """Products of signals with the shifted stimuli
+
+    Parameters
+    ----------
+    y : array ([n_y,] n_times)
+        Signal (a 2d array to compute products for multiple signals at once).
+    x : array (n_stims, n_times)
+        Stimulus.
+    segs : array (n_segs, 2)
+        Start and stop index of each segment.
+    trf_length : int
+        Number of samples in the kernel.
+
+    Returns
+    -------
+    xy : array ([n_y,] n_stims, trf_length)
+        ``xy[..., s, t]`` is the product of ``y`` with ``x[s]`` delayed by
+        ``t``, summed over all segments.
+    """
+    xy = np.zeros(y.shape[:-1] + (x.shape[0], trf_length))
+    for start, stop in segs:
+        for i_time in range(min(trf_length, stop - start)):
+            xy[..., i_time] += np.dot(y[..., start + i_time:stop],
+                                      x[:, start:stop - i_time].T)
+    return xy
+
+
+def generate_options(cnp.ndarray[FLOAT64, ndim=1] y_error,
+                     cnp.ndarray[FLOAT64, ndim=2] x,
+                     cnp.ndarray[INT64, ndim=2] segs,
+                     double delta,
+                     error,
+                     cnp.ndarray[FLOAT64, ndim=2] new_error,
+                     cnp.ndarray[INT8, ndim=2] new_sign):
+    """Training error for all possible kernel modifications
+
+    Parameters
+    ----------
+    y_error : array (n_times,)
+        Current error of the prediction.
+    x : array (n_stims, n_times)
+        Stimulus.
+    segs : array (n_segs, 2)
+        Start and stop index of each segment.
+    delta : scalar
+        Step of the adjustment.
+    error : 'l1' | 'l2'
+        Error function.
+    new_error : array (n_stims, trf_length)
+        Output for the error after the best step (+/- delta) for each kernel
+        element.
+    new_sign : array of int8 (n_stims, trf_length)
+        Output for the sign of the best step for each kernel element.
+    """
+    _generate_options(y_error, x, segs, delta, error == 'l1', new_error,
+                      new_sign)
+
+
+def boost_segs(cnp.ndarray[FLOAT64, ndim=1] y_train_error,
+               cnp.ndarray[FLOAT64, ndim=1] y_test_error,
+               cnp.ndarray[FLOAT64, ndim=2] x_train,
+               cnp.ndarray[FLOAT64, ndim=2] x_test,
+               cnp.ndarray[INT64, ndim=2] train_segs,
+               cnp.ndarray[INT64, ndim=2] test_segs,
+               cnp.ndarray[FLOAT64, ndim=2] h,
+               double delta,
+               double mindelta,
+               error,
+               cnp.ndarray[FLOAT64, ndim=4] xx_train=None,
+               cnp.ndarray[FLOAT64, ndim=4] xx_test=None,
+               cnp.ndarray[FLOAT64, ndim=2] xy_train=None,
+               cnp.ndarray[FLOAT64, ndim=2] xy_test=None):
+    """Boosting iterations
+
+    Parameters
+    ----------
+    y_train_error, y_test_error : array (n_times,)
+        Dependent signal (with ``error='l1'`` or without ``xx``, modified to
+        contain the error of the final prediction).
+    x_train, x_test : array (n_stims, n_times)
+        Stimulus.
+    train_segs, test_segs : array (n_segs, 2)
+        Start and stop index of each segment.
+    h : array (n_stims, trf_length)
+        Kernel (modified in place).
+    delta : scalar
+        Step of the adjustment.
+    mindelta : scalar
+        Smallest delta to use.
+    error : 'l1' | 'l2'
+        Error function.
+    xx_train, xx_test : array (n_stims, trf_length, n_stims, trf_length)
+        Precomputed :func:`l2_xx` for ``error='l2'`` (to share them between
+        multiple ``y``). If None, the error is updated directly, as for
+        ``error='l1'``.
+    xy_train, xy_test : array (n_stims, trf_length)
+        Precomputed :func:`l2_xy` for ``error='l2'`` (modified in place;
+        computed if None).
+
+    Returns
+    -------
+    steps : list of tuple
+        ``(i_boost, i_stim, i_time, delta_signed)`` for each modification of
+        ``h`` (see :func:`kernel_at`).
+    test_error_history : list of float
+        Test error at the start of each iteration.
+    """
+    cdef:
+        long i_boost, i_stim, i_time, i_stim_best, i_time_best
+        double e_test, e_train, new_train_error, delta_signed, h_old, h_prev
+        # steps in the previous two iterations (i_stim = -1 for no step)
+        long i_stim_1 = -1, i_time_1 = -1, i_stim_2 = -1, i_time_2 = -1
+        double h_old_1 = 0., h_old_2 = 0.
+        bint l1 = error == 'l1'
+        # update the error directly instead of through xy and xx
+        bint direct = l1 or xx_train is None or xx_test is None
+        cnp.ndarray[FLOAT64, ndim=2] new_error = np.empty_like(h)
+        cnp.ndarray[INT8, ndim=2] new_sign = np.empty((h.shape[0], h.shape[1]),
+                                                      np.int8)
+
+    if not direct:
+        trf_length = h.shape[1]
+        if xy_train is None:
+            xy_train = l2_xy(y_train_error, x_train, train_segs, trf_length)
+        if xy_test is None:
+            xy_test = l2_xy(y_test_error, x_test, test_segs, trf_length)
+        e_train = _error(y_train_error, train_segs, l1)
+        e_test = _error(y_test_error, test_segs, l1)
+
+    # (no negative indexes with wraparound=False)
+    steps = []
+    test_error_history = []
+    for i_boost in range(999999):
+        # evaluate current h
+        if direct:
+            e_test = _error(y_test_error, test_segs, l1)
+            e_train = _error(y_train_error, train_segs, l1)
+        test_error_history.append(e_test)
+
+        # stop the iteration if all the following requirements are met
+        # 1. more than 10 iterations are done
+        # 2. The testing error in the latest iteration is higher than that in
+        #    the previous two iterations
+        if (i_boost > 10 and e_test > test_error_history[i_boost - 1] and
+                e_test > test_error_history[i_boost - 2]):
+            break
+
+        # generate possible movements -> training error
+        if direct:
+            _generate_options(y_train_error, x_train, train_segs, delta, l1,
+                              new_error, new_sign)
+        else:
+            _generate_options_l2(e_train, xy_train, xx_train, delta, new_error,
+                                 new_sign)
+        i_stim_best = i_time_best = 0
+        new_train_error = new_error[0, 0]
+        for i_stim in range(h.shape[0]):
+            for i_time in range(h.shape[1]):
+                if new_error[i_stim, i_time] < new_train_error:
+                    new_train_error = new_error[i_stim, i_time]
+                    i_stim_best = i_stim
+                    i_time_best = i_time
+        delta_signed = new_sign[i_stim_best, i_time_best] * delta
+
+        # If no improvements can be found reduce delta
+        if new_train_error > e_train:
+            delta *= 0.5
+            if delta >= mindelta:
+                i_stim_2, i_time_2, h_old_2 = i_stim_1, i_time_1, h_old_1
+                i_stim_1 = i_time_1 = -1
+                continue
+            else:
+                break
+
+        # update h with best movement
+        h_old = h[i_stim_best, i_time_best]
+        h[i_stim_best, i_time_best] += delta_signed
+        steps.append((i_boost, i_stim_best, i_time_best, delta_signed))
+
+        # abort if we're moving in circles: compare with the value of the
+        # element at the start of the previous two iterations
+        h_prev = h_old
+        if i_stim_1 == i_stim_best and i_time_1 == i_time_best:
+            h_prev = h_old_1
+        if i_boost >= 2 and h[i_stim_best, i_time_best] == h_prev:
+            break
+        if i_stim_2 == i_stim_best and i_time_2 == i_time_best:
+            h_prev = h_old_2
+        if i_boost >= 3 and h[i_stim_best, i_time_best] == h_prev:
+            break
+        i_stim_2, i_time_2, h_old_2 = i_stim_1, i_time_1, h_old_1
+        i_stim_1, i_time_1, h_old_1 = i_stim_best, i_time_best, h_old
+
+        # update error
+        if direct:
+            _update_error(y_train_error, x_train, train_segs, delta_signed,
+                          i_stim_best, i_time_best)
+            _update_error(y_test_error, x_test, test_segs, delta_signed,
+                          i_stim_best, i_time_best)
+        else:
+            e_train = new_train_error
+            e_test += delta_signed * (
+                delta_signed * xx_test[i_stim_best, i_time_best,
+                                       i_stim_best, i_time_best] -
+                2 * xy_test[i_stim_best, i_time_best])
+            _update_xy(xy_train, xx_train, delta_signed, i_stim_best,
+                       i_time_best)
+            _update_xy(xy_test, xx_test, delta_signed, i_stim_best,
+                       i_time_best)
+
+    return steps, test_error_history
+
+
+def kernel_at(steps, long i_boost, h):
+    """Reconstruct the kernel at the start of iteration ``i_boost``
+
+    Parameters
+    ----------
+    steps : list of tuple
+        Steps returned by :func:`boost_segs`.
+    i_boost : int
+        Iteration.
+    h : array (n_stims, trf_length)
+        Kernel at the start of boosting (modified in place).
+    """
+    for i, i_stim, i_time, delta_signed in steps:
+        if i >= i_boost:
+            break
+        h[i_stim, i_time] += delta_signed
+    return h
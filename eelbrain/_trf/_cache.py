@@ -0,0 +1,137 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+"""Content-addressed on-disk cache for boosting results"""
+from cPickle import dumps, HIGHEST_PROTOCOL
+import hashlib
+import os
+
+import numpy as np
+
+from .._data_obj import NDVar
+from .._io.pickle import pickle, unpickle
+
+
+# default maximum size of the cache (in bytes)
+DEFAULT_MAX_SIZE = 4 * 2 ** 30
+FILE_EXT = '.pickled'
+
+
+class BoostingCache(object):
+    """Cache for :class:`BoostingResult` objects
+
+    Results are stored in files named by a hash of the input data and
+    parameters, so cached results are only used if ``y``, ``x`` and all
+    parameters are identical.
+
+    Parameters
+    ----------
+    path : str
+        Cache directory (created if it does not exist).
+    max_size : None | int
+        Maximum total size of the cache in bytes (default 4 GB). When the cache
+        grows larger, the least recently used results are deleted. ``None``
+        for no limit.
+    """
+    def __init__(self, path, max_size=DEFAULT_MAX_SIZE):
+        path = os.path.expanduser(path)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self.path = path
+        self.max_size = max_size
+
+    def __repr__(self):
+        return '<BoostingCache: %r>' % (self.path,)
+
+    def _path(self, key):
+        return os.path.join(self.path, key + FILE_EXT)
+
+    def get(self, key):
+        """Load a cached result
+
+        Parameters
+        ----------
+        key : str
+            Key from :func:`boosting_key`.
+
+        Returns
+        -------
+        res : None | BoostingResult
+            Cached result (``None`` if there is no result for ``key``).
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return
+        try:
+            res = unpickle(path)
+        except (EOFError, IOError):
+            # incompletely written file
+            os.remove(path)
+            return
+        # mark as recently used
+        os.utime(path, None)
+        return res
+
+    def put(self, key, res):
+        """Store a result and remove old results if the cache is too large
+
+        Parameters
+        ----------
+        key : str
+            Key from :func:`boosting_key`.
+        res : BoostingResult
+            Result to store.
+        """
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        pickle(res, tmp_path)
+        os.rename(tmp_path, path)
+        if self.max_size is not None:
+            self.evict(self.max_size)
+
+    def evict(self, max_size):
+        """Remove the least recently used results until the cache is small enough
+
+        Parameters
+        ----------
+        max_size : int
+            Maximum total size of the cache in bytes.
+        """
+        files = []
+        for fname in os.listdir(self.path):
+            if fname.endswith(FILE_EXT):
+                path = os.path.join(self.path, fname)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        size = sum(f[1] for f in files)
+        for _, file_size, path in sorted(files):
+            if size <= max_size:
+                break
+            os.remove(path)
+            size -= file_size
+
+    def clear(self):
+        "Remove all cached results"
+        self.evict(0)
+
+
+def boosting_key(y, x, tstart, tstop, scale_data, delta, mindelta, error,
+                 version):
+    """Hash of the input data and parameters to :func:`boosting`"""
+    h = hashlib.sha1()
+    _hash_update(h, y)
+    _hash_update(h, x)
+    params = (tstart, tstop, bool(scale_data), delta, mindelta, error, version)
+    h.update(repr(params))
+    return h.hexdigest()
+
+
+def _hash_update(h, obj):
+    if isinstance(obj, NDVar):
+        x = np.ascontiguousarray(obj.x)
+        h.update(dumps((x.dtype.str, x.shape, obj.dims, obj.name),
+                       HIGHEST_PROTOCOL))
+        h.update(x)
+    else:
+        h.update('(')
+        for item in obj:
+            _hash_update(h, item)
+        h.update(')')
@@ -1,8 +1,10 @@
+from itertools import izip
+
 import numpy as np
 from numpy import newaxis
 
 from .. import _colorspaces as cs
-from .._data_obj import NDVar, UTS, dataobj_repr
+from .._data_obj import Case, NDVar, UTS, dataobj_repr
 
 
 class RevCorrData(object):
@@ -14,6 +16,9 @@ class RevCorrData(object):
         Dependent variable.
     x : array  (n_x, n_times)
         Predictors.
+    segments : None | array  (n_segments, 2)
+        For data with multiple segments (trials or runs), the start and stop
+        index of each segment along the time axis of ``y`` and ``x``.
     """
     def __init__(self, y, x, error, scale_data):
         # scale_data param
@@ -27,27 +32,72 @@ class RevCorrData(object):
         else:
             raise TypeError("scale_data=%r, need bool or str" % (scale_data,))
 
+        # segments
+        if isinstance(y, NDVar):
+            if y.has_case:
+                n_segs = len(y)
+                if isinstance(x, NDVar):
+                    x_has_case = x.has_case
+                else:
+                    x = tuple(x)
+                    x_has_case = all(x_.has_case for x_ in x)
+                if not x_has_case:
+                    raise ValueError("y has case dimension but x does not")
+                ys = [y[i] for i in xrange(n_segs)]
+                if isinstance(x, NDVar):
+                    xs = [x[i] for i in xrange(n_segs)]
+                else:
+                    xs = [tuple(x_[i] for x_ in x) for i in xrange(n_segs)]
+            else:
+                ys = (y,)
+                xs = (x,)
+        else:
+            ys = tuple(y)
+            xs = tuple(x)
+            if len(xs) != len(ys):
+                raise ValueError("y and x have different number of segments "
+                                 "(%i and %i)" % (len(ys), len(xs)))
+            elif not ys:
+                raise ValueError("y without segments")
+        segmented = len(ys) > 1
+
         # check y and x
-        if isinstance(x, NDVar):
-            x_name = x.name
-            x = (x,)
+        y = ys[0]
+        if isinstance(xs[0], NDVar):
+            x_name = xs[0].name
             multiple_x = False
         else:
-            x = tuple(x)
-            assert all(isinstance(x_, NDVar) for x_ in x)
-            x_name = tuple(x_.name for x_ in x)
+            x_name = tuple(x_.name for x_ in xs[0])
             multiple_x = True
         time_dim = y.get_dim('time')
-        if any(x_.get_dim('time') != time_dim for x_ in x):
-            raise ValueError("Not all NDVars have the same time dimension")
+        x_segs = []
+        for y_, x in izip(ys, xs):
+            if isinstance(x, NDVar):
+                x = (x,)
+            else:
+                x = tuple(x)
+                assert all(isinstance(x_, NDVar) for x_ in x)
+            y_time = y_.get_dim('time')
+            if segmented:
+                if y_time.tstep != time_dim.tstep:
+                    raise ValueError("Not all segments have the same time step")
+                if any(x_.get_dim('time') != y_time for x_ in x):
+                    raise ValueError("Not all NDVars in a segment have the same "
+                                     "time dimension")
+            elif any(x_.get_dim('time') != time_dim for x_ in x):
+                raise ValueError("Not all NDVars have the same time dimension")
+            x_segs.append(x)
 
         # y_data:  ydim x time array
         if y.ndim == 1:
             ydim = None
-            y_data = y.x[None, :]
+            y_data = [y_.x[None, :] for y_ in ys]
         elif y.ndim == 2:
             ydim = y.dims[not y.get_axis('time')]
-            y_data = y.get_data((ydim.name, 'time'))
+            y_data = [y_.get_data((ydim.name, 'time')) for y_ in ys]
+            if any(y_.get_dim(ydim.name) != ydim for y_ in ys[1:]):
+                raise ValueError("Not all segments of y have the same %s "
+                                 "dimension" % ydim.name)
         else:
             raise NotImplementedError("y with more than 2 dimensions")
 
@@ -56,16 +106,20 @@ class RevCorrData(object):
         x_meta = []
         x_names = []
         n_x = 0
-        for x_ in x:
+        for i, x_ in enumerate(x_segs[0]):
+            x_seg = [x[i] for x in x_segs]
             if x_.ndim == 1:
                 xdim = None
-                data = x_.x[newaxis, :]
+                data = [xs_.x[newaxis, :] for xs_ in x_seg]
                 index = n_x
                 x_names.append(dataobj_repr(x_))
             elif x_.ndim == 2:
                 xdim = x_.dims[not x_.get_axis('time')]
-                data = x_.get_data((xdim.name, 'time'))
-                index = slice(n_x, n_x + len(data))
+                data = [xs_.get_data((xdim.name, 'time')) for xs_ in x_seg]
+                if any(xs_.get_dim(xdim.name) != xdim for xs_ in x_seg[1:]):
+                    raise ValueError("Not all segments of %s have the same %s "
+                                     "dimension" % (x_.name, xdim.name))
+                index = slice(n_x, n_x + len(data[0]))
                 x_repr = dataobj_repr(x_)
                 for v in xdim:
                     x_names.append("%s-%s" % (x_repr, v))
@@ -73,14 +127,32 @@ class RevCorrData(object):
                 raise NotImplementedError("x with more than 2 dimensions")
             x_data.append(data)
             x_meta.append((x_.name, xdim, index))
-            n_x += len(data)
+            n_x += len(data[0])
 
-        if len(x_data) == 1:
-            x_data = x_data[0]
-            x_is_copy = False
-        else:
-            x_data = np.vstack(x_data)
+        if segmented:
+            n_times = [d.shape[1] for d in y_data]
+            if any(d.shape[1] != n for data in x_data for d, n in
+                   izip(data, n_times)):
+                raise ValueError("y and x have inconsistent number of time "
+                                 "points")
+            stops = np.cumsum(n_times)
+            segments = np.column_stack((stops - n_times, stops)).astype(np.int64)
+            # lay out all segments in one buffer (which can then be scaled in
+            # place)
+            y_data = np.hstack(y_data)
+            x_data = np.vstack([np.hstack(data) for data in x_data])
             x_is_copy = True
+            scale_in_place = True
+        else:
+            segments = None
+            y_data = y_data[0]
+            x_data = [data[0] for data in x_data]
+            if len(x_data) == 1:
+                x_data = x_data[0]
+                x_is_copy = False
+            else:
+                x_data = np.vstack(x_data)
+                x_is_copy = True
 
         if scale_data:
             if not scale_in_place:
@@ -122,6 +194,7 @@ class RevCorrData(object):
             raise ValueError("Data with NaN: " + ', '.join(has_nan))
 
         self.time = time_dim
+        self.segments = segments
         self._scale_data = bool(scale_data)
         # y
         self.y = y_data
@@ -208,3 +281,21 @@ class RevCorrData(object):
             return value[0]
         else:
             return NDVar(value, (self.ydim,), self._y_info.copy(), name)
+
+    def package_distribution(self, dist, meas, name):
+        """Package a distribution as NDVar with case dimension
+
+        Parameters
+        ----------
+        dist : array  (n_samples, n_y)
+            Distribution of a statistic or value for each ``y``.
+        meas : None | str
+            Measurement for statistics (``None`` for values in units of ``y``).
+        name : str
+            Name of the NDVar.
+        """
+        info = self._y_info.copy() if meas is None else cs.stat_info(meas)
+        if self.ydim is None:
+            return NDVar(dist[:, 0], (Case,), info, name)
+        else:
+            return NDVar(dist, (Case, self.ydim), info, name)
@@ -1,15 +1,26 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+from itertools import izip
 from math import floor
 import os
 
-from nose.tools import eq_, assert_almost_equal, assert_is_none, assert_raises
+from nose.tools import (
+    eq_, ok_, assert_almost_equal, assert_is_none, assert_raises)
 import numpy as np
 from numpy.testing import assert_array_equal, assert_allclose
 import cPickle as pickle
 import scipy.io
-from eelbrain import boosting, convolve, configure, datasets
-from eelbrain._trf._boosting import boost_1seg, evaluate_kernel
-from eelbrain._utils.testing import assert_dataobj_equal
+import scipy.stats
+from eelbrain import (
+    NDVar, BoostingCache, boosting, boosting_permutation, boosting_sweep,
+    convolve, configure, datasets)
+from eelbrain._stats.error_functions import l1_for_delta, l2_for_delta
+from eelbrain._trf import _boosting
+from eelbrain._trf._boosting import (
+    apply_kernel, boost_1seg, boost_1seg_batch, boost_folds, evaluate_kernel,
+    permute_x, segments, split_data, x_permutations, y_blocks)
+from eelbrain._trf._boosting_opt import (
+    generate_options, kernel_at, l2_xx, l2_xy)
+from eelbrain._utils.testing import TempDir, assert_dataobj_equal
 
 
 def assert_res_equal(res1, res):
@@ -133,3 +144,272 @@ def test_boosting_func():
     assert_almost_equal(rr, mat['crlt'][1, 0])
     # svdboostV4pred multiplies error by number of predictors
     assert_allclose(test_sse_history, mat['Str_testE'][0] / 3)
+
+    # l2 error updated directly instead of through the xx table
+    max_size = _boosting.L2_XX_MAX_SIZE
+    _boosting.L2_XX_MAX_SIZE = 0
+    try:
+        h, test_sse_history = boost_1seg(x, y, 10, 0.005, 40, 0, 0.01, 'l2',
+                                         True)
+    finally:
+        _boosting.L2_XX_MAX_SIZE = max_size
+    assert_array_equal(h, mat['h'])
+    assert_allclose(test_sse_history, mat['Str_testE'][0] / 3)
+
+
+def test_cache():
+    "Test caching boosting results"
+    ds = datasets._get_continuous()
+    tempdir = TempDir()
+    res = boosting(ds['y'], ds['x1'], 0, 1, cache=tempdir)
+    eq_(len(os.listdir(tempdir)), 1)
+    res_c = boosting(ds['y'], ds['x1'], 0, 1, cache=tempdir)
+    assert_res_equal(res_c, res)
+    eq_(res_c.t_run, res.t_run)
+    # different data or parameters
+    res_2 = boosting(ds['y'], ds['x1'], 0, 1, delta=0.01, cache=tempdir)
+    eq_(res_2.delta, 0.01)
+    y = ds['y'].copy()
+    y.x[0] += 1
+    boosting(y, ds['x1'], 0, 1, cache=tempdir)
+    eq_(len(os.listdir(tempdir)), 3)
+    # in-place scaling would be skipped for cached results
+    assert_raises(ValueError, boosting, y, ds['x1'], 0, 1,
+                  scale_data='inplace', cache=tempdir)
+    eq_(len(os.listdir(tempdir)), 3)
+    # eviction
+    cache = BoostingCache(tempdir)
+    cache.evict(max(os.path.getsize(os.path.join(tempdir, fname)) for fname in
+                    os.listdir(tempdir)))
+    eq_(len(os.listdir(tempdir)), 1)
+    cache.clear()
+    eq_(os.listdir(tempdir), [])
+
+
+def test_sweep():
+    "Test boosting_sweep()"
+    ds = datasets._get_continuous()
+    y = ds['y']
+    x = [ds['x1'], ds['x2']]
+    sweep = boosting_sweep(y, x, 0, (0.5, 1), delta=(0.01, 0.005),
+                           warm_start=False)
+    eq_(len(sweep), 4)
+    eq_(repr(sweep), '<BoostingSweep: 4 results, tstop=(0.5, 1), '
+                     'delta=(0.01, 0.005)>')
+    eq_(list(sweep), [(0, 0.5, 0.01, None, 'l2'), (0, 0.5, 0.005, None, 'l2'),
+                      (0, 1, 0.01, None, 'l2'), (0, 1, 0.005, None, 'l2')])
+    res = boosting(y, x, 0, 1, delta=0.01)
+    assert_res_equal(sweep.get(tstop=1, delta=0.01), res)
+    res = boosting(y, x, 0, 0.5)
+    assert_res_equal(sweep[0, 0.5, 0.005, None, 'l2'], res)
+    assert_raises(TypeError, sweep.get, tstop=1)
+    assert_raises(ValueError, sweep.get, tstop=2, delta=0.01)
+    sweep_p = pickle.loads(pickle.dumps(sweep, pickle.HIGHEST_PROTOCOL))
+    assert_res_equal(sweep_p.get(tstop=1, delta=0.01),
+                     sweep.get(tstop=1, delta=0.01))
+
+    # warm start
+    sweep = boosting_sweep(y, x, 0, 1, delta=(0.01, 0.005))
+    res = sweep.get(delta=0.005)
+    eq_(res.delta, 0.005)
+    assert res.r >= 0.9
+
+
+def test_permutation():
+    "Test boosting_permutation()"
+    ds = datasets._get_continuous()
+    y = ds['y']
+    x1 = ds['x1']
+    res = boosting(y, x1, 0, 1)
+    null = boosting_permutation(y, x1, 0, 1, 5)
+    assert_res_equal(null.result, res)
+    eq_(null.r.shape, (5,))
+    assert np.all(null.r.x < res.r)
+    eq_(null.r_p, 1 / 6.)
+    eq_(repr(null), '<BoostingPermutation: boosting y ~ x1, 0 - 1, '
+                    'samples=5, permute=\'shift\'>')
+    # workers
+    configure(n_workers=0)
+    null_s = boosting_permutation(y, x1, 0, 1, 5)
+    configure(n_workers=True)
+    assert_res_equal(null_s.result, res)
+    assert_array_equal(null_s.r.x, null.r.x)
+    # permutation functions
+    x = np.arange(20.)[None]
+    segs = np.array([[0, 10], [10, 20]])
+    perms = x_permutations(20, segs, 3)
+    for order, shifts in perms:
+        assert_array_equal(order, [0, 1])
+        assert np.all((shifts >= 1) & (shifts <= 9))
+    assert_array_equal(permute_x(x, segs, [1, 0], [0, 0])[0],
+                       np.roll(np.arange(20.), 10))
+    assert_array_equal(permute_x(x, None, [0], [3])[0],
+                       np.roll(np.arange(20.), 3))
+    perms = x_permutations(20, segs, 3, 'segments')
+    eq_(len(perms), 3)
+    # the original order is not a permutation
+    for n_segs in (2, 3):
+        segs_ = np.array([[i * 10, (i + 1) * 10] for i in xrange(n_segs)])
+        for order, shifts in x_permutations(10 * n_segs, segs_, 20,
+                                            'segments'):
+            ok_(np.any(order != np.arange(n_segs)))
+            assert_array_equal(np.sort(order), np.arange(n_segs))
+    assert_raises(ValueError, x_permutations, 20, None, 3, 'segments')
+    assert_raises(ValueError, x_permutations, 20, np.array([[0, 8], [8, 20]]),
+                  3, 'segments')
+    assert_raises(ValueError, x_permutations, 20, None, 3, 'shuffle')
+
+
+def test_segments():
+    "Test boosting with multiple segments"
+    # cross-validation folds
+    x = np.arange(100.)[None]
+    segs = np.array([[0, 40], [40, 100]])
+    y_train, y_test, x_train, x_test = split_data(x, x[0], 10, 1, segs)
+    eq_([y[[0, -1]].tolist() for y in y_test], [[4, 7], [46, 51]])
+    eq_([y[[0, -1]].tolist() for y in y_train],
+        [[0, 3], [8, 39], [40, 45], [52, 99]])
+    segs = np.column_stack((np.arange(0, 100, 5), np.arange(5, 101, 5)))
+    y_train, y_test, x_train, x_test = split_data(x, x[0], 10, 9, segs)
+    eq_([y[[0, -1]].tolist() for y in y_test], [[90, 94], [95, 99]])
+    eq_(len(y_train), 18)
+
+    # segments as case or sequence
+    dss = [datasets._get_continuous(seed=i) for i in xrange(4)]
+    y = [ds['y'] for ds in dss]
+    x = [[ds['x1'], ds['x2']] for ds in dss]
+    res = boosting(y, x, 0, 1)
+    eq_(res.h[0].time, dss[0]['h1'].time)
+    assert res.r > 0.9
+    time = dss[0]['y'].time
+    y_case = NDVar(np.vstack([y_.x for y_ in y]), ('case', time), name='y')
+    x1 = NDVar(np.vstack([x_[0].x for x_ in x]), ('case', time), name='x1')
+    x2 = NDVar(np.stack([x_[1].x for x_ in x]),
+               ('case',) + dss[0]['x2'].dims, name='x2')
+    res_case = boosting(y_case, [x1, x2], 0, 1)
+    assert_res_equal(res_case, res)
+    # negative tstart
+    res = boosting(y_case, [x1, x2], -0.2, 1)
+    assert res.r > 0.9
+
+
+def test_boost_batch():
+    "Test boosting multiple signals with the same stimulus"
+    eq_(y_blocks(10, 1), [(0, 10)])
+    eq_(y_blocks(10, 4), [(0, 3), (3, 6), (6, 9), (9, 10)])
+    eq_(y_blocks(200, 1), [(0, 50), (50, 100), (100, 150), (150, 200)])
+
+    ds = datasets._get_continuous()
+    x = ds['x1'].x[None]
+    y = np.vstack((ds['y'].x, -ds['y'].x, ds['y'].x[::-1]))
+    for error in ('l2', 'l1'):
+        hs = boost_1seg_batch(x, y, 10, 0.005, 10, 2, 0.005, error)
+        for y_, h in izip(y, hs):
+            h_ = boost_1seg(x, y_, 10, 0.005, 10, 2, 0.005, error)
+            if h_ is None:
+                assert_is_none(h)
+            else:
+                assert_allclose(h, h_)
+
+    # multiple folds
+    h_sum, n_h, n_iter, fold_hs = boost_folds(x, y, 10, 0.005, 0.005, 'l2',
+                                              None, 10, (2, 5), None, True)
+    for y_, h_s, n, hs in izip(y, h_sum, n_h, fold_hs):
+        hs_ = [boost_1seg(x, y_, 10, 0.005, 10, i, 0.005, 'l2') for i in (2, 5)]
+        eq_(n, sum(h is not None for h in hs_))
+        for h, h_ in izip(hs, hs_):
+            if h_ is None:
+                assert_is_none(h)
+            else:
+                assert_allclose(h, h_)
+        assert_allclose(h_s, sum(h for h in hs_ if h is not None))
+
+
+def test_evaluate_kernel():
+    "Test applying and evaluating kernels"
+    np.random.seed(0)
+    x = np.random.normal(0, 1, (2, 10000))
+    h = np.random.normal(0, 1, (3, 2, 20))
+    y = np.random.normal(0, 1, (3, 10000))
+    y_pred = apply_kernel(x, h)
+    for y_pred_i, h_i in izip(y_pred, h):
+        y_direct = (np.convolve(h_i[0], x[0]) + np.convolve(h_i[1], x[1]))
+        assert_allclose(y_pred_i, y_direct[:10000])
+        assert_allclose(apply_kernel(x, h_i), y_pred_i)
+
+    y += y_pred
+    for error in ('l1', 'l2'):
+        rs, rrs, errs = evaluate_kernel(y, x, h, error)
+        for y_i, y_pred_i, h_i, r, rr, err in izip(y, y_pred, h, rs, rrs, errs):
+            assert_allclose((r, rr, err), evaluate_kernel(y_i, x, h_i, error))
+            assert_almost_equal(r, np.corrcoef(y_i[19:], y_pred_i[19:])[0, 1])
+            assert_almost_equal(
+                rr, scipy.stats.spearmanr(y_i[19:], y_pred_i[19:])[0])
+
+
+def test_kernel_at():
+    "Test reconstructing kernels from boosting steps"
+    steps = [(0, 0, 1, 0.1), (1, 1, 0, -0.1), (3, 0, 1, 0.1)]
+    assert_array_equal(kernel_at(steps, 0, np.zeros((2, 3))), 0)
+    assert_array_equal(kernel_at(steps, 1, np.zeros((2, 3))),
+                       [[0, 0.1, 0], [0, 0, 0]])
+    assert_array_equal(kernel_at(steps, 3, np.zeros((2, 3))),
+                       [[0, 0.1, 0], [-0.1, 0, 0]])
+    assert_array_equal(kernel_at(steps, 4, np.zeros((2, 3))),
+                       [[0, 0.2, 0], [-0.1, 0, 0]])
+    # warm start
+    assert_array_equal(kernel_at(steps, 1, np.ones((2, 3))),
+                       [[1, 1.1, 1], [1, 1, 1]])
+
+
+def test_generate_options():
+    "Test compiled evaluation of kernel modifications"
+    np.random.seed(0)
+    ys = (np.random.normal(0, 1, 50), np.random.normal(0, 1, 30))
+    xs = (np.random.normal(0, 1, (3, 50)), np.random.normal(0, 1, (3, 30)))
+    y = np.concatenate(ys)
+    x = np.concatenate(xs, 1)
+    segs = segments(ys)
+    assert_array_equal(segs, [[0, 50], [50, 80]])
+    new_error = np.empty((3, 10))
+    new_sign = np.empty((3, 10), np.int8)
+    for error, delta_error in (('l1', l1_for_delta), ('l2', l2_for_delta)):
+        generate_options(y, x, segs, 0.1, error, new_error, new_sign)
+        for i_stim in xrange(3):
+            for i_time in xrange(10):
+                e_add = e_sub = 0.
+                for y_, x_ in zip(ys, xs):
+                    e_add_, e_sub_ = delta_error(y_, x_[i_stim], 0.1, i_time)
+                    e_add += e_add_
+                    e_sub += e_sub_
+                eq_(new_error[i_stim, i_time], min(e_add, e_sub))
+                eq_(new_sign[i_stim, i_time], -1 if e_add > e_sub else 1)
+
+
+def test_l2_tables():
+    "Test tables for closed-form l2 error"
+    np.random.seed(0)
+    ys = (np.random.normal(0, 1, 50), np.random.normal(0, 1, 6))
+    xs = (np.random.normal(0, 1, (3, 50)), np.random.normal(0, 1, (3, 6)))
+    y = np.concatenate(ys)
+    x = np.concatenate(xs, 1)
+    segs = segments(ys)
+    trf_length = 10
+    # shifted stimuli, zero-padded within each segment
+    x_shifted = np.zeros((3, trf_length, len(y)))
+    for (start, stop), x_ in zip(segs, xs):
+        for i_time in xrange(trf_length):
+            if i_time < stop - start:
+                x_shifted[:, i_time, start + i_time:stop] = \
+                    x_[:, :stop - start - i_time]
+    xx = l2_xx(x, segs, trf_length)
+    assert_allclose(xx, np.einsum('abi,cdi->abcd', x_shifted, x_shifted))
+    xy = l2_xy(y, x, segs, trf_length)
+    assert_allclose(xy, np.einsum('abi,i->ab', x_shifted, y))
+    # closed form error of a step
+    sse = np.sum(y ** 2)
+    for i_stim, i_time, delta in ((0, 0, 0.1), (2, 7, -0.3)):
+        y_error = y - delta * x_shifted[i_stim, i_time]
+        assert_almost_equal(sse - 2 * delta * xy[i_stim, i_time] + delta ** 2 *
+                            xx[i_stim, i_time, i_stim, i_time],
+                            np.sum(y_error ** 2))
@@ -0,0 +1,235 @@
+# Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
+"""Worker pool for multiprocessing-enabled computations
+
+Workers are started once and can then process any number of jobs. Data that
+is created after the workers are started is passed to them through
+:class:`SharedArray` segments, which are backed by memory-mapped files.
+
+A job is a picklable object with two methods: ``job.setup()`` is called once
+in each worker before the first item of the job is processed, and
+``job(item)`` processes one item and returns the number of units of work it
+represents (for progress reporting).
+"""
+import atexit
+from itertools import count
+import logging
+from multiprocessing import Process, Queue, Value
+from multiprocessing.queues import SimpleQueue
+import os
+import signal
+import tempfile
+from time import sleep
+import traceback
+
+import numpy as np
+from tqdm import tqdm
+
+from .._config import CONFIG
+
+
+# memory-mapped files in /dev/shm stay in memory on Linux
+SHM_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+# seconds between checks for progress and errors
+POLL_INTERVAL = 0.05
+
+_POOL = None
+
+
+class SharedArray(object):
+    """Array in a memory-mapped file that can be opened by worker processes
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Array shape.
+    dtype : numpy dtype
+        Array data type.
+
+    Notes
+    -----
+    Pickling a :class:`SharedArray` only transfers the file name; the array is
+    opened in read-write mode when it is unpickled in a worker.
+    """
+    def __init__(self, shape, dtype=np.float64):
+        fd, self.path = tempfile.mkstemp('.dat', 'eelbrain-', SHM_DIR)
+        os.close(fd)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.x = np.memmap(self.path, self.dtype, 'w+', shape=self.shape)
+        self._owner = True
+
+    @classmethod
+    def from_array(cls, x):
+        "Create a :class:`SharedArray` with a copy of ``x``"
+        out = cls(x.shape, x.dtype)
+        out.x[:] = x
+        return out
+
+    def __getstate__(self):
+        return {'path': self.path, 'shape': self.shape,
+                'dtype': self.dtype.str}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.shape = state['shape']
+        self.dtype = np.dtype(state['dtype'])
+        self.x = np.memmap(self.path, self.dtype, 'r+', shape=self.shape)
+        self._owner = False
+
+    def close(self):
+        "Release the array (and remove the file if this is the original)"
+        self.x = None
+        if self._owner:
+            try:
+                os.remove(self.path)
+            except OSError:  # file still mapped on Windows
+                pass
+
+
+class WorkerPool(object):
+    """Pool of worker processes
+
+    Parameters
+    ----------
+    n_workers : int
+        Number of worker processes.
+    """
+    def __init__(self, n_workers):
+        logger = logging.getLogger(__name__)
+        logger.debug("Starting %i worker processes...", n_workers)
+        self.n_workers = n_workers
+        self._job_ids = count(1)
+        self._queue = SimpleQueue()
+        self._error_queue = SimpleQueue()
+        # jobs can be large, Queue does not block until they are read
+        self._job_queues = [Queue() for _ in xrange(n_workers)]
+        self._counter = Value('L', 0)
+        self._workers = []
+        for job_queue in self._job_queues:
+            args = (self._queue, job_queue, self._error_queue, self._counter)
+            w = Process(target=pool_worker, args=args)
+            w.daemon = True
+            w.start()
+            self._workers.append(w)
+
+    def is_alive(self):
+        return bool(self._workers) and all(w.is_alive() for w in self._workers)
+
+    def run(self, job, items, n, desc=None, unit=' items'):
+        """Process all items of a job
+
+        Parameters
+        ----------
+        job : job
+            Picklable job object (see module documentation).
+        items : iterator
+            Items to pass to ``job``.
+        n : int
+            Total number of units of work (sum of values returned by ``job``
+            for all items).
+        desc : str
+            Description for the progress bar (no progress bar if None).
+        unit : str
+            Unit for the progress bar.
+        """
+        job_id = next(self._job_ids)
+        for job_queue in self._job_queues:
+            job_queue.put((job_id, job))
+        with self._counter.get_lock():
+            self._counter.value = 0
+
+        progress = tqdm(total=n, desc=desc, unit=unit, disable=desc is None)
+        try:
+            for item in items:
+                self._queue.put((job_id, item))
+                self._check(progress)
+            while self._counter.value < n:
+                sleep(POLL_INTERVAL)
+                self._check(progress)
+        except:
+            # the state of the queues is unknown
+            self.close(False)
+            raise
+        finally:
+            progress.close()
+
+    def _check(self, progress):
+        progress.update(self._counter.value - progress.n)
+        if not self._error_queue.empty():
+            raise RuntimeError("Error in worker process:\n\n%s" %
+                               self._error_queue.get())
+        elif not self.is_alive():
+            raise RuntimeError("Worker process died")
+
+    def close(self, wait=True):
+        "Shut down the worker processes"
+        if wait:
+            for _ in self._workers:
+                self._queue.put(None)
+            for w in self._workers:
+                w.join(1)
+        for w in self._workers:
+            if w.is_alive():
+                w.terminate()
+        self._workers = []
+        logger = logging.getLogger(__name__)
+        logger.debug("Worker processes shut down")
+
+
+def pool_worker(queue, job_queue, error_queue, counter):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    job_id = job = None
+    while True:
+        item = queue.get()
+        if item is None:
+            break
+        item_job_id, data = item
+        try:
+            if item_job_id != job_id:
+                # skip jobs for which this worker received no items
+                while job_id != item_job_id:
+                    job_id, job = job_queue.get()
+                job.setup()
+            n = job(data)
+        except Exception:
+            error_queue.put(traceback.format_exc())
+        else:
+            with counter.get_lock():
+                counter.value += n
+
+
+class worker_pool(object):
+    """Context manager providing a :class:`WorkerPool`
+
+    With ``configure(persistent_workers=True)``, the same pool is reused until
+    the configuration changes or the interpreter exits; otherwise, a new pool
+    is started and shut down at the end of the context.
+    """
+    def __enter__(self):
+        global _POOL
+        n_workers = CONFIG['n_workers']
+        if CONFIG['persistent_workers']:
+            if _POOL is not None and (_POOL.n_workers != n_workers or
+                                      not _POOL.is_alive()):
+                shutdown_pool()
+            if _POOL is None:
+                _POOL = WorkerPool(n_workers)
+            self.pool = _POOL
+        else:
+            self.pool = WorkerPool(n_workers)
+        return self.pool
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.pool is not _POOL:
+            self.pool.close()
+
+
+def shutdown_pool():
+    "Shut down the persistent worker pool"
+    global _POOL
+    if _POOL is not None:
+        _POOL.close()
+        _POOL = None
+
+
+atexit.register(shutdown_pool)
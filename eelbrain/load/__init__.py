@@ -21,5 +21,6 @@ from . import fiff
 from . import txt
 
 from .txt import tsv
+from .._io.columns import load_columns as columns
 from .._io.pickle import unpickle, update_subjects_dir
 from .._io.wav import load_wav as wav
@@ -2,6 +2,7 @@
 """Helper functions for saving data in various formats."""
 
 from ._besa import meg160_triggers, besa_evt
+from .._io.columns import save_columns as columns
 from .._io.pickle import pickle
 from ._txt import txt
 from .._io.wav import save_wav as wav
@@ -2,7 +2,8 @@
 __test__ = False
 
 from ._stats.testnd import (
-    t_contrast_rel, corr, ttest_1samp, ttest_ind, ttest_rel, anova)
+    t_contrast_rel, corr, ttest_1samp, ttest_ind, ttest_rel, anova,
+    write_checkpoint)
 from ._stats.spm import LM, LMGroup
 
 
@@ -1,6 +1,7 @@
 # Author: Christian Brodbeck <christianbrodbeck@nyu.edu>
 from __future__ import print_function
 from copy import deepcopy
+import gc
 from itertools import chain, izip, product
 from operator import (
     add, iadd, sub, isub, mul, imul, div, idiv, floordiv, ifloordiv, mod, imod)
@@ -10,6 +11,7 @@ import shutil
 from string import ascii_lowercase
 import tempfile
 import warnings
+import weakref
 
 import mne
 from nose.tools import (
@@ -22,9 +24,9 @@ from numpy.testing import (
 from scipy import signal
 
 from eelbrain import (
-    datasets, load, Var, Factor, NDVar, Datalist, Dataset, Celltable,
-    Case, Categorial, Scalar, Sensor, UTS, align, align1, choose, combine,
-    cwt_morlet, shuffled_index)
+    datasets, load, save, Var, Factor, NDVar, LazyNDVar, Datalist, Dataset,
+    Celltable, Combiner, Case, Categorial, Scalar, Sensor, UTS, align, align1,
+    choose, combine, cwt_morlet, shuffled_index)
 from eelbrain._data_obj import (
     all_equal, asvar, assub, FULL_AXIS_SLICE, FULL_SLICE, longname, SourceSpace,
     assert_has_no_empty_cells)
@@ -74,6 +76,35 @@ def test_aggregate():
     dsa = sds.aggregate('A%B', drop=drop, equal_count=True)
     assert_array_equal(dsa['n'], [12, 12, 12])
 
+    # NDVar and Var with interleaved cells
+    ds = datasets.get_uts(utsnd=True)
+    ds = ds[np.random.RandomState(0).permutation(ds.n_cases)]
+    x = ds.eval('A % B')
+    for func in (np.mean, np.sum, np.std, np.median):
+        y = ds['utsnd'].aggregate(x, func)
+        for i, cell in enumerate(x.cells):
+            assert_allclose(y.x[i], func(ds['utsnd'].x[x == cell], 0))
+        y = ds['Y'].aggregate(x, func)
+        assert_array_equal(y, [func(ds['Y'].x[x == cell]) for cell in x.cells])
+    # bool and small int data are summed like with numpy.sum
+    utsnd = ds['utsnd']
+    for data in (utsnd > 0, (utsnd * 100).astype(np.int8)):
+        y = data.aggregate(x, np.sum)
+        for i, cell in enumerate(x.cells):
+            y_cell = np.sum(data.x[x == cell], 0)
+            eq_(y.x.dtype, y_cell.dtype)
+            assert_array_equal(y.x[i], y_cell)
+    # empty cells
+    idx = ds.eval("logical_or(A == 'a1', B == 'b1')")
+    x = ds[idx].eval('A % B')
+    y = ds[idx]['utsnd'].aggregate(x)
+    eq_(len(y), 3)
+    assert_allclose(y.x[2], ds[idx]['utsnd'].x[x == ('a1', 'b1')].mean(0))
+    dsa = ds[idx].aggregate(x, drop=drop)
+    assert_array_equal(dsa['n'], [15, 15, 15])
+    eq_(dsa['A'].as_labels(), ['a0', 'a1', 'a1'])
+    eq_(dsa['B'].as_labels(), ['b1', 'b0', 'b1'])
+
 
 def test_align():
     "Testing align() and align1() functions"
@@ -282,6 +313,82 @@ def test_combine():
     eq_(len(dsc.info['b']), 1)
     assert_array_equal(dsc.info['b'][0], np.arange(2))
 
+    # memory-mapped output
+    tempdir = tempfile.mkdtemp()
+    try:
+        dsm = combine((ds1, ds2), mmap=tempdir)
+        assert_is_instance(dsm['utsnd'].x, np.memmap)
+        assert_dataobj_equal(dsm['utsnd'], dsc['utsnd'])
+        del dsm
+    finally:
+        shutil.rmtree(tempdir)
+
+
+def test_combiner():
+    "Test Combiner class"
+    ds = datasets.get_uts(utsnd=True)
+    ds1 = ds[:30]
+    ds2 = ds[30:]
+    combiner = Combiner()
+    combiner.append(ds1)
+    combiner.append(ds2)
+    eq_(len(combiner), 2)
+    assert_dataset_equal(combiner.get(), combine((ds1, ds2)))
+    eq_(len(combiner), 0)
+    # appended Datasets are not modified
+    eq_(ds1.keys(), ds.keys())
+    assert_dataobj_equal(ds1['utsnd'], ds['utsnd'][:30])
+    assert_raises(RuntimeError, combiner.get)
+
+    # NDVars with unequal dimensions
+    y = ds['utsnd']
+    y1 = y.sub(sensor=['0', '1', '2', '3'])
+    y2 = y.sub(sensor=['1', '2', '3', '4'])
+    combiner = Combiner()
+    combiner.append(y1)
+    combiner.append(y2)
+    assert_dataobj_equal(combiner.get(), combine((y1, y2)))
+
+    # incomplete Datasets
+    del ds1['Y']
+    combiner = Combiner(incomplete='fill in')
+    combiner.append(ds1)
+    combiner.append(ds2)
+    assert_dataset_equal(combiner.get(),
+                         combine((ds1, ds2), incomplete='fill in'))
+    combiner = Combiner(incomplete='drop')
+    combiner.append(ds1)
+    combiner.append(ds2)
+    assert_dataset_equal(combiner.get(), combine((ds1, ds2), incomplete='drop'))
+
+    # data are copied when items are added
+    y = ds['utsnd']
+    target = Dataset((y, ds['A']))
+    tempdir = tempfile.mkdtemp()
+    try:
+        for kwargs in ({'n_cases': 60}, {'mmap': tempdir},
+                       {'n_cases': 60, 'mmap': tempdir}):
+            combiner = Combiner(**kwargs)
+            for index in (slice(0, 30), slice(30, 60)):
+                item = Dataset((NDVar(y.x[index].copy(), y.dims, y.info,
+                                      'utsnd'), ds['A'][index]))
+                ref = weakref.ref(item['utsnd'].x)
+                combiner.append(item)
+                del item
+                gc.collect()
+                ok_(ref() is None, "Combiner(%s) keeps data" % kwargs)
+            dsc = combiner.get()
+            assert_dataset_equal(dsc, target)
+            if 'mmap' in kwargs:
+                assert_is_instance(dsc['utsnd'].x, np.memmap)
+            del dsc
+    finally:
+        shutil.rmtree(tempdir)
+    # too many cases
+    combiner = Combiner(n_cases=40)
+    combiner.append(ds1)
+    assert_raises(ValueError, combiner.append, ds2)
+
 
 def test_datalist():
     "Test Datalist class"
@@ -604,6 +711,21 @@ def test_factor():
     assert_equal(f == Factor('aabxxx'), (True, True, True, False, False, False))
     assert_equal(f == Var(np.ones(6)), False)
 
+    # cached cell index
+    f = Factor('abcacbca')
+    assert_array_equal(f == 'a', f.x == f._codes['a'])
+    assert_array_equal(f != 'c', f.x != f._codes['c'])
+    assert_array_equal(f == 'x', False)
+    assert_array_equal(f.index('c'), [2, 4, 6])
+    assert_array_equal(f.sort_index(), np.argsort(f.x, kind='mergesort'))
+    assert_array_equal(f.sort_index(order=('c', 'a')), [2, 4, 6, 0, 3, 7])
+    f[1] = 'c'
+    assert_array_equal(f.index('c'), [1, 2, 4, 6])
+    f.x = f.x[::-1].copy()
+    assert_array_equal(f.index('c'), [1, 3, 5, 6])
+    f.update_labels({'a': 'c', 'b': 'c'})
+    assert_array_equal(f == 'c', True)
+
     # Factor.as_var()
     assert_array_equal(f.as_var(dict(zip('abc', range(3)))), [0, 0, 1, 1, 2, 2])
     assert_array_equal(f.as_var({'a': 1}, 2), [1, 1, 2, 2, 2, 2])
@@ -651,6 +773,28 @@ def test_interaction():
     # eq for element
     for a, b in product(A.cells, B.cells):
         assert_array_equal(i == (a, b), np.logical_and(A == a, B == b))
+        assert_array_equal(i != (a, b), np.logical_or(A != a, B != b))
+        assert_array_equal(i.index((a, b)),
+                           np.flatnonzero(np.logical_and(A == a, B == b)))
+    assert_array_equal(i.isin((('a1', 'b1'), ('a2', 'b2'))),
+                       np.logical_xor(A == 'a1', B == 'b2'))
+    # index is updated when base Factors change
+    i.base[0][0] = 'a2'
+    eq_(i[0], ('a2', B[0]))
+    assert_array_equal(i == i[0], np.logical_and(i.base[0] == 'a2',
+                                                 i.base[1] == B[0]))
+    # base Factors gain or lose cells
+    i = Factor('aabb') % Factor('xyxy')
+    assert_array_equal(i == ('a', 'y'), [False, True, False, False])
+    i.base[0][0] = 'c'
+    assert_array_equal(i == ('a', 'y'), [False, True, False, False])
+    assert_array_equal(i == ('c', 'x'), [True, False, False, False])
+    assert_array_equal(i.index(('b', 'y')), [3])
+    i.base[0][:2] = 'b'
+    assert_array_equal(i == ('b', 'x'), [True, False, True, False])
+    assert_array_equal(i != ('a', 'y'), True)
+    assert_array_equal(i.isin((('b', 'y'), ('c', 'x'))),
+                       [False, True, False, True])
 
     # Interaction.as_factor()
     a = Factor('aabb')
@@ -1078,6 +1222,54 @@ def test_ndvar_indexing():
     assert_array_equal(x.x[3:, 20:], ds['uts'].x[3:, 20:])
 
 
+class ReadCounter(object):
+    "Data source that records how many values were read"
+    def __init__(self, x):
+        self.x = x
+        self.shape = x.shape
+        self.n_read = 0
+
+    def __getitem__(self, index):
+        for i in index:
+            assert isinstance(i, slice) and i.step is None
+        out = self.x[index].copy()
+        self.n_read += out.size
+        return out
+
+
+def test_lazy_ndvar():
+    "Test LazyNDVar"
+    ds = datasets.get_uts(utsnd=True)
+    x = ds['utsnd']
+    source = ReadCounter(x.x)
+    lazy = LazyNDVar(source, x.dims, x.info, x.name)
+    eq_(lazy.shape, x.shape)
+    eq_(len(lazy), len(x))
+    eq_(source.n_read, 0)
+    # indexing
+    for index in ((1,), (slice(2, 10, 3),), ([5, 2, 9],), (slice(None, None, -2),),
+                  (FULL_SLICE, '2'), (FULL_SLICE, ['3', '1'], [0, 0.1]),
+                  (x.sensor.x[:, 0] > 0, 0.1), (slice(0, 3), slice(0.1, 0.2))):
+        source.n_read = 0
+        y = lazy[index]
+        assert_dataobj_equal(y, x[index])
+        assert source.n_read < x.x.size
+    source.n_read = 0
+    assert_dataobj_equal(lazy.mean(time=(0.1, 0.2)), x.mean(time=(0.1, 0.2)))
+    eq_(source.n_read, x.x[..., 30:40].size)
+    assert_dataobj_equal(lazy.summary(sensor='1'), x.summary(sensor='1'))
+    # array sources are indexed directly
+    lazy_array = LazyNDVar(x.x, x.dims, x.info, x.name)
+    assert_dataobj_equal(lazy_array.sub(time=0.1), x.sub(time=0.1))
+    # reading all data
+    eq_(type(pickle.loads(pickle.dumps(lazy))), NDVar)
+    assert_dataobj_equal(lazy.mean('case'), x.mean('case'))
+    assert_array_equal(lazy.x, x.x)
+    source.n_read = 0
+    assert_dataobj_equal(lazy[:3], x[:3])
+    eq_(source.n_read, 0)
+
+
 def test_ndvar_summary_methods():
     "Test NDVar methods for summarizing data over axes"
     ds = datasets.get_uts(utsnd=True)
@@ -1318,6 +1510,41 @@ def test_io_pickle():
     assert_dataset_equal(ds, ds2)
 
 
+def test_io_columns():
+    "Test io in columnar format"
+    ds = datasets.get_uts(utsnd=True)
+    ds.info['info'] = "Some very useful information about the Dataset"
+    ds['dl'] = Datalist(range(ds.n_cases))
+    tempdir = tempfile.mkdtemp()
+    try:
+        dest = os.path.join(tempdir, 'ds')
+        save.columns(ds, dest)
+        ds2 = load.columns(dest)
+        assert_dataset_equal(ds2, ds)
+        eq_(ds2.info, ds.info)
+        assert isinstance(ds2['utsnd'].x, np.memmap)
+        assert_raises(ValueError, ds2['utsnd'].x.__setitem__, 0, 0)
+        # copy-on-write
+        ds2 = load.columns(dest, 'c')
+        ds2['utsnd'].x[0] = 0
+        assert_dataset_equal(load.columns(dest), ds)
+        # in memory
+        ds2 = load.columns(dest, None)
+        assert not isinstance(ds2['utsnd'].x, np.memmap)
+        assert_dataset_equal(ds2, ds)
+        # single objects, overwrite
+        save.columns(ds['utsnd'], dest)
+        eq_(sorted(os.listdir(dest)), ['0.npy', 'header.pickled'])
+        assert_dataobj_equal(load.columns(dest), ds['utsnd'])
+        save.columns(ds['A'], dest)
+        assert_dataobj_equal(load.columns(dest), ds['A'])
+        # not in columnar format
+        assert_raises(IOError, load.columns, tempdir)
+        assert_raises(IOError, save.columns, ds, tempdir)
+    finally:
+        shutil.rmtree(tempdir)
+
+
 def test_io_txt():
     "Test Dataset io as text"
     ds = datasets.get_uv()
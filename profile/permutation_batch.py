@@ -0,0 +1,53 @@
+"""Compare per-permutation and batched evaluation of permutation tests
+
+Usage::
+
+    $ python permutation_batch.py [n_workers]
+
+Runs each test once with permutations evaluated one at a time
+(``PERMUTATION_BATCH_SIZE = 0``) and once with permutations evaluated in
+blocks, and checks that both produce the same permutation distribution.
+"""
+from __future__ import print_function
+import sys
+from time import time
+
+import numpy as np
+from eelbrain import Dataset, NDVar, Scalar, UTS, Var, configure, testnd
+from eelbrain._stats import testnd as testnd_module
+
+
+N_CASES = 30
+N_SOURCES = 500
+N_TIMES = 100
+SAMPLES = 1000
+BATCH_SIZES = (0, 32, 128, 512)
+
+n_workers = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+configure(n_workers=n_workers)
+
+np.random.seed(0)
+dims = ('case', Scalar('source', np.arange(N_SOURCES)),
+        UTS(0, 0.01, N_TIMES))
+ds = Dataset()
+ds['y'] = NDVar(np.random.normal(0, 1, (N_CASES, N_SOURCES, N_TIMES)), dims)
+ds['x'] = Var(np.random.normal(0, 1, N_CASES))
+
+tests = (
+    ('ttest_1samp', "testnd.ttest_1samp('y', ds=ds, samples=%i)" % SAMPLES),
+    ('corr', "testnd.corr('y', 'x', ds=ds, samples=%i)" % SAMPLES),
+)
+
+print("n_cases=%i, n_sources=%i, n_times=%i, samples=%i, n_workers=%i" %
+      (N_CASES, N_SOURCES, N_TIMES, SAMPLES, n_workers))
+for name, statement in tests:
+    dists = []
+    for batch_size in BATCH_SIZES:
+        testnd_module.PERMUTATION_BATCH_SIZE = batch_size
+        t0 = time()
+        res = eval(statement)
+        dt = time() - t0
+        dists.append(np.sort(res._cdist.dist))
+        print("%-12s batch_size=%-4i %6.2f s" % (name, batch_size, dt))
+    for dist in dists[1:]:
+        assert np.array_equal(dist, dists[0])
@@ -78,6 +78,7 @@ setup(
     },
     include_dirs=[np.get_include()],
     packages=find_packages(),
-    ext_modules=cythonize(('eelbrain/*.pyx', 'eelbrain/_stats/*.pyx')),
+    ext_modules=cythonize(('eelbrain/*.pyx', 'eelbrain/_stats/*.pyx',
+                           'eelbrain/_trf/*.pyx')),
     scripts=['bin/eelbrain'],
 )